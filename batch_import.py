@@ -0,0 +1,63 @@
+"""
+批量导入模块
+为批量处理屏幕识别图片并分块保存处方，不依赖界面，在后台线程中调用
+"""
+
+# 应用内批量识别的进程数。应用进程已加载 Kivy 和图形上下文，在其中启动进程池时，
+# spawn 方式的子进程会重新导入界面模块，fork 方式会复制带图形线程的进程，
+# 因此界面中在当前线程内顺序识别；需要多进程时在命令行中调用 OCREngine.batch_recognize
+APP_WORKERS = 1
+
+
+def import_images(ocr, db, paths, on_result=None, cancel_event=None,
+                  workers=APP_WORKERS, chunk_size=20):
+    """
+    识别图片并分块保存处方
+    
+    每块提交后已识别的处方即落库，取消时已处理的部分不会丢失；
+    重复导入同一批图片时跳过已有记录。
+    
+    Args:
+        ocr: OCREngine 实例
+        db: DatabaseManager 实例
+        paths: 图片路径列表
+        on_result: 每张图片识别后的回调 on_result(识别结果, 已处理数)，
+            结果格式见 OCREngine.iter_batch_recognize
+        cancel_event: threading.Event，设置后在下一张图片前停止
+        workers: 识别进程数，见 OCREngine.iter_batch_recognize
+        chunk_size: 每个事务保存的处方数
+    
+    Returns:
+        {'saved': 新增处方数, 'total': 图片数, 'cancelled': 是否已取消, 'error': 错误信息或None}
+    """
+    saved = 0
+    error = None
+    
+    def count_saved(info):
+        nonlocal saved
+        saved += info['inserted']
+    
+    def recognized():
+        results = ocr.iter_batch_recognize(paths, workers=workers)
+        try:
+            for done, result in enumerate(results, 1):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                if on_result is not None:
+                    on_result(result, done)
+                if result['prescription'] is not None:
+                    yield result['prescription']
+        finally:
+            results.close()
+    
+    try:
+        db.save_prescriptions(recognized(), chunk_size=chunk_size, on_chunk=count_saved, mode='skip')
+    except Exception as e:
+        error = str(e)
+    
+    return {
+        'saved': saved,
+        'total': len(paths),
+        'cancelled': cancel_event is not None and cancel_event.is_set(),
+        'error': error,
+    }
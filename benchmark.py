@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+中药处方识别整理软件 - 性能基准测试
+
+用法：
+    python benchmark.py storage [--rows N]
+    python benchmark.py ocr [--count N]
+    python benchmark.py excel [--rows N]
+    python benchmark.py excel-partitions [--rows N] [--workers N]
+    python benchmark.py startup [--screens N]
+    python benchmark.py upgrade [--rows N] [--budget 秒]
+    python benchmark.py imports [--top N] [模块 ...]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import sqlite3
+import tempfile
+import subprocess
+import threading
+import statistics
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import DatabaseManager, STORAGE_PROFILES
+from ocr_engine import OCREngine
+from excel_export import ExcelExporter
+
+
+def print_header(title):
+    """打印标题"""
+    print("\n" + "=" * 60)
+    print(f"  {title}")
+    print("=" * 60)
+
+
+def sample_prescription(i):
+    """生成第i条测试处方"""
+    return {
+        'patient_name': f'患者{i % 500}',
+        'patient_age': str(20 + i % 60),
+        'patient_gender': '男' if i % 2 else '女',
+        'formula_name': ['六味地黄丸', '四君子汤', '四物汤', '补中益气汤'][i % 4],
+        'symptoms': '头痛、眩晕、失眠多梦、腰膝酸软',
+        'diagnosis': '肾阴虚，肝阳上亢',
+        'herbs': '熟地黄 24g，山茱萸 12g，山药 12g，泽泻 9g，茯苓 9g，丹皮 9g',
+        'dosage': '7剂',
+        'usage': '水煎服，每日一剂，早晚分服',
+        'doctor_name': '李医生',
+        'hospital': '中医院',
+        'date': f'2024-{i % 12 + 1:02d}-15',
+    }
+
+
+def percentile(values, pct):
+    """计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+def bench_storage_profile(profile, rows):
+    """
+    测试单个存储配置
+    
+    写线程逐条保存处方（每条一次提交），读线程同时反复执行历史页查询，
+    记录写入吞吐和并发读延迟。
+    """
+    work_dir = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(work_dir, 'bench.db'), profile=profile)
+    
+    read_latencies = []
+    writing = threading.Event()
+    writing.set()
+    
+    def reader():
+        while writing.is_set():
+            start = time.perf_counter()
+            db.get_all_prescriptions(limit=50)
+            read_latencies.append(time.perf_counter() - start)
+        db.close_thread_connection()
+    
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    
+    start = time.perf_counter()
+    for i in range(rows):
+        db.save_prescription(sample_prescription(i))
+    elapsed = time.perf_counter() - start
+    
+    writing.clear()
+    reader_thread.join()
+    db.close()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return {
+        'inserts_per_sec': rows / elapsed,
+        'reads': len(read_latencies),
+        'read_p50_ms': statistics.median(read_latencies) * 1000 if read_latencies else 0.0,
+        'read_p95_ms': percentile(read_latencies, 95) * 1000,
+    }
+
+
+def bench_storage(args):
+    """对比各存储配置"""
+    print_header(f"存储配置基准（{args.rows} 条逐条提交 + 并发读）")
+    print(f"{'配置':<12}{'插入/秒':>12}{'读次数':>10}{'读P50(ms)':>12}{'读P95(ms)':>12}")
+    
+    for profile in STORAGE_PROFILES:
+        result = bench_storage_profile(profile, args.rows)
+        print(f"{profile:<12}{result['inserts_per_sec']:>12.1f}{result['reads']:>10}"
+              f"{result['read_p50_ms']:>12.2f}{result['read_p95_ms']:>12.2f}")
+
+
+def bench_ocr(args):
+    """处方文本解析吞吐"""
+    print_header(f"OCR文本解析基准（{args.count} 张处方）")
+    
+    ocr = OCREngine()
+    texts = [ocr._simulate_recognition().replace('张三', f'患者{i}') for i in range(args.count)]
+    
+    start = time.perf_counter()
+    for text in texts:
+        ocr.parse_prescription(text)
+    elapsed = time.perf_counter() - start
+    
+    print(f"总耗时:     {elapsed:.3f} 秒")
+    print(f"每千张:     {elapsed / args.count * 1000:.3f} 秒")
+    print(f"吞吐:       {args.count / elapsed:.1f} 张/秒")
+
+
+def run_excel_export(args):
+    """在独立进程中执行一次导出，输出耗时和峰值内存（供 excel 子命令调用）"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    prescriptions = (sample_prescription(i) for i in range(args.rows))
+    
+    start = time.perf_counter()
+    ExcelExporter().export(prescriptions, args.output, streaming=args.mode == 'streaming')
+    elapsed = time.perf_counter() - start
+    
+    # Linux 下 ru_maxrss 单位为KB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'seconds': elapsed, 'baseline_kb': baseline, 'peak_kb': peak}))
+
+
+def bench_excel(args):
+    """对比内存导出与流式导出"""
+    print_header(f"Excel导出基准（{args.rows} 行）")
+    print(f"{'模式':<12}{'行/秒':>12}{'峰值内存(MB)':>16}{'增量(MB)':>12}")
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        for mode in ('in-memory', 'streaming'):
+            # 每种模式在新进程中运行，峰值内存互不影响
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), 'excel-run', '--mode', mode,
+                 '--rows', str(args.rows), '--output', os.path.join(work_dir, f'{mode}.xlsx')],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{mode:<12}{args.rows / result['seconds']:>12.1f}"
+                  f"{result['peak_kb'] / 1024:>16.1f}"
+                  f"{(result['peak_kb'] - result['baseline_kb']) / 1024:>12.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_excel_partitions(args):
+    """对比按月分文件导出的单进程与多进程耗时，两者输出相同"""
+    print_header(f"按月分区导出基准（{args.rows} 行，12 个月）")
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        db = DatabaseManager(os.path.join(work_dir, 'bench.db'), profile='throughput')
+        db.save_prescriptions(sample_prescription(i) for i in range(args.rows))
+        exporter = ExcelExporter()
+        
+        for workers in (1, args.workers):
+            start = time.perf_counter()
+            manifest = exporter.export_by_month(
+                db, os.path.join(work_dir, f'monthly_{workers}.xlsx'),
+                layout='files', workers=workers
+            )
+            elapsed = time.perf_counter() - start
+            print(f"{workers} 进程:  {elapsed:.2f} 秒，{len(manifest['files'])} 个文件，"
+                  f"{args.rows / elapsed:.1f} 行/秒")
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_startup(args):
+    """对比启动时各屏幕各自创建服务与共用服务注册表的耗时"""
+    from services import ServiceRegistry
+    
+    # 旧方式：应用 build 一次，每个屏幕的 DatabaseManager、LLMAPI、StatisticsManager 各一次
+    opens = 1 + args.screens * 3
+    print_header(f"启动耗时基准（{args.screens} 个屏幕，旧方式 {opens} 次打开数据库）")
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(work_dir, 'bench.db')
+        
+        start = time.perf_counter()
+        DatabaseManager(db_path).close()
+        print(f"首次建库:           {(time.perf_counter() - start) * 1000:8.1f} 毫秒")
+        
+        start = time.perf_counter()
+        for _ in range(opens):
+            # 版本号清零后重新打开，即旧代码每次都执行全部建表和基础数据写入
+            conn = sqlite3.connect(db_path)
+            conn.execute('PRAGMA user_version = 0')
+            conn.close()
+            DatabaseManager(db_path).close()
+        print(f"每次完整初始化:     {(time.perf_counter() - start) * 1000:8.1f} 毫秒")
+        
+        start = time.perf_counter()
+        for _ in range(opens):
+            DatabaseManager(db_path).close()
+        print(f"按版本号跳过初始化: {(time.perf_counter() - start) * 1000:8.1f} 毫秒")
+        
+        start = time.perf_counter()
+        services = ServiceRegistry(db_path)
+        for name in ('db', 'excel', 'llm', 'stats'):
+            services.get(name)
+        services.close()
+        print(f"共用服务注册表:     {(time.perf_counter() - start) * 1000:8.1f} 毫秒")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_upgrade(args):
+    """旧版本数据库升级时打开数据库的耗时：一次回填完成与限时回填对比"""
+    print_header(f"旧数据库升级基准（{args.rows} 条处方）")
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        template = os.path.join(work_dir, 'template.db')
+        db = DatabaseManager(template, profile='throughput')
+        db.save_prescriptions(sample_prescription(i) for i in range(args.rows))
+        db.close()
+        
+        # 退回到统计计数器之前的版本（3）：统计触发器引用 date_iso，须先于该列删除
+        conn = sqlite3.connect(template)
+        for trigger in ('prescription_insert', 'prescription_delete', 'prescription_update',
+                        'distinct_insert', 'distinct_delete'):
+            conn.execute(f'DROP TRIGGER stats_{trigger}')
+        conn.execute('DROP TABLE stats_counters')
+        for column in ('date_iso', 'fingerprint'):
+            conn.execute(f'DROP INDEX idx_prescriptions_{column}')
+            conn.execute(f'ALTER TABLE prescriptions DROP COLUMN {column}')
+        conn.execute('PRAGMA user_version = 3')
+        conn.commit()
+        conn.close()
+        
+        for label, budget in (('全部回填', None), (f'限时 {args.budget} 秒', args.budget)):
+            db_path = os.path.join(work_dir, 'upgrade.db')
+            shutil.copyfile(template, db_path)
+            
+            start = time.perf_counter()
+            db = DatabaseManager(db_path, backfill_budget=budget)
+            opened = time.perf_counter() - start
+            pending = db.pending_backfills()
+            
+            start = time.perf_counter()
+            db.run_backfills()
+            remaining = time.perf_counter() - start
+            db.close()
+            os.remove(db_path)
+            
+            print(f"{label:<12} 打开 {opened:6.2f} 秒，未完成 {len(pending)} 项，"
+                  f"后续回填 {remaining:6.2f} 秒")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出
+    
+    Returns:
+        [(模块名, 层级, 自身耗时微秒, 累计耗时微秒)]，按导入完成的顺序
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def bench_imports(args):
+    """在新进程中用 -X importtime 分析模块导入耗时"""
+    for module in args.modules:
+        print_header(f"导入耗时：import {module}")
+        
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode != 0:
+            print(f"导入失败：{result.stderr.strip().splitlines()[-1]}")
+            continue
+        
+        entries = parse_importtime(result.stderr)
+        requested = {name.strip() for name in module.split(',')}
+        total = sum(cumulative for name, depth, _, cumulative in entries if depth == 0)
+        print(f"总耗时:   {total / 1000:8.1f} 毫秒（{len(entries)} 个模块）")
+        
+        print(f"\n{'累计(毫秒)':>10}{'自身(毫秒)':>12}  模块")
+        ranked = sorted(
+            (entry for entry in entries if entry[0] not in requested),
+            key=lambda entry: entry[3], reverse=True
+        )
+        for name, depth, self_us, cumulative_us in ranked[:args.top]:
+            print(f"{cumulative_us / 1000:>10.1f}{self_us / 1000:>12.1f}  {'  ' * depth}{name}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    storage_parser = subparsers.add_parser('storage', help='存储配置对比')
+    storage_parser.add_argument('--rows', type=int, default=2000)
+    storage_parser.set_defaults(func=bench_storage)
+    
+    ocr_parser = subparsers.add_parser('ocr', help='处方文本解析吞吐')
+    ocr_parser.add_argument('--count', type=int, default=5000)
+    ocr_parser.set_defaults(func=bench_ocr)
+    
+    excel_parser = subparsers.add_parser('excel', help='Excel导出吞吐与内存')
+    excel_parser.add_argument('--rows', type=int, default=20000)
+    excel_parser.set_defaults(func=bench_excel)
+    
+    partitions_parser = subparsers.add_parser('excel-partitions', help='按月分区并行导出')
+    partitions_parser.add_argument('--rows', type=int, default=20000)
+    partitions_parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    partitions_parser.set_defaults(func=bench_excel_partitions)
+    
+    startup_parser = subparsers.add_parser('startup', help='启动时创建服务的耗时')
+    startup_parser.add_argument('--screens', type=int, default=6)
+    startup_parser.set_defaults(func=bench_startup)
+    
+    upgrade_parser = subparsers.add_parser('upgrade', help='旧数据库升级耗时')
+    upgrade_parser.add_argument('--rows', type=int, default=100000)
+    upgrade_parser.add_argument('--budget', type=float, default=0.2)
+    upgrade_parser.set_defaults(func=bench_upgrade)
+    
+    imports_parser = subparsers.add_parser('imports', help='模块导入耗时（-X importtime）')
+    imports_parser.add_argument('--top', type=int, default=15)
+    imports_parser.add_argument('modules', nargs='*', default=['main'],
+                                help='要分析的模块，多个模块用逗号连接表示一起导入')
+    imports_parser.set_defaults(func=bench_imports)
+    
+    excel_run_parser = subparsers.add_parser('excel-run', help='单次导出（excel 子命令内部使用）')
+    excel_run_parser.add_argument('--mode', choices=['in-memory', 'streaming'], required=True)
+    excel_run_parser.add_argument('--rows', type=int, required=True)
+    excel_run_parser.add_argument('--output', required=True)
+    excel_run_parser.set_defaults(func=run_excel_export)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,236 @@
 
 import sqlite3
 import json
+import base64
 import datetime
+import hashlib
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
+from lexicon import SEED_HERBS, SEED_FORMULAS, get_lexicon
+
+
+# 存储配置预设，每个新连接创建时按顺序应用其中的 PRAGMA
+STORAGE_PROFILES = {
+    # 日常录入：每次提交都同步落盘
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8000,        # 负数单位为KB，约8MB
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    # 批量导入：WAL下NORMAL仅在检查点同步，断电可能丢失最近提交但不会损坏数据库
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,       # 约64MB
+        'mmap_size': 268435456,     # 256MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+DEFAULT_PROFILE = 'durable'
+
+# 结构迁移：(版本号, 说明, DatabaseManager 方法名)，按版本号依次执行。
+# 已发布的迁移不再修改，修改表结构或内置基础数据时在末尾追加新的迁移。
+MIGRATIONS = (
+    (1, '处方、药材、方剂基础表', '_migrate_base_tables'),
+    (2, '内置药材和方剂', '_migrate_base_data'),
+    (3, '处方药材明细表', '_migrate_prescription_herbs'),
+    (4, '统计计数器', '_migrate_stats_counters'),
+    (5, '全文索引', '_migrate_fulltext_index'),
+    (6, '规范化日期列', '_migrate_date_iso'),
+    (7, '处方指纹列', '_migrate_fingerprint'),
+    (8, '月度计数按规范化日期统计', '_migrate_stats_month_iso'),
+    (9, '按全部药材片段重算处方指纹', '_migrate_fingerprint_all_fragments'),
+)
+
+# 数据库结构版本，记录在 PRAGMA user_version 中
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# 可分块续跑的数据回填：名称 -> (读取的处方列, 处理一块的 DatabaseManager 方法名)
+BACKFILLS = {
+    'prescription_herbs': ('id, herbs', '_backfill_herbs_chunk'),
+    'date_iso': ('id, date', '_backfill_date_iso_chunk'),
+    'fingerprint': ('id, patient_name, date, formula_name, herbs', '_backfill_fingerprint_chunk'),
+}
+
+# 写入处方的列，顺序与 DatabaseManager._prescription_values 一致
+PRESCRIPTION_COLUMNS = (
+    'patient_name', 'patient_age', 'patient_gender', 'formula_name', 'symptoms',
+    'diagnosis', 'herbs', 'dosage', 'usage', 'doctor_name', 'hospital', 'date', 'notes',
+    'date_iso', 'fingerprint',
+)
+
+INSERT_PRESCRIPTION_SQL = f'''
+    INSERT INTO prescriptions ({', '.join(PRESCRIPTION_COLUMNS)})
+    VALUES ({', '.join('?' * len(PRESCRIPTION_COLUMNS))})
+'''
+
+UPDATE_PRESCRIPTION_SQL = f'''
+    UPDATE prescriptions 
+    SET {', '.join(f'{column} = ?' for column in PRESCRIPTION_COLUMNS)}, 
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
+# 保存模式：keep 总是新增；skip 遇到重复处方时保留原记录；update 用新内容覆盖原记录
+SAVE_MODES = ('keep', 'skip', 'update')
+
+# 参与指纹计算的字段
+FINGERPRINT_FIELDS = frozenset(('patient_name', 'date', 'formula_name', 'herbs'))
+
+# 月度计数器按此列的前7位（YYYY-MM）统计，与按月查询和导出分区一致
+STATS_MONTH_COLUMN = 'date_iso'
+
+# 统计计数器：处方增删改时由触发器维护，row 为 new 或 old，month 为月份所在列
+_STATS_ADD_SQL = '''
+    INSERT INTO stats_counters (kind, key, count) VALUES ('total', '', 1)
+    ON CONFLICT(kind, key) DO UPDATE SET count = count + 1;
+    INSERT INTO stats_counters (kind, key, count)
+    SELECT 'patient', {row}.patient_name, 1 WHERE {row}.patient_name IS NOT NULL
+    ON CONFLICT(kind, key) DO UPDATE SET count = count + 1;
+    INSERT INTO stats_counters (kind, key, count)
+    SELECT 'formula', {row}.formula_name, 1 WHERE {row}.formula_name IS NOT NULL
+    ON CONFLICT(kind, key) DO UPDATE SET count = count + 1;
+    INSERT INTO stats_counters (kind, key, count)
+    SELECT 'month', substr({row}.{month}, 1, 7), 1 WHERE {row}.{month} IS NOT NULL
+    ON CONFLICT(kind, key) DO UPDATE SET count = count + 1;
+'''
+
+_STATS_REMOVE_SQL = '''
+    UPDATE stats_counters SET count = count - 1
+    WHERE (kind = 'total' AND key = '')
+    OR (kind = 'patient' AND key = {row}.patient_name)
+    OR (kind = 'formula' AND key = {row}.formula_name)
+    OR (kind = 'month' AND key = substr({row}.{month}, 1, 7));
+    DELETE FROM stats_counters
+    WHERE count <= 0 AND (
+        (kind = 'patient' AND key = {row}.patient_name)
+        OR (kind = 'formula' AND key = {row}.formula_name)
+        OR (kind = 'month' AND key = substr({row}.{month}, 1, 7))
+    );
+'''
+
+# 从处方表重新计算全部计数器
+_STATS_AGGREGATE_SQL = '''
+    SELECT 'total' AS kind, '' AS key, COUNT(*) AS count FROM prescriptions
+    UNION ALL
+    SELECT 'patient', patient_name, COUNT(*) FROM prescriptions
+    WHERE patient_name IS NOT NULL GROUP BY patient_name
+    UNION ALL
+    SELECT 'formula', formula_name, COUNT(*) FROM prescriptions
+    WHERE formula_name IS NOT NULL GROUP BY formula_name
+    UNION ALL
+    SELECT 'month', substr({month}, 1, 7), COUNT(*) FROM prescriptions
+    WHERE {month} IS NOT NULL GROUP BY substr({month}, 1, 7)
+    UNION ALL
+    SELECT 'distinct', 'patient', COUNT(DISTINCT patient_name) FROM prescriptions
+    UNION ALL
+    SELECT 'distinct', 'formula', COUNT(DISTINCT formula_name) FROM prescriptions
+'''
+
+# 药材条目中的括号注释，如“熟地黄 24g（滋阴补肾，填精益髓）”
+_HERB_NOTE_RE = re.compile(r'[（(][^）)]*[）)]')
+_HERB_SEPARATOR_RE = re.compile(r'[，,、；;\n]')
+_HERB_ENTRY_RE = re.compile(r'([\u4e00-\u9fa5]+)\s*(?:(\d+(?:\.\d+)?)\s*(?:g|克))?')
+
+
+def parse_herbs(herbs_text):
+    """
+    解析药材文本
+    
+    Args:
+        herbs_text: 如“熟地黄 24g，山茱萸 12g”
+    
+    Returns:
+        [(药材名, 剂量克数或None, 原始文本), ...]
+    """
+    entries = []
+    if not herbs_text:
+        return entries
+    
+    for raw in _HERB_SEPARATOR_RE.split(_HERB_NOTE_RE.sub('', herbs_text)):
+        raw = raw.strip()
+        matches = list(_HERB_ENTRY_RE.finditer(raw))
+        
+        # OCR 文本常以空格分隔多味药，如“熟地黄24g 山茱萸12g”，每个片段都返回。
+        # 只按文本解析，不查词库，处方指纹不随词库变化；“后下”等煎法片段由调用方筛除
+        for match in matches:
+            name, dose = match.group(1), match.group(2)
+            entries.append((
+                name,
+                float(dose) if dose else None,
+                raw if len(matches) == 1 else match.group(0).strip()
+            ))
+    
+    return entries
+
+
+# 处方日期，如“2024-01-15”“2024/1/15”“2024年1月15日”
+_DATE_RE = re.compile(r'(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})')
+
+
+def normalize_date(date_text):
+    """
+    日期文本规范化为 YYYY-MM-DD
+    
+    Returns:
+        规范化日期，无法识别时返回None
+    """
+    match = _DATE_RE.search(date_text or '')
+    if not match:
+        return None
+    
+    try:
+        return datetime.date(*map(int, match.groups())).isoformat()
+    except ValueError:
+        return None
+
+
+def prescription_fingerprint(patient_name, date, formula_name, herbs_text):
+    """
+    计算处方指纹
+    
+    患者、日期、方剂和药材集合（不计顺序和剂量写法）都相同的处方视为重复。
+    """
+    parts = (
+        re.sub(r'\s+', '', patient_name or ''),
+        normalize_date(date) or (date or '').strip(),
+        re.sub(r'\s+', '', formula_name or ''),
+        ','.join(sorted({name for name, _, _ in parse_herbs(herbs_text)})),
+    )
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
 
 
 class DatabaseManager:
-    """数据库管理器"""
+    """
+    数据库管理器
     
-    def __init__(self, db_path=None):
+    连接按线程复用：每个线程在首次访问时打开一个长连接并一直持有，
+    sqlite3 会在连接上缓存预编译语句。连接只能在创建它的线程中使用，
+    调用方不要自行关闭，工作线程结束前调用 close_thread_connection()，
+    应用退出时调用 close() 统一释放。
+    """
+    
+    # 每个连接缓存的预编译语句数量
+    CACHED_STATEMENTS = 256
+    
+    def __init__(self, db_path=None, profile=DEFAULT_PROFILE, backfill_budget=None):
+        """
+        Args:
+            db_path: 数据库文件路径，默认为用户目录下的 tcm_prescriptions.db
+            profile: 存储配置，STORAGE_PROFILES 中的预设名或 PRAGMA 字典
+            backfill_budget: 打开时执行数据回填的最长秒数，None 表示全部完成；
+                未完成的部分可稍后调用 run_backfills() 继续
+        """
         if db_path is None:
             # 默认数据库路径
             self.db_path = os.path.join(
@@ -23,18 +244,164 @@ class DatabaseManager:
         else:
             self.db_path = db_path
         
-        self.init_database()
+        if isinstance(profile, dict):
+            self.profile = dict(profile)
+        elif profile in STORAGE_PROFILES:
+            self.profile = STORAGE_PROFILES[profile]
+        else:
+            raise ValueError(f'未知的存储配置: {profile}')
+        
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # close() 之后递增，使各线程缓存的旧连接失效
+        self._generation = 0
+        
+        self.ensure_schema(backfill_budget)
     
     def get_connection(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path)
+        """获取当前线程的数据库连接"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None and local.generation == self._generation:
+            return conn
+        
+        # check_same_thread=False 仅用于 close() 在退出时跨线程关闭连接，
+        # 连接本身始终只在创建它的线程中使用
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.CACHED_STATEMENTS
+        )
+        # 按列名访问，列名元组由 sqlite3 按语句缓存，无需逐行计算
+        conn.row_factory = sqlite3.Row
+        self._apply_profile(conn)
+        with self._lock:
+            self._connections.append(conn)
+            local.conn = conn
+            local.generation = self._generation
+        return conn
+    
+    def _apply_profile(self, conn):
+        """在新连接上应用存储配置"""
+        for pragma, value in self.profile.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+    
+    @contextmanager
+    def transaction(self):
+        """在当前线程连接上执行事务，成功提交，异常回滚"""
+        conn = self.get_connection()
+        self._local.new_herbs = []
+        with conn:
+            yield conn.cursor()
+        
+        # 提交后再把本事务登记的药材加入词库，回滚时词库不变
+        if self._local.new_herbs:
+            get_lexicon().add('herb', self._local.new_herbs)
+            self._local.new_herbs = []
+    
+    def close_thread_connection(self):
+        """关闭当前线程的连接（工作线程退出前调用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+    
+    def close(self):
+        """关闭所有线程的连接，应在工作线程停止后调用"""
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+            self._generation += 1
+        self._local.conn = None
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def ensure_schema(self, backfill_budget=None):
+        """
+        打开数据库时执行未应用的迁移和待完成的数据回填
+        
+        已是当前版本时只读取一次 user_version，然后确认全文索引可用并把数据库中的名称载入词库。
+        
+        Args:
+            backfill_budget: 数据回填的最长秒数，None 表示全部完成，
+                0 表示不回填（只读取数据的工作进程使用，回填留给应用连接）
+        
+        Returns:
+            是否执行了迁移
+        """
+        applied = self.migrate()
+        
+        conn = self.get_connection()
+        self.fts_enabled = self._fulltext_available(conn.cursor())
+        get_lexicon().sync(conn.cursor())
+        if backfill_budget is None or backfill_budget > 0:
+            self.run_backfills(time_budget=backfill_budget)
+        
+        return bool(applied)
     
     def init_database(self):
-        """初始化数据库表"""
+        """初始化数据库表（执行全部未应用的迁移和数据回填）"""
+        self.ensure_schema()
+    
+    def schema_version(self):
+        """当前数据库结构版本"""
+        return self.get_connection().execute('PRAGMA user_version').fetchone()[0]
+    
+    def migrate(self):
+        """
+        按 PRAGMA user_version 依次执行未应用的迁移
+        
+        每个迁移与新版本号、它登记的数据回填在同一个事务中提交，失败时只回滚这一个迁移。
+        事务以 BEGIN IMMEDIATE 开始，多个进程同时打开旧数据库时后到者等待写锁，
+        再读到新版本号后跳过。
+        
+        Returns:
+            本次执行的迁移版本号列表
+        """
+        if self.schema_version() >= SCHEMA_VERSION:
+            return []
+        
         conn = self.get_connection()
-        cursor = conn.cursor()
+        applied = []
         
-        # 创建处方表
+        for version, _, method in MIGRATIONS:
+            with conn:
+                # DDL 不会隐式开启事务，需要显式开始
+                conn.execute('BEGIN IMMEDIATE')
+                cursor = conn.cursor()
+                if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    continue
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_backfills (
+                        name TEXT PRIMARY KEY,
+                        last_id INTEGER NOT NULL DEFAULT 0,
+                        done INTEGER NOT NULL DEFAULT 0
+                    )
+                ''')
+                for name in getattr(self, method)(cursor) or ():
+                    self._schedule_backfill(cursor, name)
+                cursor.execute(f'PRAGMA user_version = {version}')
+            applied.append(version)
+        
+        return applied
+    
+    def _migrate_base_tables(self, cursor):
+        """处方、药材、方剂表及处方表索引"""
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS prescriptions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -100,77 +467,456 @@ class DatabaseManager:
             CREATE INDEX IF NOT EXISTS idx_prescriptions_formula 
             ON prescriptions(formula_name)
         ''')
+        # 历史记录按创建时间倒序分页
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_prescriptions_created 
+            ON prescriptions(created_at, id)
+        ''')
+    
+    def _migrate_base_data(self, cursor):
+        """
+        写入内置药材和方剂
         
-        conn.commit()
-        conn.close()
+        带详细资料的种子数据之外，词库中的其余名称也补入数据库。
+        """
+        lexicon = get_lexicon()
         
-        # 初始化基础数据
-        self.init_base_data()
-    
-    def init_base_data(self):
-        """初始化基础药材和方剂数据"""
-        # 常用中药材
-        common_herbs = [
-            ('人参', 'renshen', '补气药', '甘、微苦，微温', '大补元气，复脉固脱，补脾益肺，生津养血，安神益智', '3-9g', '实证、热证忌服'),
-            ('黄芪', 'huangqi', '补气药', '甘，微温', '补气升阳，固表止汗，利水消肿，生津养血', '9-30g', '表实邪盛、气滞湿阻忌服'),
-            ('当归', 'danggui', '补血药', '甘、辛，温', '补血活血，调经止痛，润肠通便', '6-12g', '湿盛中满、大便溏泄忌服'),
-            ('白术', 'baizhu', '补气药', '苦、甘，温', '健脾益气，燥湿利水，止汗，安胎', '6-12g', '阴虚燥渴、气滞胀闷忌服'),
-            ('茯苓', 'fuling', '利水渗湿药', '甘、淡，平', '利水渗湿，健脾，宁心', '10-15g', '虚寒精滑忌服'),
-            ('甘草', 'gancao', '补气药', '甘，平', '补脾益气，清热解毒，祛痰止咳，缓急止痛', '2-10g', '湿盛胀满、水肿者忌服'),
-            ('川芎', 'chuanxiong', '活血化瘀药', '辛，温', '活血行气，祛风止痛', '3-10g', '阴虚火旺、舌红口干者忌服'),
-            ('熟地黄', 'shudihuang', '补血药', '甘，微温', '补血滋阴，益精填髓', '9-15g', '脾胃虚弱、气滞痰多者忌服'),
-            ('白芍', 'baishao', '补血药', '苦、酸，微寒', '养血调经，敛阴止汗，柔肝止痛', '6-15g', '虚寒腹痛泄泻者慎服'),
-            ('党参', 'dangshen', '补气药', '甘，平', '健脾益肺，养血生津', '9-30g', '实证、热证忌服'),
-        ]
-        
-        # 常用方剂
-        common_formulas = [
-            ('四君子汤', 'sijunzitang', '补气剂', '人参、白术、茯苓、甘草', '益气健脾', '脾胃气虚证', '水煎服'),
-            ('四物汤', 'siwutang', '补血剂', '当归、川芎、白芍、熟地黄', '补血和血', '营血虚滞证', '水煎服'),
-            ('六味地黄丸', 'liuweidihuangwan', '补阴剂', '熟地黄、山茱萸、山药、泽泻、茯苓、丹皮', '滋阴补肾', '肾阴虚证', '蜜丸，温水送服'),
-            ('补中益气汤', 'buzhongyiqitang', '补气剂', '黄芪、人参、白术、甘草、当归、陈皮、升麻、柴胡', '补中益气，升阳举陷', '脾胃气虚、中气下陷', '水煎服'),
-            ('当归补血汤', 'dangguibuxuetang', '补血剂', '黄芪、当归', '补气生血', '血虚发热证', '水煎服'),
-        ]
+        cursor.executemany('''
+            INSERT OR IGNORE INTO herbs 
+            (name, pinyin, category, properties, functions, usage_dosage, contraindications)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', SEED_HERBS)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO formulas 
+            (name, pinyin, category, composition, functions, indications, usage)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', SEED_FORMULAS)
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor.executemany(
+            'INSERT OR IGNORE INTO herbs (name) VALUES (?)', [(name,) for name in lexicon.herbs]
+        )
+        cursor.executemany(
+            'INSERT OR IGNORE INTO formulas (name) VALUES (?)', [(name,) for name in lexicon.formulas]
+        )
+    
+    def _migrate_prescription_herbs(self, cursor):
+        """处方药材明细表，已有处方的药材由回填拆分"""
+        table_exists = self._table_exists(cursor, 'prescription_herbs')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS prescription_herbs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                prescription_id INTEGER NOT NULL REFERENCES prescriptions(id),
+                herb_id INTEGER NOT NULL REFERENCES herbs(id),
+                dose_grams REAL,
+                raw_text TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_prescription_herbs_herb 
+            ON prescription_herbs(herb_id, prescription_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_prescription_herbs_prescription 
+            ON prescription_herbs(prescription_id)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS prescription_herbs_delete
+            AFTER DELETE ON prescriptions BEGIN
+                DELETE FROM prescription_herbs WHERE prescription_id = old.id;
+            END
+        ''')
         
-        # 插入药材数据
-        for herb in common_herbs:
-            try:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO herbs 
-                    (name, pinyin, category, properties, functions, usage_dosage, contraindications)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', herb)
-            except:
-                pass
+        if not table_exists:
+            return ['prescription_herbs']
+    
+    def _migrate_stats_counters(self, cursor):
+        """统计计数器表，概览统计直接读取，无需全表聚合"""
+        # 此时还没有 date_iso 列，触发器和汇总都按原始日期统计月份，由版本 8 改为 date_iso
+        table_exists = self._table_exists(cursor, 'stats_counters')
+        self._create_stats_counters(cursor, month_column='date')
+        if not table_exists:
+            # 与创建触发器在同一事务中汇总，期间不会有写入漏计
+            self._rebuild_statistics(cursor, month_column='date')
+    
+    def _migrate_fulltext_index(self, cursor):
+        """
+        处方全文索引
         
-        # 插入方剂数据
-        for formula in common_formulas:
-            try:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO formulas 
-                    (name, pinyin, category, composition, functions, indications, usage)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', formula)
-            except:
-                pass
+        使用 FTS5 trigram 分词器（对中文按三字切分），通过触发器与
+        prescriptions 表保持同步。设备上的 SQLite 不支持 FTS5 时跳过，搜索退回 LIKE 查询。
+        """
+        if self._table_exists(cursor, 'prescriptions_fts'):
+            return
         
-        conn.commit()
-        conn.close()
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE prescriptions_fts USING fts5(
+                    patient_name, formula_name, symptoms, diagnosis, herbs,
+                    content='prescriptions', content_rowid='id',
+                    tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS prescriptions_fts_insert
+            AFTER INSERT ON prescriptions BEGIN
+                INSERT INTO prescriptions_fts
+                (rowid, patient_name, formula_name, symptoms, diagnosis, herbs)
+                VALUES (new.id, new.patient_name, new.formula_name,
+                        new.symptoms, new.diagnosis, new.herbs);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS prescriptions_fts_delete
+            AFTER DELETE ON prescriptions BEGIN
+                INSERT INTO prescriptions_fts
+                (prescriptions_fts, rowid, patient_name, formula_name, symptoms, diagnosis, herbs)
+                VALUES ('delete', old.id, old.patient_name, old.formula_name,
+                        old.symptoms, old.diagnosis, old.herbs);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS prescriptions_fts_update
+            AFTER UPDATE OF patient_name, formula_name, symptoms, diagnosis, herbs
+            ON prescriptions BEGIN
+                INSERT INTO prescriptions_fts
+                (prescriptions_fts, rowid, patient_name, formula_name, symptoms, diagnosis, herbs)
+                VALUES ('delete', old.id, old.patient_name, old.formula_name,
+                        old.symptoms, old.diagnosis, old.herbs);
+                INSERT INTO prescriptions_fts
+                (rowid, patient_name, formula_name, symptoms, diagnosis, herbs)
+                VALUES (new.id, new.patient_name, new.formula_name,
+                        new.symptoms, new.diagnosis, new.herbs);
+            END
+        ''')
+        
+        # 为已有处方建立索引
+        cursor.execute("INSERT INTO prescriptions_fts(prescriptions_fts) VALUES ('rebuild')")
     
-    def save_prescription(self, prescription):
-        """保存处方"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _migrate_date_iso(self, cursor):
+        """规范化日期列，按月统计走索引范围扫描"""
+        column_exists = self._column_exists(cursor, 'prescriptions', 'date_iso')
+        if not column_exists:
+            cursor.execute('ALTER TABLE prescriptions ADD COLUMN date_iso TEXT')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_prescriptions_date_iso 
+            ON prescriptions(date_iso)
+        ''')
         
+        if not column_exists:
+            return ['date_iso']
+    
+    def _migrate_fingerprint(self, cursor):
+        """处方指纹列，导入时按索引查重"""
+        column_exists = self._column_exists(cursor, 'prescriptions', 'fingerprint')
+        if not column_exists:
+            cursor.execute('ALTER TABLE prescriptions ADD COLUMN fingerprint TEXT')
         cursor.execute('''
-            INSERT INTO prescriptions 
-            (patient_name, patient_age, patient_gender, formula_name, symptoms, 
-             diagnosis, herbs, dosage, usage, doctor_name, hospital, date, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+            CREATE INDEX IF NOT EXISTS idx_prescriptions_fingerprint 
+            ON prescriptions(fingerprint)
+        ''')
+        
+        if not column_exists:
+            return ['fingerprint']
+    
+    def _migrate_stats_month_iso(self, cursor):
+        """
+        月度计数器改按 date_iso 统计
+        
+        原先按原始日期的前7位统计，“2024年1月15日”会计入“2024年1月”，
+        与按月查询和导出分区对不上。重建处方表上的统计触发器并重新汇总；
+        date_iso 尚在回填的处方在回填写入时由更新触发器计入。
+        """
+        for trigger in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS stats_prescription_{trigger}')
+        self._create_stats_counters(cursor)
+        self._rebuild_statistics(cursor)
+    
+    def _migrate_fingerprint_all_fragments(self, cursor):
+        """
+        重算处方指纹
+        
+        指纹改为由处方文本中的全部药材片段计算，不再查词库，
+        已存的指纹按新规则分块回填。
+        """
+        return ['fingerprint']
+    
+    def _create_stats_counters(self, cursor, month_column=STATS_MONTH_COLUMN):
+        """
+        创建统计计数器表及其触发器
+        
+        kind/key 取值：
+            total/''          处方总数
+            patient/患者名    每位患者的处方数
+            formula/方剂名    每个方剂的处方数
+            month/YYYY-MM     每月处方数，按 month_column 列统计
+            distinct/patient  患者数
+            distinct/formula  方剂种类数
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS stats_prescription_insert
+            AFTER INSERT ON prescriptions BEGIN
+                {_STATS_ADD_SQL.format(row='new', month=month_column)}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS stats_prescription_delete
+            AFTER DELETE ON prescriptions BEGIN
+                {_STATS_REMOVE_SQL.format(row='old', month=month_column)}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS stats_prescription_update
+            AFTER UPDATE OF patient_name, formula_name, {month_column} ON prescriptions BEGIN
+                {_STATS_REMOVE_SQL.format(row='old', month=month_column)}
+                {_STATS_ADD_SQL.format(row='new', month=month_column)}
+            END
+        ''')
+        # 患者、方剂首次出现或计数归零时维护去重数
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_distinct_insert
+            AFTER INSERT ON stats_counters
+            WHEN new.kind IN ('patient', 'formula') BEGIN
+                INSERT INTO stats_counters (kind, key, count) VALUES ('distinct', new.kind, 1)
+                ON CONFLICT(kind, key) DO UPDATE SET count = count + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_distinct_delete
+            AFTER DELETE ON stats_counters
+            WHEN old.kind IN ('patient', 'formula') BEGIN
+                UPDATE stats_counters SET count = count - 1
+                WHERE kind = 'distinct' AND key = old.kind;
+            END
+        ''')
+    
+    def rebuild_statistics(self):
+        """从处方表重新计算统计计数器"""
+        with self.transaction() as cursor:
+            self._rebuild_statistics(cursor)
+    
+    def _rebuild_statistics(self, cursor, month_column=STATS_MONTH_COLUMN):
+        """在给定事务中重新计算统计计数器"""
+        cursor.execute('DELETE FROM stats_counters')
+        # 去重计数由 stats_distinct_insert 触发器随明细行生成
+        cursor.execute(f'''
+            INSERT INTO stats_counters (kind, key, count)
+            SELECT * FROM ({_STATS_AGGREGATE_SQL.format(month=month_column)})
+            WHERE kind != 'distinct'
+        ''')
+    
+    def check_statistics(self):
+        """
+        校验统计计数器与处方表是否一致
+        
+        Returns:
+            不一致项列表 [(kind, key, 计数器值, 实际值), ...]，一致时为空列表
+        """
+        conn = self.get_connection()
+        
+        expected = {
+            (kind, key): count
+            for kind, key, count in conn.execute(
+                _STATS_AGGREGATE_SQL.format(month=STATS_MONTH_COLUMN)
+            )
+            if count
+        }
+        stored = {
+            (kind, key): count
+            for kind, key, count in conn.execute('SELECT kind, key, count FROM stats_counters')
+            if count
+        }
+        
+        mismatches = []
+        for kind, key in sorted(set(expected) | set(stored)):
+            actual = expected.get((kind, key), 0)
+            counter = stored.get((kind, key), 0)
+            if actual != counter:
+                mismatches.append((kind, key, counter, actual))
+        
+        return mismatches
+    
+    def _table_exists(self, cursor, name):
+        """检查表是否存在"""
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        )
+        return cursor.fetchone() is not None
+    
+    def _column_exists(self, cursor, table, column):
+        """检查列是否存在"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        return any(row[1] == column for row in cursor.fetchall())
+    
+    def _fulltext_available(self, cursor):
+        """全文索引是否存在且当前环境的 SQLite 支持 FTS5"""
+        if not self._table_exists(cursor, 'prescriptions_fts'):
+            return False
+        
+        # 数据库可能由支持 FTS5 的设备创建，确认当前环境可用
+        try:
+            cursor.execute('SELECT 1 FROM prescriptions_fts LIMIT 0')
+        except sqlite3.OperationalError:
+            return False
+        return True
+    
+    def save_prescription(self, prescription, mode='keep'):
+        """
+        保存处方
+        
+        Args:
+            prescription: 处方字典
+            mode: 遇到重复处方时的处理方式，见 SAVE_MODES
+        
+        Returns:
+            处方ID，跳过或覆盖时为原记录的ID
+        """
+        self._check_save_mode(mode)
+        values = self._prescription_values(prescription)
+        
+        with self.transaction() as cursor:
+            prescription_id = None
+            if mode != 'keep':
+                cursor.execute(
+                    'SELECT MIN(id) FROM prescriptions WHERE fingerprint = ?', (values[-1],)
+                )
+                prescription_id = cursor.fetchone()[0]
+            
+            if prescription_id is None:
+                cursor.execute(INSERT_PRESCRIPTION_SQL, values)
+                prescription_id = cursor.lastrowid
+                self._save_herb_rows(cursor, prescription_id, values[6])
+            elif mode == 'update':
+                self._overwrite_prescription(cursor, prescription_id, values)
+        
+        return prescription_id
+    
+    def save_prescriptions(self, prescriptions, chunk_size=500, on_chunk=None, mode='keep'):
+        """
+        批量保存处方
+        
+        按 chunk_size 分块，每块在一个事务内用 executemany 写入，
+        适合一次导入大量历史处方。
+        
+        Args:
+            prescriptions: 处方字典的可迭代对象，可以是生成器
+            chunk_size: 每个事务写入的条数
+            on_chunk: 每块提交后的回调，参数为
+                {'chunk': 块序号, 'rows': 条数, 'inserted': 新增条数, 'seconds': 耗时}
+            mode: 遇到重复处方时的处理方式，见 SAVE_MODES；
+                同一批内的重复处方也会合并
+        
+        Returns:
+            与输入顺序一致的处方ID列表，跳过或覆盖的位置为原记录的ID
+        """
+        self._check_save_mode(mode)
+        ids = []
+        iterator = iter(prescriptions)
+        chunk_index = 0
+        
+        while True:
+            chunk = [self._prescription_values(p) for p in islice(iterator, chunk_size)]
+            if not chunk:
+                break
+            
+            start = time.perf_counter()
+            with self.transaction() as cursor:
+                if mode == 'keep':
+                    chunk_ids = self._insert_rows(cursor, chunk)
+                    inserted = len(chunk)
+                else:
+                    chunk_ids, inserted = self._merge_rows(cursor, chunk, mode)
+            ids.extend(chunk_ids)
+            
+            if on_chunk:
+                on_chunk({
+                    'chunk': chunk_index,
+                    'rows': len(chunk),
+                    'inserted': inserted,
+                    'seconds': time.perf_counter() - start
+                })
+            chunk_index += 1
+        
+        return ids
+    
+    def _check_save_mode(self, mode):
+        """校验保存模式"""
+        if mode not in SAVE_MODES:
+            raise ValueError(f'未知的保存模式: {mode}')
+    
+    def _insert_rows(self, cursor, rows):
+        """在当前事务内批量插入处方及药材明细，返回ID列表"""
+        if not rows:
+            return []
+        
+        cursor.executemany(INSERT_PRESCRIPTION_SQL, rows)
+        # 事务内持有写锁，AUTOINCREMENT 分配的ID连续
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'prescriptions'")
+        last_id = cursor.fetchone()[0]
+        row_ids = range(last_id - len(rows) + 1, last_id + 1)
+        for prescription_id, values in zip(row_ids, rows):
+            self._save_herb_rows(cursor, prescription_id, values[6])
+        
+        return list(row_ids)
+    
+    def _merge_rows(self, cursor, rows, mode):
+        """
+        按指纹合并写入一块处方
+        
+        一次 IN 查询找出库中已有的指纹，其余处方批量插入。
+        
+        Returns:
+            (与 rows 顺序一致的ID列表, 新增条数)
+        """
+        fingerprints = list({values[-1] for values in rows})
+        existing = {}
+        # 分批查询，避免超出 SQLite 参数个数上限
+        for i in range(0, len(fingerprints), 500):
+            batch = fingerprints[i:i + 500]
+            cursor.execute(f'''
+                SELECT fingerprint, MIN(id) FROM prescriptions 
+                WHERE fingerprint IN ({', '.join('?' * len(batch))})
+                GROUP BY fingerprint
+            ''', batch)
+            existing.update(cursor.fetchall())
+        
+        # 库中没有的处方，同一指纹只插入一条；update 模式下以最后一条为准
+        new_rows = {}
+        for values in rows:
+            fingerprint = values[-1]
+            if fingerprint in existing:
+                if mode == 'update':
+                    self._overwrite_prescription(cursor, existing[fingerprint], values)
+            elif mode == 'update' or fingerprint not in new_rows:
+                new_rows[fingerprint] = values
+        
+        new_ids = self._insert_rows(cursor, list(new_rows.values()))
+        existing.update(zip(new_rows, new_ids))
+        
+        return [existing[values[-1]] for values in rows], len(new_ids)
+    
+    def _overwrite_prescription(self, cursor, prescription_id, values):
+        """用新内容覆盖已有处方并重建药材明细"""
+        cursor.execute(UPDATE_PRESCRIPTION_SQL, values + (prescription_id,))
+        cursor.execute(
+            'DELETE FROM prescription_herbs WHERE prescription_id = ?', (prescription_id,)
+        )
+        self._save_herb_rows(cursor, prescription_id, values[6])
+    
+    def _prescription_values(self, prescription):
+        """处方字典转换为插入参数"""
+        date = prescription.get('date', datetime.datetime.now().strftime('%Y-%m-%d'))
+        return (
             prescription.get('patient_name', ''),
             prescription.get('patient_age', ''),
             prescription.get('patient_gender', ''),
@@ -182,15 +928,160 @@ class DatabaseManager:
             prescription.get('usage', ''),
             prescription.get('doctor_name', ''),
             prescription.get('hospital', ''),
-            prescription.get('date', datetime.datetime.now().strftime('%Y-%m-%d')),
-            prescription.get('notes', '')
-        ))
+            date,
+            prescription.get('notes', ''),
+            normalize_date(date),
+            prescription_fingerprint(
+                prescription.get('patient_name', ''), date,
+                prescription.get('formula_name', ''), prescription.get('herbs', '')
+            )
+        )
+    
+    def _save_herb_rows(self, cursor, prescription_id, herbs_text):
+        """
+        写入处方的药材明细，须在 transaction() 中调用
         
-        conn.commit()
-        prescription_id = cursor.lastrowid
-        conn.close()
+        药材表中已有的药材直接关联；未登记的名称只有写明剂量时才加入药材表，
+        事务提交后由 transaction() 加入词库，匹配器随词库版本更新。
+        既未登记又没有剂量的片段多为煎法说明或识别错误，不加入药材表。
+        """
+        for name, dose, raw in parse_herbs(herbs_text):
+            cursor.execute('SELECT id FROM herbs WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            if row is not None:
+                herb_id = row[0]
+            elif dose is not None:
+                cursor.execute('INSERT INTO herbs (name) VALUES (?)', (name,))
+                herb_id = cursor.lastrowid
+                self._local.new_herbs.append(name)
+            else:
+                continue
+            
+            cursor.execute('''
+                INSERT INTO prescription_herbs (prescription_id, herb_id, dose_grams, raw_text)
+                VALUES (?, ?, ?, ?)
+            ''', (prescription_id, herb_id, dose, raw))
+    
+    def _schedule_backfill(self, cursor, name):
+        """登记一项从头开始的数据回填"""
+        if name not in BACKFILLS:
+            raise ValueError(f'未知的数据回填: {name}')
+        cursor.execute('''
+            INSERT INTO schema_backfills (name, last_id, done) VALUES (?, 0, 0)
+            ON CONFLICT(name) DO UPDATE SET last_id = 0, done = 0
+        ''', (name,))
+    
+    def pending_backfills(self):
+        """未完成的数据回填名称列表"""
+        rows = self.get_connection().execute(
+            'SELECT name FROM schema_backfills WHERE done = 0 ORDER BY rowid'
+        ).fetchall()
+        return [row[0] for row in rows]
+    
+    def run_backfills(self, time_budget=None, chunk_size=1000):
+        """
+        按处方ID分块执行待完成的数据回填
         
-        return prescription_id
+        每块的读取、处理结果与进度在同一个写事务中完成，中断（超时、退出、崩溃）后
+        下次调用从上次提交的位置继续。读取前先取得写锁，读到的处方在提交前不会被
+        其他连接修改，不会用旧内容算出的数据覆盖界面刚保存的修改。
+        回填期间新写入的处方已自带相应数据，重复处理无副作用。
+        
+        Args:
+            time_budget: 最长执行秒数，None 表示全部完成；至少处理一块
+            chunk_size: 每块处方数
+        
+        Returns:
+            全部回填是否已完成
+        """
+        conn = self.get_connection()
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        pending = conn.execute(
+            'SELECT name FROM schema_backfills WHERE done = 0 ORDER BY rowid'
+        ).fetchall()
+        
+        for name, in pending:
+            columns, method = BACKFILLS[name]
+            process_chunk = getattr(self, method)
+            
+            while True:
+                with self.transaction() as cursor:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    # 进度在事务内读取，另一个连接同时回填时不会重复处理同一块
+                    cursor.execute(
+                        'SELECT last_id, done FROM schema_backfills WHERE name = ?', (name,)
+                    )
+                    last_id, done = cursor.fetchone()
+                    if done:
+                        break
+                    
+                    rows = cursor.execute(f'''
+                        SELECT {columns} FROM prescriptions 
+                        WHERE id > ? ORDER BY id LIMIT ?
+                    ''', (last_id, chunk_size)).fetchall()
+                    if rows:
+                        process_chunk(cursor, rows)
+                        last_id = rows[-1][0]
+                    cursor.execute(
+                        'UPDATE schema_backfills SET last_id = ?, done = ? WHERE name = ?',
+                        (last_id, 0 if rows else 1, name)
+                    )
+                
+                if not rows:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return False
+        
+        return True
+    
+    def backfill_prescription_herbs(self, chunk_size=1000):
+        """为已有处方重建药材明细，按ID分块提交"""
+        self._backfill_now('prescription_herbs', chunk_size)
+    
+    def backfill_date_iso(self, chunk_size=1000):
+        """为已有处方补全规范化日期，按ID分块提交"""
+        self._backfill_now('date_iso', chunk_size)
+    
+    def backfill_fingerprints(self, chunk_size=1000):
+        """为已有处方计算指纹，按ID分块提交"""
+        self._backfill_now('fingerprint', chunk_size)
+    
+    def _backfill_now(self, name, chunk_size):
+        """登记一项回填并立即执行完"""
+        with self.transaction() as cursor:
+            self._schedule_backfill(cursor, name)
+        self.run_backfills(chunk_size=chunk_size)
+    
+    def _backfill_herbs_chunk(self, cursor, rows):
+        """回填：拆分一块处方的药材明细"""
+        for prescription_id, herbs_text in rows:
+            cursor.execute(
+                'DELETE FROM prescription_herbs WHERE prescription_id = ?', (prescription_id,)
+            )
+            self._save_herb_rows(cursor, prescription_id, herbs_text)
+    
+    def _backfill_date_iso_chunk(self, cursor, rows):
+        """回填：一块处方的规范化日期"""
+        cursor.executemany(
+            'UPDATE prescriptions SET date_iso = ? WHERE id = ?',
+            [(normalize_date(date), prescription_id) for prescription_id, date in rows]
+        )
+    
+    def _backfill_fingerprint_chunk(self, cursor, rows):
+        """回填：一块处方的指纹"""
+        cursor.executemany(
+            'UPDATE prescriptions SET fingerprint = ? WHERE id = ?',
+            [(prescription_fingerprint(*row[1:]), row[0]) for row in rows]
+        )
+    
+    def find_duplicates(self, prescription):
+        """查找与给定处方指纹相同的已有处方ID"""
+        values = self._prescription_values(prescription)
+        conn = self.get_connection()
+        rows = conn.execute(
+            'SELECT id FROM prescriptions WHERE fingerprint = ? ORDER BY id', (values[-1],)
+        ).fetchall()
+        return [row[0] for row in rows]
     
     def get_prescription(self, prescription_id):
         """获取单个处方"""
@@ -202,18 +1093,14 @@ class DatabaseManager:
         ''', (prescription_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return self._row_to_dict(row, cursor)
+            return self._row_to_dict(row)
         return None
     
     def get_all_prescriptions(self, limit=None, offset=None):
         """获取所有处方"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = 'SELECT * FROM prescriptions ORDER BY created_at DESC'
+        query = 'SELECT * FROM prescriptions ORDER BY created_at DESC, id DESC'
         params = []
         
         if limit:
@@ -224,21 +1111,120 @@ class DatabaseManager:
             query += ' OFFSET ?'
             params.append(offset)
         
-        cursor.execute(query, params)
+        return list(self._iter_rows(query, params))
+    
+    def iter_prescriptions(self, batch_size=500):
+        """
+        按创建时间倒序逐条产出所有处方
         
-        rows = cursor.fetchall()
-        conn.close()
+        使用 fetchmany 分批读取，内存占用与表大小无关，适合统计和导出。
+        """
+        return self._iter_rows(
+            'SELECT * FROM prescriptions ORDER BY created_at DESC, id DESC',
+            batch_size=batch_size
+        )
+    
+    def _iter_rows(self, query, params=(), batch_size=500):
+        """执行查询并按批次逐行产出字典"""
+        cursor = self.get_connection().execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield self._row_to_dict(row)
+    
+    def get_prescriptions_page(self, page_size=50, cursor=None):
+        """
+        按创建时间倒序分页获取处方
+        
+        使用 (created_at, id) 游标定位，翻到多深的页面都只需一次索引范围扫描。
+        
+        Args:
+            page_size: 每页条数
+            cursor: 上一页返回的 next_cursor，为None时获取第一页
+        
+        Returns:
+            {'records': 处方列表, 'next_cursor': 下一页游标，没有更多时为None}
+        """
+        conn = self.get_connection()
+        db_cursor = conn.cursor()
         
-        return [self._row_to_dict(row, cursor) for row in rows]
+        if cursor is None:
+            db_cursor.execute('''
+                SELECT * FROM prescriptions 
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (page_size + 1,))
+        else:
+            created_at, last_id = self._decode_cursor(cursor)
+            db_cursor.execute('''
+                SELECT * FROM prescriptions 
+                WHERE (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (created_at, last_id, page_size + 1))
+        
+        rows = db_cursor.fetchall()
+        records = [self._row_to_dict(row) for row in rows[:page_size]]
+        
+        next_cursor = None
+        if len(rows) > page_size:
+            last = records[-1]
+            next_cursor = self._encode_cursor(last['created_at'], last['id'])
+        
+        return {'records': records, 'next_cursor': next_cursor}
+    
+    def iter_prescription_pages(self, page_size=500):
+        """逐页遍历所有处方，每次产出一页处方列表"""
+        cursor = None
+        while True:
+            page = self.get_prescriptions_page(page_size, cursor)
+            if page['records']:
+                yield page['records']
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+    
+    def _encode_cursor(self, created_at, prescription_id):
+        """生成不透明的分页游标"""
+        payload = json.dumps([created_at, prescription_id]).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+    
+    def _decode_cursor(self, cursor):
+        """解析分页游标"""
+        try:
+            created_at, prescription_id = json.loads(base64.urlsafe_b64decode(cursor))
+        except (ValueError, TypeError):
+            raise ValueError(f'无效的分页游标: {cursor}')
+        return created_at, prescription_id
     
     def search_prescriptions(self, keyword):
         """搜索处方"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        return list(self.iter_search_prescriptions(keyword))
+    
+    def iter_search_prescriptions(self, keyword, batch_size=500):
+        """
+        逐条产出搜索结果
+        
+        关键词不少于3个字时走全文索引并按 bm25 相关度排序；
+        更短的关键词（trigram 无法索引）或不支持 FTS5 时使用 LIKE 查询。
+        """
+        keyword = keyword.strip()
+        
+        if self.fts_enabled and len(keyword) >= 3:
+            # 作为短语查询，转义双引号
+            phrase = '"' + keyword.replace('"', '""') + '"'
+            return self._iter_rows('''
+                SELECT p.* FROM prescriptions_fts
+                JOIN prescriptions p ON p.id = prescriptions_fts.rowid
+                WHERE prescriptions_fts MATCH ?
+                ORDER BY bm25(prescriptions_fts), p.created_at DESC
+            ''', (phrase,), batch_size)
         
         search_pattern = f'%{keyword}%'
         
-        cursor.execute('''
+        return self._iter_rows('''
             SELECT * FROM prescriptions 
             WHERE patient_name LIKE ? 
             OR formula_name LIKE ?
@@ -246,115 +1232,141 @@ class DatabaseManager:
             OR diagnosis LIKE ?
             OR herbs LIKE ?
             ORDER BY created_at DESC
-        ''', (search_pattern, search_pattern, search_pattern, search_pattern, search_pattern))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [self._row_to_dict(row, cursor) for row in rows]
+        ''', (search_pattern, search_pattern, search_pattern, search_pattern, search_pattern), batch_size)
     
     def update_prescription(self, prescription_id, updates):
         """更新处方"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # 构建更新语句
-        fields = []
-        values = []
-        
-        for key, value in updates.items():
-            if key != 'id':
-                fields.append(f'{key} = ?')
-                values.append(value)
-        
-        values.append(prescription_id)
-        
-        query = f'''
-            UPDATE prescriptions 
-            SET {', '.join(fields)}, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        '''
-        
-        cursor.execute(query, values)
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            # 构建更新语句
+            fields = []
+            values = []
+            
+            for key, value in updates.items():
+                if key not in ('id', 'date_iso', 'fingerprint'):
+                    fields.append(f'{key} = ?')
+                    values.append(value)
+            
+            if 'date' in updates:
+                fields.append('date_iso = ?')
+                values.append(normalize_date(updates['date']))
+            
+            if FINGERPRINT_FIELDS & updates.keys():
+                cursor.execute(
+                    'SELECT patient_name, date, formula_name, herbs FROM prescriptions WHERE id = ?',
+                    (prescription_id,)
+                )
+                row = cursor.fetchone()
+                if row:
+                    merged = dict(row)
+                    merged.update((key, updates[key]) for key in FINGERPRINT_FIELDS & updates.keys())
+                    fields.append('fingerprint = ?')
+                    values.append(prescription_fingerprint(
+                        merged['patient_name'], merged['date'], merged['formula_name'], merged['herbs']
+                    ))
+            
+            values.append(prescription_id)
+            
+            query = f'''
+                UPDATE prescriptions 
+                SET {', '.join(fields)}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            '''
+            
+            cursor.execute(query, values)
+            
+            if 'herbs' in updates:
+                cursor.execute(
+                    'DELETE FROM prescription_herbs WHERE prescription_id = ?', (prescription_id,)
+                )
+                self._save_herb_rows(cursor, prescription_id, updates['herbs'])
     
     def delete_prescription(self, prescription_id):
         """删除处方"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM prescriptions WHERE id = ?', (prescription_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM prescriptions WHERE id = ?', (prescription_id,))
     
     def clear_all(self):
         """清空所有处方"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM prescriptions')
-        
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM prescriptions')
     
     def get_statistics(self):
-        """获取统计数据"""
+        """获取统计数据（读取统计计数器）"""
+        current_month = datetime.datetime.now().strftime('%Y-%m')
+        
+        return {
+            'total': self._get_counter('total', ''),
+            'patients': self._get_counter('distinct', 'patient'),
+            'formulas': self._get_counter('distinct', 'formula'),
+            'monthly': self._get_counter('month', current_month)
+        }
+    
+    def _get_counter(self, kind, key):
+        """读取单个统计计数器"""
+        row = self.get_connection().execute(
+            'SELECT count FROM stats_counters WHERE kind = ? AND key = ?', (kind, key)
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def get_herb_usage_stats(self):
+        """获取药材使用统计（含该药材的处方数）"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # 总处方数
-        cursor.execute('SELECT COUNT(*) FROM prescriptions')
-        total = cursor.fetchone()[0]
-        
-        # 患者数
-        cursor.execute('SELECT COUNT(DISTINCT patient_name) FROM prescriptions')
-        patients = cursor.fetchone()[0]
-        
-        # 方剂种类
-        cursor.execute('SELECT COUNT(DISTINCT formula_name) FROM prescriptions')
-        formulas = cursor.fetchone()[0]
-        
-        # 本月新增
-        current_month = datetime.datetime.now().strftime('%Y-%m')
         cursor.execute('''
-            SELECT COUNT(*) FROM prescriptions 
-            WHERE date LIKE ?
-        ''', (f'{current_month}%',))
-        monthly = cursor.fetchone()[0]
+            SELECT h.name, COUNT(DISTINCT ph.prescription_id) as count
+            FROM prescription_herbs ph
+            JOIN herbs h ON h.id = ph.herb_id
+            GROUP BY ph.herb_id
+            ORDER BY count DESC
+        ''')
         
-        conn.close()
+        rows = cursor.fetchall()
         
-        return {
-            'total': total,
-            'patients': patients,
-            'formulas': formulas,
-            'monthly': monthly
-        }
+        return {row[0]: row[1] for row in rows}
     
-    def get_herb_usage_stats(self):
-        """获取药材使用统计"""
+    def get_herb_cooccurrence(self, herb_name, limit=20):
+        """
+        获取与指定药材同方出现的药材
+        
+        Returns:
+            {药材名: 同时出现的处方数}
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT herbs FROM prescriptions')
+        cursor.execute('''
+            SELECT other.name, COUNT(DISTINCT b.prescription_id) as count
+            FROM herbs target
+            JOIN prescription_herbs a ON a.herb_id = target.id
+            JOIN prescription_herbs b ON b.prescription_id = a.prescription_id
+            JOIN herbs other ON other.id = b.herb_id
+            WHERE target.name = ? AND b.herb_id != target.id
+            GROUP BY b.herb_id
+            ORDER BY count DESC
+            LIMIT ?
+        ''', (herb_name, limit))
+        
         rows = cursor.fetchall()
         
-        herb_counts = {}
-        for row in rows:
-            herbs_text = row[0]
-            if herbs_text:
-                # 简单的药材计数（实际应用中需要更精确的解析）
-                herbs = herbs_text.split('，')
-                for herb in herbs:
-                    herb = herb.strip()
-                    if herb:
-                        herb_counts[herb] = herb_counts.get(herb, 0) + 1
+        return {row[0]: row[1] for row in rows}
+    
+    def get_prescriptions_by_herb(self, herb_name):
+        """获取含有指定药材的处方"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
-        conn.close()
+        cursor.execute('''
+            SELECT p.* FROM prescriptions p
+            WHERE p.id IN (
+                SELECT ph.prescription_id FROM prescription_herbs ph
+                JOIN herbs h ON h.id = ph.herb_id
+                WHERE h.name = ?
+            )
+            ORDER BY p.created_at DESC
+        ''', (herb_name,))
         
-        return herb_counts
+        return [self._row_to_dict(row) for row in cursor]
     
     def get_formula_usage_stats(self):
         """获取方剂使用统计"""
@@ -362,15 +1374,12 @@ class DatabaseManager:
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT formula_name, COUNT(*) as count 
-            FROM prescriptions 
-            WHERE formula_name IS NOT NULL AND formula_name != ''
-            GROUP BY formula_name
+            SELECT key, count FROM stats_counters 
+            WHERE kind = 'formula' AND key != ''
             ORDER BY count DESC
         ''')
         
         rows = cursor.fetchall()
-        conn.close()
         
         return {row[0]: row[1] for row in rows}
     
@@ -380,23 +1389,77 @@ class DatabaseManager:
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT substr(date, 1, 7) as month, COUNT(*) as count
-            FROM prescriptions
-            WHERE date IS NOT NULL
-            GROUP BY month
-            ORDER BY month DESC
+            SELECT key, count FROM stats_counters
+            WHERE kind = 'month'
+            ORDER BY key DESC
             LIMIT ?
         ''', (months,))
         
         rows = cursor.fetchall()
-        conn.close()
         
         return {row[0]: row[1] for row in rows}
     
-    def _row_to_dict(self, row, cursor):
+    def get_month_counts(self, start_month, end_month):
+        """
+        按自然月统计处方数
+        
+        Args:
+            start_month: 起始月份 YYYY-MM（含）
+            end_month: 结束月份 YYYY-MM（含）
+        
+        Returns:
+            {YYYY-MM: 处方数}，没有处方的月份不出现
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # 只读 idx_prescriptions_date_iso 上的窗口范围，无需回表
+        cursor.execute('''
+            SELECT substr(date_iso, 1, 7) AS month, COUNT(*) FROM prescriptions
+            WHERE date_iso BETWEEN ? AND ?
+            GROUP BY month
+        ''', (f'{start_month}-01', f'{end_month}-31'))
+        
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    
+    def get_month_partitions(self):
+        """
+        列出有处方的自然月及处方数，供按月分区导出
+        
+        Returns:
+            [(YYYY-MM, 处方数)]，按月份升序；日期无法识别的处方记为 (None, 数量) 排在最后
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT substr(date_iso, 1, 7) AS month, COUNT(*) FROM prescriptions
+            GROUP BY month
+            ORDER BY month IS NULL, month
+        ''')
+        
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    
+    def iter_prescriptions_in_month(self, month, batch_size=500):
+        """
+        按日期顺序逐条产出某月的处方
+        
+        Args:
+            month: 月份 YYYY-MM，为None时产出日期无法识别的处方
+        """
+        if month is None:
+            return self._iter_rows(
+                'SELECT * FROM prescriptions WHERE date_iso IS NULL ORDER BY id',
+                batch_size=batch_size
+            )
+        return self._iter_rows(
+            'SELECT * FROM prescriptions WHERE date_iso BETWEEN ? AND ? ORDER BY date_iso, id',
+            (f'{month}-01', f'{month}-31'), batch_size=batch_size
+        )
+    
+    def _row_to_dict(self, row):
         """将数据库行转换为字典"""
-        columns = [description[0] for description in cursor.description]
-        return dict(zip(columns, row))
+        return dict(row)
     
     def get_herb_info(self, herb_name):
         """获取药材信息"""
@@ -406,10 +1469,9 @@ class DatabaseManager:
         cursor.execute('SELECT * FROM herbs WHERE name = ?', (herb_name,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return self._row_to_dict(row, cursor)
+            return self._row_to_dict(row)
         return None
     
     def get_formula_info(self, formula_name):
@@ -420,10 +1482,9 @@ class DatabaseManager:
         cursor.execute('SELECT * FROM formulas WHERE name = ?', (formula_name,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return self._row_to_dict(row, cursor)
+            return self._row_to_dict(row)
         return None
     
     def search_formulas(self, keyword):
@@ -441,6 +1502,35 @@ class DatabaseManager:
         ''', (search_pattern, search_pattern, search_pattern))
         
         rows = cursor.fetchall()
-        conn.close()
         
-        return [self._row_to_dict(row, cursor) for row in rows]
+        return [self._row_to_dict(row) for row in rows]
+
+
+def main():
+    """数据库维护命令：校验或重建统计计数器"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='处方数据库维护')
+    parser.add_argument('command', choices=['check-stats', 'rebuild-stats'])
+    parser.add_argument('--db', help='数据库路径，默认为用户目录下的 tcm_prescriptions.db')
+    args = parser.parse_args()
+    
+    with DatabaseManager(args.db) as db:
+        if args.command == 'rebuild-stats':
+            db.rebuild_statistics()
+            print('统计计数器已重建')
+        
+        mismatches = db.check_statistics()
+    
+    if not mismatches:
+        print('统计计数器与处方表一致')
+        return 0
+    
+    print(f'发现 {len(mismatches)} 项不一致：')
+    for kind, key, counter, actual in mismatches:
+        print(f'  {kind}/{key}: 计数器 {counter}，实际 {actual}')
+    return 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
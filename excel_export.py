@@ -4,40 +4,101 @@ Excel导出模块
 """
 
 import os
+import json
 import datetime
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
 from openpyxl.utils import get_column_letter
 
 
+# xlsx 单个工作表最多 1048576 行，扣除表头
+MAX_SHEET_ROWS = 1048575
+
+SHEET_TITLE = '处方记录'
+
+# 按月分区导出时日期无法识别的处方所在分区名
+UNDATED_PARTITION = '日期不详'
+
+# 按月分区导出的方式：sheets 一个工作簿每月一个工作表，files 每月一个文件
+MONTH_LAYOUTS = ('sheets', 'files')
+
+# 导出列：(处方字段, 表头, 列宽, 对齐方式)，字段 index 表示序号
+COLUMNS = [
+    ('index', '序号', 8, 'center'),
+    ('patient_name', '患者姓名', 12, 'center'),
+    ('patient_age', '年龄', 8, 'center'),
+    ('patient_gender', '性别', 8, 'center'),
+    ('date', '日期', 12, 'center'),
+    ('symptoms', '症状', 30, 'left'),
+    ('diagnosis', '诊断', 25, 'left'),
+    ('formula_name', '方剂名称', 20, 'left'),
+    ('herbs', '药材组成', 40, 'left'),
+    ('dosage', '剂量', 10, 'center'),
+    ('usage', '用法', 25, 'left'),
+    ('doctor_name', '医师', 12, 'center'),
+    ('hospital', '医院', 20, 'left'),
+    ('notes', '备注', 20, 'left'),
+]
+
+
+def row_values(index, prescription):
+    """按 COLUMNS 顺序取出一行的值"""
+    return [index if field == 'index' else prescription.get(field, '')
+            for field, _, _, _ in COLUMNS]
+
+
+def _thin_border():
+    """细线边框"""
+    side = Side(style='thin')
+    return Border(left=side, right=side, top=side, bottom=side)
+
+
+def _named_styles():
+    """
+    流式导出使用的命名样式
+    
+    每个工作簿登记一次，单元格只引用样式名，不再逐个创建字体、对齐和边框对象。
+    """
+    header = NamedStyle(name='处方表头')
+    header.font = Font(name='微软雅黑', size=11, bold=True, color='FFFFFF')
+    header.fill = PatternFill(start_color='2E7D32', end_color='2E7D32', fill_type='solid')
+    header.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    header.border = _thin_border()
+    
+    center = NamedStyle(name='处方居中')
+    center.font = Font(name='微软雅黑', size=10)
+    center.alignment = Alignment(horizontal='center', vertical='center')
+    center.border = _thin_border()
+    
+    left = NamedStyle(name='处方文本')
+    left.font = Font(name='微软雅黑', size=10)
+    left.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+    left.border = _thin_border()
+    
+    return {'header': header, 'center': center, 'left': left}
+
+
 class ExcelExporter:
     """Excel导出器"""
     
     def __init__(self):
-        self.headers = [
-            '序号',
-            '患者姓名',
-            '年龄',
-            '性别',
-            '日期',
-            '症状',
-            '诊断',
-            '方剂名称',
-            '药材组成',
-            '剂量',
-            '用法',
-            '医师',
-            '医院',
-            '备注'
-        ]
+        self.headers = [header for _, header, _, _ in COLUMNS]
     
-    def export(self, prescriptions, output_path=None):
+    def export(self, prescriptions, output_path=None, streaming=True,
+               rows_per_sheet=MAX_SHEET_ROWS):
         """
         导出处方数据到Excel
         
         Args:
-            prescriptions: 处方数据列表
+            prescriptions: 处方数据的可迭代对象，流式导出时可直接传入
+                DatabaseManager.iter_prescriptions() 等生成器
             output_path: 输出文件路径
+            streaming: True 使用只写模式逐行写出，内存占用不随行数增长；
+                False 使用在内存中构建整张表的旧方式
+            rows_per_sheet: 流式导出时每个工作表的最多行数，写满后续写到新工作表
         
         Returns:
             输出文件路径
@@ -47,6 +108,177 @@ class ExcelExporter:
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
             output_path = f'prescriptions_{timestamp}.xlsx'
         
+        if streaming:
+            self._write_workbook([(SHEET_TITLE, prescriptions)], output_path, rows_per_sheet)
+            return output_path
+        return self._export_in_memory(prescriptions, output_path)
+    
+    def export_split(self, prescriptions, output_path, rows_per_file, rows_per_sheet=MAX_SHEET_ROWS):
+        """
+        按行数拆分为多个文件导出
+        
+        每 rows_per_file 行写成一个文件：名称_001.xlsx、名称_002.xlsx 等，序号跨文件连续，
+        并在同目录写出清单 名称_manifest.json。
+        
+        Args:
+            prescriptions: 处方数据的可迭代对象
+            output_path: 输出文件路径，实际文件名在其后追加序号
+            rows_per_file: 每个文件的最多行数
+            rows_per_sheet: 每个工作表的最多行数
+        
+        Returns:
+            清单字典（见 write_manifest）
+        """
+        stem, ext = os.path.splitext(output_path)
+        iterator = iter(prescriptions)
+        files = []
+        written = 0
+        
+        while True:
+            first = next(iterator, None)
+            if first is None and files:
+                break
+            
+            chunk = () if first is None else itertools.chain(
+                [first], itertools.islice(iterator, rows_per_file - 1)
+            )
+            path = f'{stem}_{len(files) + 1:03d}{ext}'
+            sheets = self._write_workbook(
+                [(SHEET_TITLE, chunk)], path, rows_per_sheet, start_index=written + 1
+            )
+            files.append(_file_entry(path, sheets))
+            written += files[-1]['rows']
+            
+            if first is None:
+                break
+        
+        return write_manifest(f'{stem}_manifest.json', files)
+    
+    def export_by_month(self, db, output_path, layout='sheets', workers=1,
+                        rows_per_sheet=MAX_SHEET_ROWS):
+        """
+        按处方日期的自然月分区导出
+        
+        layout 为 'sheets' 时写成一个工作簿，每月一个工作表；为 'files' 时每月单独写成
+        名称_YYYY-MM.xlsx。输出格式只由 layout 决定，workers 只影响 'files' 的生成速度：
+        大于1时由多个工作进程并行生成，各进程按 db.db_path 自行打开数据库。
+        两种方式都在同目录写出清单 名称_manifest.json。
+        
+        Args:
+            db: DatabaseManager 实例
+            output_path: 输出文件路径
+            layout: 分区方式，见 MONTH_LAYOUTS
+            workers: 'files' 方式的工作进程数；单个工作簿只能顺序写入，'sheets' 方式忽略此参数
+            rows_per_sheet: 每个工作表的最多行数
+        
+        Returns:
+            清单字典（见 write_manifest）
+        
+        Raises:
+            ValueError: 不支持的分区方式
+        """
+        if layout not in MONTH_LAYOUTS:
+            raise ValueError(f'不支持的分区方式: {layout}（支持 {", ".join(MONTH_LAYOUTS)}）')
+        
+        partitions = db.get_month_partitions()
+        stem, ext = os.path.splitext(output_path)
+        
+        if layout == 'sheets':
+            sections = [
+                (month or UNDATED_PARTITION, db.iter_prescriptions_in_month(month))
+                for month, _ in partitions
+            ] or [(SHEET_TITLE, ())]
+            sheets = self._write_workbook(sections, output_path, rows_per_sheet)
+            return write_manifest(f'{stem}_manifest.json', [_file_entry(output_path, sheets)])
+        
+        jobs = [
+            (month, f'{stem}_{month or UNDATED_PARTITION}{ext}', rows_per_sheet)
+            for month, _ in partitions
+        ]
+        if workers <= 1 or len(jobs) <= 1:
+            files = [_write_month_file(db, *job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                # 大分区先提交，避免最后只剩一个进程在写最大的月份
+                largest_first = sorted(range(len(jobs)), key=lambda i: -partitions[i][1])
+                futures = {
+                    i: pool.submit(_export_month_in_worker, db.db_path, db.profile, *jobs[i])
+                    for i in largest_first
+                }
+                files = [futures[i].result() for i in range(len(jobs))]
+        
+        return write_manifest(f'{stem}_manifest.json', files)
+    
+    def _write_workbook(self, sections, output_path, rows_per_sheet, start_index=1):
+        """
+        只写模式导出，行写入后即刷到临时文件
+        
+        Args:
+            sections: [(工作表名, 处方可迭代对象)]，每段从新的工作表开始，
+                写满 rows_per_sheet 行后续写到“工作表名 (2)”等新表
+            start_index: 每段第一行的序号
+        
+        Returns:
+            [{'name': 工作表名, 'rows': 数据行数}]
+        """
+        wb = Workbook(write_only=True)
+        styles = _named_styles()
+        for style in styles.values():
+            wb.add_named_style(style)
+        
+        header_style = styles['header'].name
+        row_styles = [styles[align].name for _, _, _, align in COLUMNS]
+        sheets = []
+        
+        for title, prescriptions in sections:
+            part = 0
+            rows = rows_per_sheet
+            for index, prescription in enumerate(prescriptions, start_index):
+                if rows >= rows_per_sheet:
+                    part += 1
+                    name = title if part == 1 else f'{title} ({part})'
+                    ws = self._create_sheet(wb, name, header_style)
+                    sheets.append({'name': name, 'rows': 0})
+                    rows = 0
+                
+                ws.append([
+                    self._styled_cell(ws, value, style)
+                    for value, style in zip(row_values(index, prescription), row_styles)
+                ])
+                rows += 1
+                sheets[-1]['rows'] = rows
+            
+            if part == 0:
+                # 没有数据时保留只有表头的工作表
+                self._create_sheet(wb, title, header_style)
+                sheets.append({'name': title, 'rows': 0})
+        
+        wb.save(output_path)
+        
+        return sheets
+    
+    def _create_sheet(self, wb, title, header_style):
+        """创建带列宽、冻结窗格和表头的只写工作表"""
+        ws = wb.create_sheet(title)
+        for col, (_, _, width, _) in enumerate(COLUMNS, 1):
+            ws.column_dimensions[get_column_letter(col)].width = width
+        # 只写模式下逐行设置行高会累积在内存中，改用默认行高
+        ws.sheet_format.defaultRowHeight = 30
+        ws.sheet_format.customHeight = True
+        ws.freeze_panes = 'A2'
+        
+        ws.append([self._styled_cell(ws, header, header_style) for header in self.headers])
+        
+        return ws
+    
+    def _styled_cell(self, ws, value, style_name):
+        """创建引用命名样式的只写单元格"""
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style_name
+        return cell
+    
+    def _export_in_memory(self, prescriptions, output_path):
+        """在内存中构建整张表并逐个设置单元格样式后保存"""
         # 创建工作簿
         wb = Workbook()
         ws = wb.active
@@ -350,3 +582,56 @@ class ExcelExporter:
         wb.save(output_path)
         
         return output_path
+
+
+def _file_entry(path, sheets, partition=None):
+    """清单中的单个文件条目"""
+    entry = {
+        'path': path,
+        'rows': sum(sheet['rows'] for sheet in sheets),
+        'sheets': sheets,
+    }
+    if partition is not None:
+        entry['partition'] = partition
+    return entry
+
+
+def write_manifest(manifest_path, files):
+    """
+    写出导出清单
+    
+    Returns:
+        {'manifest': 清单路径, 'rows': 总行数, 'files': [{'path', 'rows', 'sheets', 'partition'}]}，
+        partition 仅在按月分文件导出时出现
+    """
+    manifest = {
+        'manifest': manifest_path,
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'rows': sum(entry['rows'] for entry in files),
+        'files': files,
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    
+    return manifest
+
+
+def _write_month_file(db, month, output_path, rows_per_sheet):
+    """把一个月的处方写成单独的文件，返回清单条目"""
+    sheets = ExcelExporter()._write_workbook(
+        [(month or UNDATED_PARTITION, db.iter_prescriptions_in_month(month))],
+        output_path, rows_per_sheet
+    )
+    return _file_entry(output_path, sheets, partition=month or UNDATED_PARTITION)
+
+
+def _export_month_in_worker(db_path, profile, month, output_path, rows_per_sheet):
+    """进程池任务：打开数据库并导出一个月的处方"""
+    from database import DatabaseManager
+    
+    # 只读取处方，未完成的数据回填留给应用的连接，避免多个进程争抢写锁
+    db = DatabaseManager(db_path, profile=profile, backfill_budget=0)
+    try:
+        return _write_month_file(db, month, output_path, rows_per_sheet)
+    finally:
+        db.close()
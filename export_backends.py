@@ -0,0 +1,182 @@
+"""
+导出后端模块
+按输出文件扩展名选择 Excel、CSV、JSON Lines 或 Parquet 格式导出处方
+"""
+
+import csv
+import json
+import os
+from excel_export import COLUMNS, ExcelExporter, row_values
+
+
+class ExportBackend:
+    """
+    导出后端基类
+    
+    子类声明支持的扩展名并实现 write()。处方逐条从可迭代对象中读取，
+    可以直接传入 DatabaseManager.iter_prescriptions()，不需要先整表读入内存。
+    """
+    
+    # 支持的扩展名（小写，含点号）
+    extensions = ()
+    
+    @classmethod
+    def available(cls):
+        """后端依赖是否已安装"""
+        return True
+    
+    def write(self, prescriptions, output_path):
+        """
+        写出处方
+        
+        Returns:
+            写出的处方条数
+        """
+        raise NotImplementedError
+
+
+class ExcelBackend(ExportBackend):
+    """带样式的 xlsx，使用 ExcelExporter 的流式导出"""
+    
+    extensions = ('.xlsx',)
+    
+    def write(self, prescriptions, output_path):
+        counted = _Counter(prescriptions)
+        ExcelExporter().export(counted, output_path)
+        return counted.count
+
+
+class CSVBackend(ExportBackend):
+    """CSV，表头为中文列名，带 BOM 以便 Excel 直接打开"""
+    
+    extensions = ('.csv',)
+    
+    def write(self, prescriptions, output_path):
+        count = 0
+        with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow([header for _, header, _, _ in COLUMNS])
+            for count, prescription in enumerate(prescriptions, 1):
+                writer.writerow(row_values(count, prescription))
+        return count
+
+
+class JSONLinesBackend(ExportBackend):
+    """JSON Lines，每行一个以字段名为键的对象"""
+    
+    extensions = ('.jsonl', '.ndjson')
+    
+    def write(self, prescriptions, output_path):
+        fields = [field for field, _, _, _ in COLUMNS]
+        # 复用同一个编码器，json.dumps 带参数时每次调用都会新建一个
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        count = 0
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for count, prescription in enumerate(prescriptions, 1):
+                record = dict(zip(fields, row_values(count, prescription)))
+                f.write(encode(record) + '\n')
+        return count
+
+
+class ParquetBackend(ExportBackend):
+    """
+    Parquet 列式文件，需要 pyarrow
+    
+    按 batch_size 条攒成一个行组写出，内存占用与总行数无关。
+    """
+    
+    extensions = ('.parquet',)
+    
+    def __init__(self, batch_size=50000):
+        self.batch_size = batch_size
+    
+    @classmethod
+    def available(cls):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    
+    def write(self, prescriptions, output_path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        fields = [field for field, _, _, _ in COLUMNS]
+        schema = pa.schema([
+            pa.field(field, pa.int64() if field == 'index' else pa.string())
+            for field in fields
+        ])
+        
+        count = 0
+        columns = [[] for _ in fields]
+        with pq.ParquetWriter(output_path, schema) as writer:
+            for count, prescription in enumerate(prescriptions, 1):
+                for column, value in zip(columns, row_values(count, prescription)):
+                    column.append(value)
+                if len(columns[0]) >= self.batch_size:
+                    writer.write_table(self._to_table(pa, schema, columns))
+                    columns = [[] for _ in fields]
+            if columns[0] or count == 0:
+                writer.write_table(self._to_table(pa, schema, columns))
+        return count
+    
+    def _to_table(self, pa, schema, columns):
+        """一批列数据转换为 Arrow 表，非字符串的值转为字符串"""
+        arrays = [columns[0]] + [
+            [value if value is None or isinstance(value, str) else str(value) for value in column]
+            for column in columns[1:]
+        ]
+        return pa.Table.from_arrays(
+            [pa.array(array, type=field.type) for array, field in zip(arrays, schema)],
+            schema=schema
+        )
+
+
+class _Counter:
+    """包装可迭代对象并统计已读取的条数"""
+    
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+    
+    def __iter__(self):
+        for item in self.iterable:
+            self.count += 1
+            yield item
+
+
+BACKENDS = [ExcelBackend, CSVBackend, JSONLinesBackend, ParquetBackend]
+
+
+def get_backend(output_path):
+    """
+    按扩展名选择导出后端
+    
+    Raises:
+        ValueError: 扩展名不支持或所需依赖未安装
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    for backend in BACKENDS:
+        if extension in backend.extensions:
+            if not backend.available():
+                raise ValueError(f'导出 {extension} 文件需要安装 pyarrow')
+            return backend()
+    
+    supported = ', '.join(ext for backend in BACKENDS for ext in backend.extensions)
+    raise ValueError(f'不支持的导出格式: {extension}（支持 {supported}）')
+
+
+def export_prescriptions(prescriptions, output_path):
+    """
+    按输出文件扩展名导出处方
+    
+    Args:
+        prescriptions: 处方字典的可迭代对象
+        output_path: 输出文件路径，扩展名决定格式
+    
+    Returns:
+        {'path': 输出路径, 'rows': 处方条数}
+    """
+    rows = get_backend(output_path).write(prescriptions, output_path)
+    return {'path': output_path, 'rows': rows}
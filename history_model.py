@@ -0,0 +1,171 @@
+"""
+历史记录列表数据模块
+为历史记录屏幕的 RecycleView 提供行数据，按游标分页从数据库读取，并在后台线程中执行搜索
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def record_row(record):
+    """
+    处方转换为列表行数据
+    
+    只保留列表显示需要的字段，键与 RecordItem 的属性对应，详情按 record_id 再查询。
+    """
+    return {
+        'record_id': record['id'],
+        'name_text': f"患者: {record.get('patient_name', '未知')}",
+        'formula_text': f"方剂: {record.get('formula_name', '未命名')}",
+        'date_text': f"日期: {record.get('date', '未知')}",
+    }
+
+
+class PagedRecords:
+    """
+    按创建时间倒序分页读取的处方列表
+    
+    使用 DatabaseManager.get_prescriptions_page 的 (created_at, id) 游标，
+    滚动到底部时再读取下一页，每页只查询 page_size 条。
+    """
+    
+    def __init__(self, db, page_size=50):
+        self.db = db
+        self.page_size = page_size
+        self.next_cursor = None
+        self.has_more = True
+    
+    def reset(self):
+        """回到第一页，返回第一页的行数据"""
+        self.next_cursor = None
+        self.has_more = True
+        return self.load_more()
+    
+    def load_more(self):
+        """读取下一页，没有更多记录时返回空列表"""
+        if not self.has_more:
+            return []
+        
+        page = self.db.get_prescriptions_page(self.page_size, self.next_cursor)
+        self.next_cursor = page['next_cursor']
+        self.has_more = self.next_cursor is not None
+        
+        return [record_row(record) for record in page['records']]
+
+
+def diff_rows(old, new):
+    """
+    比较新旧列表行，找出需要替换的区间
+    
+    保留相同的前缀和后缀，使 old[start:stop] = replacement 后与 new 相同，
+    RecycleView 只刷新变化的部分。
+    
+    Returns:
+        (start, stop, replacement)，两者完全相同时返回 None
+    """
+    prefix = 0
+    for old_row, new_row in zip(old, new):
+        if old_row != new_row:
+            break
+        prefix += 1
+    
+    if prefix == len(old) == len(new):
+        return None
+    
+    suffix = 0
+    limit = min(len(old), len(new)) - prefix
+    while suffix < limit and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    
+    return prefix, len(old) - suffix, new[prefix:len(new) - suffix]
+
+
+class SearchController:
+    """
+    历史记录的后台搜索
+    
+    查询在一个后台线程中执行，界面线程只提交关键词。每次提交递增查询代号，
+    后台逐条读取结果时发现代号已过期就放弃，连续输入时只有最后一次关键词的结果送达。
+    最近的查询结果按关键词缓存（LRU），处方增删后调用 invalidate() 清空。
+    """
+    
+    def __init__(self, db, deliver, limit=500, cache_size=32):
+        """
+        Args:
+            db: DatabaseManager 实例
+            deliver: 结果回调 deliver(代号, 关键词, 行数据列表, error=错误信息)，
+                后台查询时在后台线程调用；查询出错时行数据列表为 None
+            limit: 每次查询最多返回的条数
+            cache_size: 缓存的关键词数
+        """
+        self.db = db
+        self.deliver = deliver
+        self.limit = limit
+        self.cache_size = cache_size
+        self.generation = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-search')
+    
+    def submit(self, keyword):
+        """
+        提交查询，命中缓存时直接回调
+        
+        Returns:
+            本次查询的代号
+        """
+        keyword = keyword.strip()
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+            rows = self._cache.get(keyword)
+            if rows is not None:
+                self._cache.move_to_end(keyword)
+        
+        if rows is not None:
+            self.deliver(generation, keyword, rows)
+        else:
+            self._executor.submit(self._search, generation, keyword)
+        return generation
+    
+    def cancel(self):
+        """使尚未送达的查询失效"""
+        with self._lock:
+            self.generation += 1
+    
+    def invalidate(self):
+        """清空缓存并使尚未送达的查询失效"""
+        with self._lock:
+            self._cache.clear()
+            self.generation += 1
+    
+    def close(self, wait=False):
+        """停止后台线程，默认不等待进行中的查询"""
+        self.cancel()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+    
+    def _search(self, generation, keyword):
+        """后台线程：执行查询，过期时中途放弃"""
+        rows = []
+        try:
+            for record in self.db.iter_search_prescriptions(keyword):
+                if generation != self.generation:
+                    return
+                rows.append(record_row(record))
+                if len(rows) >= self.limit:
+                    break
+        except Exception as e:
+            # 线程池会吞掉异常，错误同样按代号送达，界面不会一直停在“搜索中”
+            if generation == self.generation:
+                self.deliver(generation, keyword, None, error=str(e))
+            return
+        
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._cache[keyword] = rows
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        
+        self.deliver(generation, keyword, rows)
@@ -0,0 +1,160 @@
+"""
+关键词匹配模块
+用 Aho-Corasick 自动机一次扫描文本，找出其中的症状、药材和方剂关键词
+"""
+
+from collections import deque
+from lexicon import get_lexicon
+
+
+# 症状关键词，包含“舌红少苔”这类复合词，匹配时优先取最长
+SYMPTOM_KEYWORDS = (
+    '头痛', '头晕', '眩晕', '耳鸣', '耳聋', '目赤', '目昏', '目涩',
+    '鼻塞', '流涕', '喷嚏', '咽痛', '咽痒', '咳嗽', '咳痰', '气喘',
+    '胸闷', '胸痛', '心悸', '心慌', '失眠', '多梦', '健忘', '嗜睡',
+    '口渴', '口干', '口苦', '口臭', '口疮', '牙痛', '牙龈肿痛', '胃痛',
+    '胃胀', '呕吐', '恶心', '反酸', '嗳气', '食欲不振', '腹痛', '腹胀',
+    '腹泻', '便秘', '便血', '痔疮', '脱肛', '腰痛', '腰酸', '腰重',
+    '腰冷', '尿频', '尿急', '尿痛', '尿血', '遗精', '早泄', '阳痿',
+    '性欲减退', '月经不调', '痛经', '闭经', '带下', '不孕', '乳房胀痛', '乳癖',
+    '中风', '半身不遂', '口眼歪斜', '发热', '恶寒', '怕冷', '畏寒', '汗出',
+    '无汗', '自汗', '盗汗', '身重', '身痛', '关节痛', '肌肉酸痛', '麻木',
+    '抽搐', '震颤', '烦躁', '易怒', '抑郁', '焦虑', '神疲', '乏力',
+    '倦怠', '嗜卧', '面色萎黄', '面色苍白', '面色潮红', '面色晦暗', '黄褐斑', '痤疮',
+    '舌淡', '舌红', '舌紫', '苔白', '苔黄', '苔腻', '脉浮', '脉沉',
+    '脉迟', '脉数', '脉虚', '脉实', '脉滑', '脉涩', '脉弦', '脉细',
+    '疲倦', '消化不良', '舌红少苔', '腰膝酸软', '脉细数',
+)
+
+
+class KeywordMatcher:
+    """
+    多关键词匹配器
+    
+    构建时把所有关键词编入一个 Aho-Corasick 自动机，之后每次匹配只需线性扫描一遍文本。
+    重叠的命中按“最左最长”取舍，例如“舌红少苔”不会再单独计出其中的“舌红”。
+    """
+    
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords: {类别: 关键词序列}，同一个词出现在多个类别时以先出现的为准
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]   # 以该节点结尾的关键词 (词, 类别)
+        self._link = [0]        # 沿失败链最近的一个有输出的节点
+        
+        for category, words in keywords.items():
+            for word in words:
+                self._add(word, category)
+        self._build_links()
+    
+    def _add(self, word, category):
+        """向字典树加入一个关键词"""
+        node = 0
+        for char in word:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._link.append(0)
+                self._goto[node][char] = child
+            node = child
+        
+        if self._output[node] is None:
+            self._output[node] = (word, category)
+    
+    def _build_links(self):
+        """按层构建失败指针和输出链"""
+        queue = deque(self._goto[0].values())
+        
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                
+                state = self._fail[node]
+                while state and char not in self._goto[state]:
+                    state = self._fail[state]
+                fail = self._goto[state].get(char, 0)
+                
+                self._fail[child] = fail
+                self._link[child] = fail if self._output[fail] else self._link[fail]
+    
+    def find_all(self, text, categories=None):
+        """
+        查找文本中的关键词
+        
+        Args:
+            text: 待匹配文本
+            categories: 只返回这些类别的命中，None 表示全部
+        
+        Returns:
+            [(起始位置, 关键词, 类别), ...]，按位置排列且互不重叠
+        """
+        if not text:
+            return []
+        
+        goto, fail, output, link = self._goto, self._fail, self._output, self._link
+        hits = []
+        node = 0
+        
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            
+            hit = node if output[node] else link[node]
+            while hit:
+                word, category = output[hit]
+                hits.append((end - len(word), word, category))
+                hit = link[hit]
+        
+        # 最左最长：先按起点，再按长度取不重叠的命中
+        hits.sort(key=lambda h: (h[0], -len(h[1])))
+        matches = []
+        covered = 0
+        for start, word, category in hits:
+            if start >= covered:
+                covered = start + len(word)
+                if categories is None or category in categories:
+                    matches.append((start, word, category))
+        
+        return matches
+    
+    def find(self, text, category):
+        """
+        查找某一类关键词
+        
+        Returns:
+            去重后的关键词列表，按首次出现的位置排列
+        """
+        words = (word for _, word, _ in self.find_all(text, (category,)))
+        return list(dict.fromkeys(words))
+
+
+_default_matcher = None
+_default_matcher_version = None
+
+
+def get_default_matcher():
+    """
+    获取内置症状词表和全局药材方剂词库的匹配器
+    
+    首次调用时构建，词库有新名称加入后下一次调用时重建。
+    """
+    global _default_matcher, _default_matcher_version
+    lexicon = get_lexicon()
+    version = lexicon.version
+    
+    if _default_matcher is None or _default_matcher_version != version:
+        _default_matcher = KeywordMatcher({
+            'formula': lexicon.formulas,
+            'herb': lexicon.herbs,
+            'symptom': SYMPTOM_KEYWORDS,
+        })
+        _default_matcher_version = version
+    return _default_matcher
@@ -0,0 +1,255 @@
+"""
+药材方剂词库
+OCR识别、数据库和大模型模块共用的一份去重词表
+"""
+
+import threading
+
+
+# 常用中药材名称
+HERB_NAMES = (
+    '人参', '黄芪', '当归', '白术', '茯苓', '甘草', '川芎', '熟地黄', '白芍', '党参',
+    '麦冬', '五味子', '肉桂', '附子', '干姜', '大枣', '生姜', '葱白', '豆豉', '薄荷',
+    '柴胡', '葛根', '升麻', '防风', '荆芥', '羌活', '独活', '白芷', '细辛', '藁本',
+    '苍耳子', '辛夷', '香薷', '紫苏', '桂枝', '麻黄', '桑叶', '菊花', '牛蒡子', '蝉蜕',
+    '淡豆豉', '蔓荆子', '浮萍', '木贼', '石膏', '知母', '芦根', '天花粉', '竹叶', '淡竹叶',
+    '鸭跖草', '栀子', '夏枯草', '决明子', '谷精草', '密蒙花', '青葙子', '黄芩', '黄连', '黄柏',
+    '龙胆', '秦皮', '苦参', '白鲜皮', '金银花', '连翘', '蒲公英', '紫花地丁', '野菊花', '穿心莲',
+    '大青叶', '板蓝根', '青黛', '贯众', '生地', '玄参', '丹皮', '赤芍', '紫草', '水牛角',
+    '青蒿', '白薇', '地骨皮', '银柴胡', '胡黄连', '大黄', '芒硝', '番泻叶', '芦荟', '火麻仁',
+    '郁李仁', '甘遂', '京大戟', '芫花', '商陆', '牵牛子', '巴豆', '木瓜', '威灵仙', '蕲蛇',
+    '乌梢蛇', '川乌', '草乌', '桑枝', '桑寄生', '五加皮', '香加皮', '千年健', '雪莲花', '鹿衔草',
+    '石楠叶', '藿香', '佩兰', '苍术', '厚朴', '砂仁', '白豆蔻', '草豆蔻', '草果', '薏苡仁',
+    '泽泻', '猪苓', '车前子', '滑石', '木通', '通草', '瞿麦', '萹蓄', '地肤子', '海金沙',
+    '石韦', '冬葵子', '灯心草', '茵陈', '金钱草', '虎杖', '垂盆草', '鸡骨草', '珍珠草', '吴茱萸',
+    '小茴香', '丁香', '高良姜', '花椒', '胡椒', '荜茇', '荜澄茄', '陈皮', '青皮', '枳实',
+    '枳壳', '木香', '香附', '乌药', '沉香', '檀香', '川楝子', '荔枝核', '佛手', '香橼',
+    '玫瑰花', '绿萼梅', '娑罗子', '薤白', '天仙藤', '大腹皮', '甘松', '山楂', '神曲', '麦芽',
+    '谷芽', '莱菔子', '鸡内金', '使君子', '苦楝皮', '槟榔', '南瓜子', '鹤草芽', '雷丸', '鹤虱',
+    '榧子', '大蓟', '小蓟', '地榆', '槐花', '侧柏叶', '白茅根', '苎麻根', '三七', '茜草',
+    '蒲黄', '花蕊石', '降香', '白及', '仙鹤草', '紫珠叶', '棕榈炭', '血余炭', '藕节', '炮姜',
+    '艾叶', '延胡索', '郁金', '姜黄', '乳香', '没药', '五灵脂', '丹参', '红花', '桃仁',
+    '益母草', '泽兰', '牛膝', '鸡血藤', '王不留行', '月季花', '凌霄花', '土鳖虫', '自然铜', '苏木',
+    '骨碎补', '血竭', '儿茶', '刘寄奴', '莪术', '三棱', '水蛭', '虻虫', '斑蝥', '穿山甲',
+    '半夏', '天南星', '白附子', '白芥子', '皂荚', '旋覆花', '白前', '猫爪草', '川贝母', '浙贝母',
+    '瓜蒌', '竹茹', '竹沥', '天竺黄', '海藻', '昆布', '黄药子', '海蛤壳', '海浮石', '瓦楞子',
+    '礞石', '杏仁', '紫苏子', '百部', '紫菀', '款冬花', '马兜铃', '枇杷叶', '桑白皮', '葶苈子',
+    '白果', '矮地茶', '洋金花', '华山参', '罗汉果', '满山红', '朱砂', '磁石', '龙骨', '琥珀',
+    '酸枣仁', '柏子仁', '远志', '合欢皮', '首乌藤', '灵芝', '缬草', '麝香', '冰片', '苏合香',
+    '石菖蒲', '蟾酥', '樟脑', '牛黄', '珍珠', '天麻', '钩藤', '石决明', '刺蒺藜', '罗布麻叶',
+    '珍珠母', '牡蛎', '赭石', '羚羊角', '地龙', '全蝎', '蜈蚣', '僵蚕',
+)
+
+# 常用方剂名称
+FORMULA_NAMES = (
+    '四君子汤', '四物汤', '六味地黄丸', '补中益气汤', '当归补血汤',
+    '归脾汤', '炙甘草汤', '生脉散', '玉屏风散', '参苓白术散',
+    '理中丸', '小建中汤', '大建中汤', '吴茱萸汤', '四逆汤',
+    '当归四逆汤', '黄芪桂枝五物汤', '阳和汤', '小柴胡汤', '大柴胡汤',
+    '逍遥散', '加味逍遥散', '半夏泻心汤', '白虎汤', '清营汤',
+    '黄连解毒汤', '凉膈散', '普济消毒饮', '导赤散', '龙胆泻肝汤',
+    '清胃散', '玉女煎', '芍药汤', '白头翁汤', '青蒿鳖甲汤',
+    '香薷散', '六一散', '清暑益气汤', '麻黄汤', '桂枝汤',
+    '小青龙汤', '大青龙汤', '九味羌活汤', '银翘散', '桑菊饮',
+    '麻黄杏仁甘草石膏汤', '败毒散', '再造散', '加减葳蕤汤', '大承气汤',
+    '小承气汤', '调胃承气汤', '大黄牡丹汤', '温脾汤', '麻子仁丸',
+    '济川煎', '十枣汤', '黄龙汤', '蒿芩清胆汤', '达原饮',
+    '四逆散',
+)
+
+# 带详细资料的基础药材：(名称, 拼音, 分类, 性味, 功效, 用法用量, 禁忌)
+SEED_HERBS = [
+    ('人参', 'renshen', '补气药', '甘、微苦，微温', '大补元气，复脉固脱，补脾益肺，生津养血，安神益智', '3-9g', '实证、热证忌服'),
+    ('黄芪', 'huangqi', '补气药', '甘，微温', '补气升阳，固表止汗，利水消肿，生津养血', '9-30g', '表实邪盛、气滞湿阻忌服'),
+    ('当归', 'danggui', '补血药', '甘、辛，温', '补血活血，调经止痛，润肠通便', '6-12g', '湿盛中满、大便溏泄忌服'),
+    ('白术', 'baizhu', '补气药', '苦、甘，温', '健脾益气，燥湿利水，止汗，安胎', '6-12g', '阴虚燥渴、气滞胀闷忌服'),
+    ('茯苓', 'fuling', '利水渗湿药', '甘、淡，平', '利水渗湿，健脾，宁心', '10-15g', '虚寒精滑忌服'),
+    ('甘草', 'gancao', '补气药', '甘，平', '补脾益气，清热解毒，祛痰止咳，缓急止痛', '2-10g', '湿盛胀满、水肿者忌服'),
+    ('川芎', 'chuanxiong', '活血化瘀药', '辛，温', '活血行气，祛风止痛', '3-10g', '阴虚火旺、舌红口干者忌服'),
+    ('熟地黄', 'shudihuang', '补血药', '甘，微温', '补血滋阴，益精填髓', '9-15g', '脾胃虚弱、气滞痰多者忌服'),
+    ('白芍', 'baishao', '补血药', '苦、酸，微寒', '养血调经，敛阴止汗，柔肝止痛', '6-15g', '虚寒腹痛泄泻者慎服'),
+    ('党参', 'dangshen', '补气药', '甘，平', '健脾益肺，养血生津', '9-30g', '实证、热证忌服'),
+]
+
+# 带详细资料的基础方剂：(名称, 拼音, 分类, 组成, 功效, 主治, 用法)
+SEED_FORMULAS = [
+    ('四君子汤', 'sijunzitang', '补气剂', '人参、白术、茯苓、甘草', '益气健脾', '脾胃气虚证', '水煎服'),
+    ('四物汤', 'siwutang', '补血剂', '当归、川芎、白芍、熟地黄', '补血和血', '营血虚滞证', '水煎服'),
+    ('六味地黄丸', 'liuweidihuangwan', '补阴剂', '熟地黄、山茱萸、山药、泽泻、茯苓、丹皮', '滋阴补肾', '肾阴虚证', '蜜丸，温水送服'),
+    ('补中益气汤', 'buzhongyiqitang', '补气剂', '黄芪、人参、白术、甘草、当归、陈皮、升麻、柴胡', '补中益气，升阳举陷', '脾胃气虚、中气下陷', '水煎服'),
+    ('当归补血汤', 'dangguibuxuetang', '补血剂', '黄芪、当归', '补气生血', '血虚发热证', '水煎服'),
+]
+
+CATEGORIES = ('herb', 'formula')
+
+_pinyin_module = None
+
+
+def to_pinyin(name):
+    """
+    汉字名称转为不带声调的拼音
+    
+    依赖可选的 pypinyin，未安装时返回None
+    """
+    global _pinyin_module
+    if _pinyin_module is None:
+        try:
+            import pypinyin
+            _pinyin_module = pypinyin
+        except ImportError:
+            _pinyin_module = False
+    
+    if not _pinyin_module:
+        return None
+    return ''.join(_pinyin_module.lazy_pinyin(name))
+
+
+class _Trie:
+    """前缀树，节点上记录以该路径结尾的名称"""
+    
+    def __init__(self):
+        self.root = {}
+    
+    def insert(self, key, value):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault('', set()).add(value)
+    
+    def prefix(self, key):
+        """返回所有以 key 开头的键对应的名称"""
+        node = self.root
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                return set()
+        
+        values = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == '':
+                    values |= child
+                else:
+                    stack.append(child)
+        return values
+
+
+class Lexicon:
+    """
+    药材方剂词库
+    
+    名称存放在 frozenset 中，查找为 O(1)；名称和拼音各建一棵前缀树用于补全。
+    词库只增不减，每次有新名称加入时 version 加一，依赖词库构建的缓存据此判断是否过期。
+    """
+    
+    def __init__(self):
+        self.herbs = frozenset()
+        self.formulas = frozenset()
+        self.version = 0
+        self._name_trie = _Trie()
+        self._pinyin_trie = _Trie()
+        self._lock = threading.Lock()
+    
+    def add(self, category, names, pinyins=None):
+        """
+        加入名称
+        
+        Args:
+            category: 'herb' 或 'formula'
+            names: 名称序列
+            pinyins: {名称: 拼音}，缺省时尝试用 pypinyin 生成
+        
+        Returns:
+            新加入的名称数
+        """
+        if category not in CATEGORIES:
+            raise ValueError(f'未知词库类别: {category}')
+        
+        pinyins = pinyins or {}
+        with self._lock:
+            known = self.herbs if category == 'herb' else self.formulas
+            new_names = [name for name in dict.fromkeys(names) if name and name not in known]
+            if not new_names:
+                return 0
+            
+            for name in new_names:
+                self._name_trie.insert(name, name)
+                pinyin = pinyins.get(name) or to_pinyin(name)
+                if pinyin:
+                    self._pinyin_trie.insert(pinyin.lower(), name)
+            
+            if category == 'herb':
+                self.herbs = known | frozenset(new_names)
+            else:
+                self.formulas = known | frozenset(new_names)
+            self.version += 1
+        
+        return len(new_names)
+    
+    def is_herb(self, name):
+        """是否为已知药材"""
+        return name in self.herbs
+    
+    def is_formula(self, name):
+        """是否为已知方剂"""
+        return name in self.formulas
+    
+    def complete(self, prefix, category=None, limit=10):
+        """
+        按名称或拼音前缀补全
+        
+        Args:
+            prefix: 汉字或拼音前缀，如“熟地”“shudi”
+            category: 'herb' / 'formula'，None 表示不限
+            limit: 最多返回条数
+        
+        Returns:
+            按名称长度、字典序排列的名称列表
+        """
+        if not prefix:
+            return []
+        
+        names = self._name_trie.prefix(prefix) | self._pinyin_trie.prefix(prefix.lower())
+        if category == 'herb':
+            names &= self.herbs
+        elif category == 'formula':
+            names &= self.formulas
+        
+        return sorted(names, key=lambda name: (len(name), name))[:limit]
+    
+    def sync(self, cursor):
+        """
+        从数据库 herbs / formulas 表加载名称
+        
+        Args:
+            cursor: 数据库游标
+        
+        Returns:
+            新加入的名称数
+        """
+        added = 0
+        for category, table in (('herb', 'herbs'), ('formula', 'formulas')):
+            cursor.execute(f'SELECT name, pinyin FROM {table}')
+            rows = cursor.fetchall()
+            added += self.add(category, [row[0] for row in rows],
+                              {row[0]: row[1] for row in rows if row[1]})
+        return added
+
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+def get_lexicon():
+    """获取全局词库，首次调用时用内置词表初始化"""
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                lexicon = Lexicon()
+                lexicon.add('herb', HERB_NAMES, {row[0]: row[1] for row in SEED_HERBS})
+                lexicon.add('formula', FORMULA_NAMES, {row[0]: row[1] for row in SEED_FORMULAS})
+                _lexicon = lexicon
+    return _lexicon
@@ -7,15 +7,22 @@ import os
 import json
 import sqlite3
 from database import DatabaseManager
+from keyword_matcher import get_default_matcher
 
 
 class LLMAPI:
     """大模型API接口"""
     
-    def __init__(self, api_key=None, api_base=None):
+    def __init__(self, api_key=None, api_base=None, db=None):
+        """
+        Args:
+            api_key: API密钥，默认读取环境变量 OPENAI_API_KEY
+            api_base: API地址，默认读取环境变量 OPENAI_API_BASE
+            db: 共用的 DatabaseManager，为None时自行创建
+        """
         self.api_key = api_key or os.getenv('OPENAI_API_KEY', '')
         self.api_base = api_base or os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
-        self.db = DatabaseManager()
+        self.db = db if db is not None else DatabaseManager()
         
         # 中医知识库提示词
         self.tcm_system_prompt = """你是一位经验丰富的中医专家，精通中医理论和临床实践。
@@ -289,7 +296,6 @@ class LLMAPI:
         for row in cursor.fetchall():
             formulas.append(dict(zip(columns, row)))
         
-        conn.close()
         return formulas
     
     def parse_diagnosis_result(self, result_text):
@@ -306,8 +312,10 @@ class LLMAPI:
         # 提取方剂名称
         if '【处方】' in result_text:
             lines = result_text.split('【处方】')[1].split('【')[0].strip().split('\n')
+            matcher = get_default_matcher()
             for line in lines:
-                if '汤' in line or '丸' in line or '散' in line:
+                # 词库中的方名可识别“桑菊饮”“济川煎”等不以汤丸散结尾的方剂
+                if '汤' in line or '丸' in line or '散' in line or matcher.find(line, 'formula'):
                     prescription['formula_name'] = line.strip()
                     break
         
@@ -10,52 +10,67 @@ TCM Prescription Recognition and Management App
 
 import os
 import json
-import sqlite3
 import datetime
-from pathlib import Path
+import threading
 
 from kivy.app import App
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
-from kivy.uix.scrollview import ScrollView
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
 from kivy.uix.image import Image
 from kivy.uix.popup import Popup
-from kivy.uix.filechooser import FileChooserListView
-from kivy.uix.camera import Camera
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.core.window import Window
-from kivy.properties import StringProperty, ListProperty, ObjectProperty
-from kivy.graphics import Color, Rectangle, Line
+from kivy.properties import NumericProperty, StringProperty
+from kivy.graphics import Color, Rectangle
 from kivy.clock import Clock
-from kivy.utils import platform
 
-# 数据库管理
-from database import DatabaseManager
-# OCR识别
-from ocr_engine import OCREngine
-# Excel导出
-from excel_export import ExcelExporter
-# 大模型API
-from llm_api import LLMAPI
-# 统计分析
-from statistics_manager import StatisticsManager
+# 共用服务（数据库、OCR、Excel导出、大模型API、统计分析），
+# 各服务的模块在首次使用时才导入，不影响首屏启动
+from services import get_services
+# 历史记录列表分页数据
+from history_model import PagedRecords, SearchController, diff_rows
+# 批量识别并保存处方
+from batch_import import import_images
 
 # 设置窗口大小（用于桌面测试）
 Window.size = (400, 700)
 
 
 class BaseScreen(Screen):
-    """基础屏幕类"""
+    """基础屏幕类，各服务在所有屏幕间共用，首次使用时创建"""
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.db = DatabaseManager()
-        self.ocr = OCREngine()
-        self.excel = ExcelExporter()
-        self.llm = LLMAPI()
-        self.stats = StatisticsManager()
+        self.services = get_services()
+    
+    @property
+    def db(self):
+        return self.services.db
+    
+    @property
+    def ocr(self):
+        return self.services.ocr
+    
+    @property
+    def excel(self):
+        return self.services.excel
+    
+    @property
+    def llm(self):
+        return self.services.llm
+    
+    @property
+    def stats(self):
+        return self.services.stats
+    
+    def go_to(self, screen_name):
+        """切换到指定屏幕"""
+        self.manager.current = screen_name
 
 
 class HomeScreen(BaseScreen):
@@ -98,7 +113,7 @@ class HomeScreen(BaseScreen):
             font_size='18sp',
             size_hint_y=0.25,
             background_color=(0.3, 0.7, 0.5, 1),
-            on_press=lambda x: self.manager.current = 'scan'
+            on_press=lambda x: self.go_to('scan')
         )
         btn_layout.add_widget(btn_scan)
         
@@ -107,7 +122,7 @@ class HomeScreen(BaseScreen):
             font_size='18sp',
             size_hint_y=0.25,
             background_color=(0.3, 0.7, 0.5, 1),
-            on_press=lambda x: self.manager.current = 'history'
+            on_press=lambda x: self.go_to('history')
         )
         btn_layout.add_widget(btn_history)
         
@@ -116,7 +131,7 @@ class HomeScreen(BaseScreen):
             font_size='18sp',
             size_hint_y=0.25,
             background_color=(0.3, 0.7, 0.5, 1),
-            on_press=lambda x: self.manager.current = 'statistics'
+            on_press=lambda x: self.go_to('statistics')
         )
         btn_layout.add_widget(btn_stats)
         
@@ -125,7 +140,7 @@ class HomeScreen(BaseScreen):
             font_size='18sp',
             size_hint_y=0.25,
             background_color=(0.3, 0.7, 0.5, 1),
-            on_press=lambda x: self.manager.current = 'diagnosis'
+            on_press=lambda x: self.go_to('diagnosis')
         )
         btn_layout.add_widget(btn_diagnosis)
         
@@ -162,7 +177,7 @@ class ScanScreen(BaseScreen):
         back_btn = Button(
             text='← 返回',
             size_hint_x=0.2,
-            on_press=lambda x: self.manager.current = 'home'
+            on_press=lambda x: self.go_to('home')
         )
         header.add_widget(back_btn)
         
@@ -262,6 +277,9 @@ class ScanScreen(BaseScreen):
     
     def open_gallery(self, instance):
         """打开相册"""
+        # 文件选择器只在打开相册时导入
+        from kivy.uix.filechooser import FileChooserListView
+        
         # 创建文件选择器
         content = BoxLayout(orientation='vertical')
         filechooser = FileChooserListView(
@@ -318,7 +336,7 @@ class ScanScreen(BaseScreen):
     
     def batch_process(self, instance):
         """批量处理"""
-        self.manager.current = 'batch'
+        self.go_to('batch')
     
     def show_popup(self, title, message):
         """显示弹窗"""
@@ -335,6 +353,8 @@ class BatchProcessScreen(BaseScreen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.selected_files = []
+        self.worker = None
+        self.cancel_event = threading.Event()
         self.build_ui()
     
     def build_ui(self):
@@ -345,7 +365,7 @@ class BatchProcessScreen(BaseScreen):
         back_btn = Button(
             text='← 返回',
             size_hint_x=0.2,
-            on_press=lambda x: self.manager.current = 'scan'
+            on_press=lambda x: self.go_to('scan')
         )
         header.add_widget(back_btn)
         
@@ -396,13 +416,13 @@ class BatchProcessScreen(BaseScreen):
         )
         btn_layout.add_widget(select_btn)
         
-        process_btn = Button(
+        self.process_btn = Button(
             text='▶️ 开始处理',
             font_size='16sp',
             background_color=(0.3, 0.7, 0.5, 1),
             on_press=self.start_processing
         )
-        btn_layout.add_widget(process_btn)
+        btn_layout.add_widget(self.process_btn)
         
         export_btn = Button(
             text='📊 导出Excel',
@@ -418,6 +438,8 @@ class BatchProcessScreen(BaseScreen):
     
     def select_files(self, instance):
         """选择多个文件"""
+        from kivy.uix.filechooser import FileChooserListView
+        
         content = BoxLayout(orientation='vertical')
         filechooser = FileChooserListView(
             path=os.path.expanduser('~'),
@@ -448,31 +470,64 @@ class BatchProcessScreen(BaseScreen):
         popup.open()
     
     def start_processing(self, instance):
-        """开始批量处理"""
+        """开始批量处理，处理中再次点击则取消"""
+        if self.worker and self.worker.is_alive():
+            self.cancel_event.set()
+            self.process_btn.text = '正在取消...'
+            return
+        
         if not self.selected_files:
             self.show_popup('错误', '请先选择文件')
             return
         
-        results = []
-        total = len(self.selected_files)
-        
-        for i, file_path in enumerate(self.selected_files):
-            self.progress_label.text = f'进度: {i+1}/{total}'
-            
-            # 识别文字
-            text = self.ocr.recognize(file_path)
-            
-            # 解析处方
-            prescription = self.ocr.parse_prescription(text)
-            
-            # 保存到数据库
-            self.db.save_prescription(prescription)
-            
-            results.append(prescription)
-        
-        # 显示结果
-        self.result_text.text = json.dumps(results, ensure_ascii=False, indent=2)
-        self.show_popup('完成', f'已处理 {total} 个处方')
+        files = list(self.selected_files)
+        self.cancel_event.clear()
+        self.result_text.text = ''
+        self.progress_label.text = f'进度: 0/{len(files)}'
+        self.process_btn.text = '⏹ 取消处理'
+        
+        # 识别、解析、保存都在后台线程进行，界面只接收进度
+        self.worker = threading.Thread(target=self._process_files, args=(files,), daemon=True)
+        self.worker.start()
+    
+    def _process_files(self, files):
+        """后台线程：识别文件并分块保存"""
+        total = len(files)
+        try:
+            outcome = import_images(
+                self.ocr, self.db, files, cancel_event=self.cancel_event,
+                on_result=lambda result, done: Clock.schedule_once(
+                    lambda dt: self._on_result(result, done, total)
+                )
+            )
+        finally:
+            self.db.close_thread_connection()
+        
+        Clock.schedule_once(lambda dt: self._on_finished(
+            outcome['saved'], total, outcome['cancelled'], outcome['error']
+        ))
+    
+    def _on_result(self, result, done, total):
+        """主线程：显示单个文件的处理结果"""
+        self.progress_label.text = f'进度: {done}/{total}'
+        
+        name = os.path.basename(result['path'])
+        if result['error']:
+            entry = f'{name}: {result["error"]}'
+        else:
+            entry = f'{name}:\n' + json.dumps(result['prescription'], ensure_ascii=False, indent=2)
+        self.result_text.text += entry + '\n'
+    
+    def _on_finished(self, saved, total, cancelled, error):
+        """主线程：批量处理结束"""
+        self.process_btn.text = '▶️ 开始处理'
+        
+        if error:
+            self.show_popup('错误', f'处理失败: {error}\n已新增 {saved} 个处方')
+        elif cancelled:
+            self.show_popup('已取消', f'已新增 {saved} 个处方')
+        else:
+            self.show_popup('完成', f'已处理 {total} 个处方，新增 {saved} 个')
     
     def export_excel(self, instance):
         """导出Excel"""
@@ -480,12 +535,9 @@ class BatchProcessScreen(BaseScreen):
             self.show_popup('错误', '没有可导出的数据')
             return
         
-        # 获取所有处方数据
-        prescriptions = self.db.get_all_prescriptions()
-        
-        # 导出为Excel
+        # 逐批读取处方流式导出为Excel
         output_path = os.path.join(os.path.expanduser('~'), 'prescriptions.xlsx')
-        self.excel.export(prescriptions, output_path)
+        self.excel.export(self.db.iter_prescriptions(), output_path)
         
         self.show_popup('成功', f'Excel已保存到: {output_path}')
     
@@ -498,10 +550,90 @@ class BatchProcessScreen(BaseScreen):
         popup.open()
 
 
+class RecordItem(RecycleDataViewBehavior, BoxLayout):
+    """历史记录列表的一行，由 RecycleView 按可见区域创建并复用"""
+    record_id = NumericProperty(0)
+    name_text = StringProperty('')
+    formula_text = StringProperty('')
+    date_text = StringProperty('')
+    
+    def __init__(self, **kwargs):
+        super().__init__(padding=5, **kwargs)
+        
+        with self.canvas.before:
+            Color(0.95, 0.95, 0.95, 1)
+            rect = Rectangle(size=self.size, pos=self.pos)
+        self.bind(size=lambda obj, val: setattr(rect, 'size', val))
+        self.bind(pos=lambda obj, val: setattr(rect, 'pos', val))
+        
+        info_layout = BoxLayout(orientation='vertical', size_hint_x=0.7)
+        
+        name_label = Label(font_size='14sp', halign='left', text_size=(None, None))
+        self.bind(name_text=name_label.setter('text'))
+        info_layout.add_widget(name_label)
+        
+        formula_label = Label(
+            font_size='12sp',
+            halign='left',
+            text_size=(None, None),
+            color=(0.5, 0.5, 0.5, 1)
+        )
+        self.bind(formula_text=formula_label.setter('text'))
+        info_layout.add_widget(formula_label)
+        
+        date_label = Label(
+            font_size='11sp',
+            halign='left',
+            text_size=(None, None),
+            color=(0.6, 0.6, 0.6, 1)
+        )
+        self.bind(date_text=date_label.setter('text'))
+        info_layout.add_widget(date_label)
+        
+        self.add_widget(info_layout)
+        
+        # 操作按钮
+        btn_layout = BoxLayout(orientation='vertical', size_hint_x=0.3, spacing=2)
+        
+        view_btn = Button(
+            text='查看',
+            font_size='12sp',
+            on_press=lambda x: self.history_screen().view_record(self.record_id)
+        )
+        btn_layout.add_widget(view_btn)
+        
+        delete_btn = Button(
+            text='删除',
+            font_size='12sp',
+            background_color=(0.9, 0.4, 0.4, 1),
+            on_press=lambda x: self.history_screen().delete_record(self.record_id)
+        )
+        btn_layout.add_widget(delete_btn)
+        
+        self.add_widget(btn_layout)
+    
+    def history_screen(self):
+        return App.get_running_app().root.get_screen('history')
+
+
 class HistoryScreen(BaseScreen):
     """历史记录屏幕"""
+    # 每页记录数
+    PAGE_SIZE = 50
+    # 滚动到距底部该比例以内时加载下一页
+    LOAD_MORE_THRESHOLD = 0.1
+    # 停止输入该秒数后再搜索
+    SEARCH_DELAY = 0.3
+    # 搜索结果最多显示的条数
+    SEARCH_LIMIT = 500
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.source = PagedRecords(self.db, self.PAGE_SIZE)
+        self.search = SearchController(self.db, self._on_search_done, limit=self.SEARCH_LIMIT)
+        self.searching = False
+        # 每次输入重新计时，停顿后才提交查询
+        self._search_trigger = Clock.create_trigger(self.run_search, self.SEARCH_DELAY)
         self.build_ui()
     
     def build_ui(self):
@@ -512,7 +644,7 @@ class HistoryScreen(BaseScreen):
         back_btn = Button(
             text='← 返回',
             size_hint_x=0.2,
-            on_press=lambda x: self.manager.current = 'home'
+            on_press=lambda x: self.go_to('home')
         )
         header.add_widget(back_btn)
         
@@ -526,7 +658,7 @@ class HistoryScreen(BaseScreen):
         refresh_btn = Button(
             text='🔄',
             size_hint_x=0.2,
-            on_press=self.load_records
+            on_press=self.refresh_records
         )
         header.add_widget(refresh_btn)
         
@@ -537,8 +669,10 @@ class HistoryScreen(BaseScreen):
         self.search_input = TextInput(
             hint_text='搜索患者姓名或方剂...',
             size_hint_x=0.7,
-            font_size='14sp'
+            font_size='14sp',
+            multiline=False
         )
+        self.search_input.bind(text=self.on_search_text, on_text_validate=self.search_records)
         search_layout.add_widget(self.search_input)
         
         search_btn = Button(
@@ -550,13 +684,27 @@ class HistoryScreen(BaseScreen):
         
         layout.add_widget(search_layout)
         
-        # 记录列表
-        self.records_layout = GridLayout(cols=1, spacing=5, size_hint_y=None)
-        self.records_layout.bind(minimum_height=self.records_layout.setter('height'))
+        self.status_label = Label(
+            text='',
+            font_size='12sp',
+            size_hint_y=0.04,
+            color=(0.5, 0.5, 0.5, 1)
+        )
+        layout.add_widget(self.status_label)
         
-        scroll = ScrollView(size_hint_y=0.74)
-        scroll.add_widget(self.records_layout)
-        layout.add_widget(scroll)
+        # 记录列表：只为可见行创建控件，滚动时复用
+        self.records_view = RecycleView(size_hint_y=0.7, viewclass=RecordItem)
+        records_layout = RecycleBoxLayout(
+            orientation='vertical',
+            spacing=5,
+            size_hint_y=None,
+            default_size=(None, 80),
+            default_size_hint=(1, None)
+        )
+        records_layout.bind(minimum_height=records_layout.setter('height'))
+        self.records_view.add_widget(records_layout)
+        self.records_view.bind(scroll_y=self.on_records_scroll)
+        layout.add_widget(self.records_view)
         
         # 底部按钮
         footer = BoxLayout(size_hint_y=0.08, spacing=10)
@@ -581,103 +729,102 @@ class HistoryScreen(BaseScreen):
         # 加载记录
         Clock.schedule_once(lambda dt: self.load_records(None), 0.5)
     
+    def on_enter(self):
+        # 其他屏幕可能新增了处方，缓存的搜索结果作废
+        self.search.invalidate()
+    
+    def refresh_records(self, instance):
+        """刷新当前列表"""
+        self.search.invalidate()
+        if self.search_input.text.strip():
+            self.run_search(0)
+        else:
+            self.load_records(None)
+    
     def load_records(self, instance):
-        """加载记录"""
-        self.records_layout.clear_widgets()
-        
-        records = self.db.get_all_prescriptions()
-        
-        if not records:
-            label = Label(
-                text='暂无记录',
-                size_hint_y=None,
-                height=50
-            )
-            self.records_layout.add_widget(label)
-            return
-        
-        for record in records:
-            item = self.create_record_item(record)
-            self.records_layout.add_widget(item)
+        """加载记录（第一页）"""
+        # 丢弃尚未送达的搜索结果
+        self.search.cancel()
+        self.searching = False
+        self.records_view.data = self.source.reset()
+        self.records_view.scroll_y = 1
+        self.update_status()
     
-    def create_record_item(self, record):
-        """创建记录项"""
-        item = BoxLayout(size_hint_y=None, height=80, padding=5)
-        
-        with item.canvas.before:
-            Color(0.95, 0.95, 0.95, 1)
-            rect = Rectangle(size=item.size, pos=item.pos)
-            item.bind(size=lambda obj, val: setattr(rect, 'size', val))
-            item.bind(pos=lambda obj, val: setattr(rect, 'pos', val))
-        
-        info_layout = BoxLayout(orientation='vertical', size_hint_x=0.7)
-        
-        name_label = Label(
-            text=f"患者: {record.get('patient_name', '未知')}",
-            font_size='14sp',
-            halign='left',
-            text_size=(None, None)
-        )
-        info_layout.add_widget(name_label)
-        
-        formula_label = Label(
-            text=f"方剂: {record.get('formula_name', '未命名')}",
-            font_size='12sp',
-            halign='left',
-            text_size=(None, None),
-            color=(0.5, 0.5, 0.5, 1)
-        )
-        info_layout.add_widget(formula_label)
-        
-        date_label = Label(
-            text=f"日期: {record.get('date', '未知')}",
-            font_size='11sp',
-            halign='left',
-            text_size=(None, None),
-            color=(0.6, 0.6, 0.6, 1)
-        )
-        info_layout.add_widget(date_label)
-        
-        item.add_widget(info_layout)
-        
-        # 操作按钮
-        btn_layout = BoxLayout(orientation='vertical', size_hint_x=0.3, spacing=2)
-        
-        view_btn = Button(
-            text='查看',
-            font_size='12sp',
-            on_press=lambda x, r=record: self.view_record(r)
-        )
-        btn_layout.add_widget(view_btn)
-        
-        delete_btn = Button(
-            text='删除',
-            font_size='12sp',
-            background_color=(0.9, 0.4, 0.4, 1),
-            on_press=lambda x, r=record: self.delete_record(r)
-        )
-        btn_layout.add_widget(delete_btn)
-        
-        item.add_widget(btn_layout)
-        
-        return item
+    def load_more(self):
+        """加载下一页"""
+        rows = self.source.load_more()
+        if rows:
+            self.records_view.data.extend(rows)
+        self.update_status()
+    
+    def on_records_scroll(self, instance, scroll_y):
+        """滚动到接近底部时加载下一页（scroll_y 为 0 表示底部）"""
+        if not self.searching and self.source.has_more and scroll_y <= self.LOAD_MORE_THRESHOLD:
+            self.load_more()
+    
+    def update_status(self):
+        """更新列表上方的记录数提示"""
+        count = len(self.records_view.data)
+        if not count:
+            self.status_label.text = '暂无记录'
+        elif self.searching and count >= self.SEARCH_LIMIT:
+            self.status_label.text = f'仅显示前 {count} 条搜索结果'
+        elif self.searching:
+            self.status_label.text = f'找到 {count} 条记录'
+        elif self.source.has_more:
+            self.status_label.text = f'已加载 {count} 条，下滑加载更多'
+        else:
+            self.status_label.text = f'共 {count} 条记录'
+    
+    def on_search_text(self, instance, text):
+        """输入变化时只重新计时，不在按键处理中查询"""
+        self._search_trigger.cancel()
+        self._search_trigger()
     
     def search_records(self, instance):
-        """搜索记录"""
-        keyword = self.search_input.text
+        """立即搜索（搜索按钮或回车）"""
+        self._search_trigger.cancel()
+        self.run_search(0)
+    
+    def run_search(self, dt):
+        """提交后台查询，关键词清空时回到分页列表"""
+        keyword = self.search_input.text.strip()
         if not keyword:
-            self.load_records(None)
+            if self.searching:
+                self.load_records(None)
             return
         
-        self.records_layout.clear_widgets()
-        records = self.db.search_prescriptions(keyword)
+        self.searching = True
+        self.status_label.text = '搜索中…'
+        self.search.submit(keyword)
+    
+    def _on_search_done(self, generation, keyword, rows, error=None):
+        # 可能在后台线程中调用，切回界面线程更新列表
+        Clock.schedule_once(lambda dt: self.show_search_results(generation, rows, error))
+    
+    def show_search_results(self, generation, rows, error=None):
+        """显示搜索结果，只替换与当前列表不同的行"""
+        if generation != self.search.generation:
+            return
+        if error is not None:
+            self.status_label.text = f'搜索失败: {error}'
+            return
         
-        for record in records:
-            item = self.create_record_item(record)
-            self.records_layout.add_widget(item)
+        data = self.records_view.data
+        change = diff_rows(data, rows)
+        if change is not None:
+            start, stop, replacement = change
+            data[start:stop] = replacement
+            if start == 0:
+                self.records_view.scroll_y = 1
+        self.update_status()
     
-    def view_record(self, record):
+    def view_record(self, record_id):
         """查看记录详情"""
+        record = self.db.get_prescription(record_id)
+        if record is None:
+            return
+        
         content = BoxLayout(orientation='vertical', padding=10)
         
         details = TextInput(
@@ -702,25 +849,32 @@ class HistoryScreen(BaseScreen):
         )
         popup.open()
     
-    def delete_record(self, record):
-        """删除记录"""
-        self.db.delete_prescription(record.get('id'))
-        self.load_records(None)
+    def delete_record(self, record_id):
+        """删除记录，只从列表中移除这一行"""
+        self.db.delete_prescription(record_id)
+        self.search.invalidate()
+        
+        data = self.records_view.data
+        for index, row in enumerate(data):
+            if row['record_id'] == record_id:
+                data.pop(index)
+                break
+        self.update_status()
     
     def export_to_excel(self, instance):
         """导出到Excel"""
-        records = self.db.get_all_prescriptions()
-        if not records:
+        if not self.db.get_statistics()['total']:
             self.show_popup('提示', '没有可导出的记录')
             return
         
         output_path = os.path.join(os.path.expanduser('~'), 'prescriptions_export.xlsx')
-        self.excel.export(records, output_path)
+        self.excel.export(self.db.iter_prescriptions(), output_path)
         self.show_popup('成功', f'已导出到: {output_path}')
     
     def clear_all(self, instance):
         """清空所有记录"""
         self.db.clear_all()
+        self.search.invalidate()
         self.load_records(None)
     
     def show_popup(self, title, message):
@@ -746,7 +900,7 @@ class StatisticsScreen(BaseScreen):
         back_btn = Button(
             text='← 返回',
             size_hint_x=0.2,
-            on_press=lambda x: self.manager.current = 'home'
+            on_press=lambda x: self.go_to('home')
         )
         header.add_widget(back_btn)
         
@@ -902,7 +1056,7 @@ class DiagnosisScreen(BaseScreen):
         back_btn = Button(
             text='← 返回',
             size_hint_x=0.2,
-            on_press=lambda x: self.manager.current = 'home'
+            on_press=lambda x: self.go_to('home')
         )
         header.add_widget(back_btn)
         
@@ -1032,6 +1186,34 @@ class DiagnosisScreen(BaseScreen):
         popup.open()
 
 
+class LazyScreenManager(ScreenManager):
+    """
+    按需创建屏幕的屏幕管理器
+    
+    登记的屏幕在第一次切换过去（或通过 get_screen 取用）时才创建，
+    启动时只构建首屏。
+    """
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._pending = {}
+    
+    def register(self, name, screen_class):
+        """登记屏幕类，暂不创建"""
+        self._pending[name] = screen_class
+    
+    def is_built(self, name):
+        """屏幕是否已经创建"""
+        return self.has_screen(name)
+    
+    def get_screen(self, name):
+        # 切换 current 时 ScreenManager 也经由这里取屏幕
+        screen_class = self._pending.pop(name, None)
+        if screen_class is not None:
+            self.add_widget(screen_class(name=name))
+        return super().get_screen(name)
+
+
 class TCMPrescriptionApp(App):
     """中药处方识别整理应用"""
     
@@ -1039,22 +1221,29 @@ class TCMPrescriptionApp(App):
         # 加载KV文件
         self.load_kv('tcmapp.kv')
         
-        # 创建数据库
-        db = DatabaseManager()
-        db.init_database()
-        
-        # 创建屏幕管理器
-        sm = ScreenManager()
-        
-        # 添加各个屏幕
+        # 创建屏幕管理器，只构建首屏，其余屏幕首次进入时创建
+        sm = LazyScreenManager()
         sm.add_widget(HomeScreen(name='home'))
-        sm.add_widget(ScanScreen(name='scan'))
-        sm.add_widget(BatchProcessScreen(name='batch'))
-        sm.add_widget(HistoryScreen(name='history'))
-        sm.add_widget(StatisticsScreen(name='statistics'))
-        sm.add_widget(DiagnosisScreen(name='diagnosis'))
+        
+        sm.register('scan', ScanScreen)
+        sm.register('batch', BatchProcessScreen)
+        sm.register('history', HistoryScreen)
+        sm.register('statistics', StatisticsScreen)
+        sm.register('diagnosis', DiagnosisScreen)
         
         return sm
+    
+    def on_stop(self):
+        # 停止后台批量处理，释放共用的数据库和缓存连接
+        if self.root.is_built('batch'):
+            batch = self.root.get_screen('batch')
+            batch.cancel_event.set()
+            if batch.worker:
+                batch.worker.join(timeout=5)
+        if self.root.is_built('history'):
+            self.root.get_screen('history').search.close()
+        
+        get_services().close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,140 @@
+"""
+OCR结果缓存模块
+按图片内容哈希缓存识别文本和解析结果，重复导入同一批图片时跳过识别
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    OCR结果磁盘缓存
+    
+    键为“引擎版本:图片内容哈希”，引擎或解析规则变化时改变版本号即可让旧结果失效。
+    条目数超过 max_entries 时按最近使用时间淘汰。
+    """
+    
+    def __init__(self, path=None, max_entries=5000):
+        """
+        Args:
+            path: 缓存数据库路径，默认为用户目录下的 tcm_ocr_cache.db
+            max_entries: 最多保留的条目数
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), 'tcm_ocr_cache.db')
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = 0
+        
+        # 批量处理线程和界面线程共用一个连接，由锁串行化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    prescription TEXT,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used
+                ON ocr_cache(last_used)
+            ''')
+        self._entries = self._conn.execute('SELECT COUNT(*) FROM ocr_cache').fetchone()[0]
+    
+    def get(self, key):
+        """
+        读取缓存
+        
+        Returns:
+            {'text': 识别文本, 'prescription': 处方字典或None}，未命中返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT text, prescription FROM ocr_cache WHERE key = ?', (key,)
+            ).fetchone()
+            
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE ocr_cache SET last_used = ? WHERE key = ?', (time.time(), key)
+                )
+        
+        return {
+            'text': row[0],
+            'prescription': json.loads(row[1]) if row[1] else None,
+        }
+    
+    def put(self, key, text, prescription=None):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        payload = json.dumps(prescription, ensure_ascii=False) if prescription is not None else None
+        
+        with self._lock, self._conn:
+            exists = self._conn.execute(
+                'SELECT 1 FROM ocr_cache WHERE key = ?', (key,)
+            ).fetchone() is not None
+            self._conn.execute('''
+                INSERT INTO ocr_cache (key, text, prescription, last_used) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    text = excluded.text,
+                    prescription = COALESCE(excluded.prescription, prescription),
+                    last_used = excluded.last_used
+            ''', (key, text, payload, time.time()))
+            
+            if not exists:
+                self._entries += 1
+            
+            if self._entries > self.max_entries:
+                self._conn.execute('''
+                    DELETE FROM ocr_cache WHERE key IN (
+                        SELECT key FROM ocr_cache ORDER BY last_used LIMIT ?
+                    )
+                ''', (self._entries - self.max_entries,))
+                self._entries = self.max_entries
+    
+    def stats(self):
+        """获取命中统计"""
+        total = self.hits + self.misses
+        
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': self._entries,
+        }
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM ocr_cache')
+        self._entries = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def close(self):
+        """关闭缓存数据库"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,132 @@
+"""
+服务注册模块
+应用内共用的数据库、OCR、导出、大模型和统计服务，首次使用时才创建
+"""
+
+import sqlite3
+import threading
+
+# 应用启动时打开数据库用于数据回填的最长秒数
+BACKFILL_BUDGET = 0.5
+
+
+class ServiceRegistry:
+    """
+    延迟创建的单例服务表
+    
+    每个服务登记一个工厂函数，第一次通过 get() 或属性访问时调用工厂创建实例，
+    之后一直返回同一个实例。工厂函数接收注册表本身，可以取用其他服务。
+    """
+    
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path: 数据库文件路径，默认使用 DatabaseManager 的默认路径
+        """
+        self.db_path = db_path
+        self._factories = {}
+        self._instances = {}
+        # 可重入锁：工厂内部会再取依赖的服务
+        self._lock = threading.RLock()
+        register_default_services(self)
+    
+    def register(self, name, factory):
+        """登记服务工厂，已创建的同名实例会被替换"""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+    
+    def get(self, name):
+        """获取服务实例，首次访问时创建"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f'未注册的服务: {name}')
+                self._instances[name] = self._factories[name](self)
+            return self._instances[name]
+    
+    def __getattr__(self, name):
+        # 只有普通属性查找失败时才会进入这里
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    def created(self, name):
+        """服务是否已经创建"""
+        return name in self._instances
+    
+    def close(self):
+        """关闭已创建的服务中持有的数据库和缓存连接"""
+        with self._lock:
+            for name in ('db', 'ocr_cache'):
+                instance = self._instances.get(name)
+                if instance is not None:
+                    instance.close()
+
+
+def register_default_services(registry):
+    """登记应用的默认服务，模块在工厂内导入，未使用的服务不产生导入开销"""
+    
+    def db(services):
+        from database import DatabaseManager
+        # 旧数据库升级时打开只回填一小段，其余在后台线程中完成，不阻塞启动
+        db = DatabaseManager(services.db_path, backfill_budget=BACKFILL_BUDGET)
+        if db.pending_backfills():
+            threading.Thread(target=_finish_backfills, args=(db,), daemon=True).start()
+        return db
+    
+    def ocr_cache(services):
+        from ocr_cache import OCRCache
+        return OCRCache()
+    
+    def ocr(services):
+        from ocr_engine import OCREngine
+        return OCREngine(cache=services.ocr_cache)
+    
+    def excel(services):
+        from excel_export import ExcelExporter
+        return ExcelExporter()
+    
+    def llm(services):
+        from llm_api import LLMAPI
+        return LLMAPI(db=services.db)
+    
+    def stats(services):
+        from statistics_manager import StatisticsManager
+        return StatisticsManager(db=services.db)
+    
+    for name, factory in (('db', db), ('ocr_cache', ocr_cache), ('ocr', ocr),
+                          ('excel', excel), ('llm', llm), ('stats', stats)):
+        registry.register(name, factory)
+
+
+def _finish_backfills(db):
+    """后台线程：完成剩余的数据回填"""
+    try:
+        db.run_backfills()
+    except sqlite3.ProgrammingError:
+        # 应用退出时连接已被关闭，已提交的进度保留，下次启动继续
+        pass
+    finally:
+        db.close_thread_connection()
+
+
+_services = None
+_services_lock = threading.Lock()
+
+
+def get_services():
+    """获取应用级服务注册表"""
+    global _services
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                _services = ServiceRegistry()
+    return _services
@@ -7,13 +7,214 @@ import json
 import datetime
 from collections import Counter
 from database import DatabaseManager
+from keyword_matcher import get_default_matcher
+
+
+SEASONS = ['春季(3-5月)', '夏季(6-8月)', '秋季(9-11月)', '冬季(12-2月)']
+
+
+def get_age_group(age):
+    """获取年龄分组"""
+    if age < 18:
+        return '未成年(0-17)'
+    elif age < 30:
+        return '青年(18-29)'
+    elif age < 40:
+        return '青壮年(30-39)'
+    elif age < 50:
+        return '中年(40-49)'
+    elif age < 60:
+        return '中老年(50-59)'
+    else:
+        return '老年(60+)'
+
+
+def simplify_diagnosis(diagnosis):
+    """简化诊断名称"""
+    # 去除常见修饰词
+    modifiers = ['证', '型', '偏', '明显', '轻度', '重度', '急性', '慢性']
+    
+    simplified = diagnosis
+    for modifier in modifiers:
+        simplified = simplified.replace(modifier, '')
+    
+    return simplified.strip()
+
+
+class Aggregator:
+    """
+    统计聚合器
+    
+    报告引擎遍历一次处方表，把每条处方依次交给各聚合器的 add()，
+    遍历结束后以 name 为键收集 result()。新增统计项只需实现这两个方法。
+    """
+    
+    name = ''
+    
+    def add(self, prescription):
+        """累计一条处方"""
+        raise NotImplementedError
+    
+    def result(self):
+        """返回统计结果"""
+        raise NotImplementedError
+
+
+class PatientAggregator(Aggregator):
+    """患者统计：就诊次数、年龄、性别分布"""
+    
+    name = 'patient_analysis'
+    
+    def __init__(self):
+        self.patient_visits = {}
+        self.patient_ages = {}
+        self.patient_genders = {'男': 0, '女': 0, '未知': 0}
+    
+    def add(self, prescription):
+        name = prescription.get('patient_name', '未知')
+        
+        # 就诊次数
+        self.patient_visits[name] = self.patient_visits.get(name, 0) + 1
+        
+        # 年龄统计
+        age = prescription.get('patient_age', '')
+        if age and age.isdigit():
+            age_group = get_age_group(int(age))
+            self.patient_ages[age_group] = self.patient_ages.get(age_group, 0) + 1
+        
+        # 性别统计
+        gender = prescription.get('patient_gender', '未知')
+        if gender in self.patient_genders:
+            self.patient_genders[gender] += 1
+        else:
+            self.patient_genders['未知'] += 1
+    
+    def result(self):
+        patient_visits = self.patient_visits
+        
+        # 复诊患者统计
+        revisit_patients = {name: count for name, count in patient_visits.items() if count > 1}
+        
+        return {
+            'total_patients': len(patient_visits),
+            'revisit_patients': len(revisit_patients),
+            'revisit_rate': len(revisit_patients) / len(patient_visits) * 100 if patient_visits else 0,
+            'age_distribution': self.patient_ages,
+            'gender_distribution': self.patient_genders,
+            'top_patients': dict(sorted(patient_visits.items(), key=lambda x: x[1], reverse=True)[:10])
+        }
+
+
+class SymptomAggregator(Aggregator):
+    """症状统计"""
+    
+    name = 'symptom_analysis'
+    
+    def __init__(self, top_n=30):
+        self.top_n = top_n
+        self.symptom_counts = {}
+        self.matcher = get_default_matcher()
+    
+    def add(self, prescription):
+        symptoms_text = prescription.get('symptoms', '')
+        
+        # 每个症状在一张处方中只计一次
+        for symptom in self.matcher.find(symptoms_text, 'symptom'):
+            self.symptom_counts[symptom] = self.symptom_counts.get(symptom, 0) + 1
+    
+    def result(self):
+        # 排序并取前N个
+        sorted_symptoms = sorted(self.symptom_counts.items(), key=lambda x: x[1], reverse=True)
+        
+        return dict(sorted_symptoms[:self.top_n])
+
+
+class DiagnosisAggregator(Aggregator):
+    """诊断统计"""
+    
+    name = 'diagnosis_analysis'
+    
+    def __init__(self):
+        self.diagnosis_counts = {}
+    
+    def add(self, prescription):
+        diagnosis = prescription.get('diagnosis', '')
+        if diagnosis:
+            simplified = simplify_diagnosis(diagnosis)
+            self.diagnosis_counts[simplified] = self.diagnosis_counts.get(simplified, 0) + 1
+    
+    def result(self):
+        return dict(sorted(self.diagnosis_counts.items(), key=lambda x: x[1], reverse=True))
+
+
+class DoctorAggregator(Aggregator):
+    """医生开方统计"""
+    
+    name = 'doctor_analysis'
+    
+    def __init__(self):
+        self.doctor_counts = {}
+    
+    def add(self, prescription):
+        doctor = prescription.get('doctor_name', '未知')
+        if doctor:
+            self.doctor_counts[doctor] = self.doctor_counts.get(doctor, 0) + 1
+    
+    def result(self):
+        return dict(sorted(self.doctor_counts.items(), key=lambda x: x[1], reverse=True))
+
+
+class SeasonalAggregator(Aggregator):
+    """季节性统计"""
+    
+    name = 'seasonal_analysis'
+    
+    def __init__(self):
+        self.season_counts = {season: 0 for season in SEASONS}
+        self.season_diagnoses = {season: Counter() for season in SEASONS}
+    
+    def add(self, prescription):
+        date_str = prescription.get('date', '')
+        if not date_str:
+            return
+        
+        try:
+            month = int(date_str.split('-')[1])
+        except (IndexError, ValueError):
+            return
+        
+        if 3 <= month <= 5:
+            season = SEASONS[0]
+        elif 6 <= month <= 8:
+            season = SEASONS[1]
+        elif 9 <= month <= 11:
+            season = SEASONS[2]
+        else:
+            season = SEASONS[3]
+        
+        self.season_counts[season] += 1
+        self.season_diagnoses[season][prescription.get('diagnosis', '')] += 1
+    
+    def result(self):
+        # 统计各季节常见诊断
+        return {
+            season: {
+                'count': self.season_counts[season],
+                'top_diagnoses': dict(self.season_diagnoses[season].most_common(5))
+            }
+            for season in SEASONS
+        }
 
 
 class StatisticsManager:
     """统计管理器"""
     
-    def __init__(self):
-        self.db = DatabaseManager()
+    def __init__(self, db=None):
+        """
+        Args:
+            db: 共用的 DatabaseManager，为None时自行创建
+        """
+        self.db = db if db is not None else DatabaseManager()
     
     def get_overview(self):
         """获取概览统计"""
@@ -77,208 +278,102 @@ class StatisticsManager:
         """
         return self.db.get_monthly_trend(months)
     
-    def get_patient_statistics(self):
-        """获取患者统计"""
-        prescriptions = self.db.get_all_prescriptions()
-        
-        # 患者就诊次数统计
-        patient_visits = {}
-        patient_ages = {}
-        patient_genders = {'男': 0, '女': 0, '未知': 0}
-        
-        for prescription in prescriptions:
-            name = prescription.get('patient_name', '未知')
-            
-            # 就诊次数
-            patient_visits[name] = patient_visits.get(name, 0) + 1
-            
-            # 年龄统计
-            age = prescription.get('patient_age', '')
-            if age and age.isdigit():
-                age_group = self._get_age_group(int(age))
-                patient_ages[age_group] = patient_ages.get(age_group, 0) + 1
-            
-            # 性别统计
-            gender = prescription.get('patient_gender', '未知')
-            if gender in patient_genders:
-                patient_genders[gender] += 1
-            else:
-                patient_genders['未知'] += 1
+    def run_aggregators(self, aggregators):
+        """
+        单次遍历处方表，把每条处方交给所有聚合器
         
-        # 复诊患者统计
-        revisit_patients = {name: count for name, count in patient_visits.items() if count > 1}
+        Args:
+            aggregators: Aggregator 实例列表
         
-        return {
-            'total_patients': len(patient_visits),
-            'revisit_patients': len(revisit_patients),
-            'revisit_rate': len(revisit_patients) / len(patient_visits) * 100 if patient_visits else 0,
-            'age_distribution': patient_ages,
-            'gender_distribution': patient_genders,
-            'top_patients': dict(sorted(patient_visits.items(), key=lambda x: x[1], reverse=True)[:10])
-        }
+        Returns:
+            {聚合器name: 统计结果}
+        """
+        for prescription in self.db.iter_prescriptions():
+            for aggregator in aggregators:
+                aggregator.add(prescription)
+        
+        return {aggregator.name: aggregator.result() for aggregator in aggregators}
+    
+    def _run_aggregator(self, aggregator):
+        """遍历处方表计算单个统计项"""
+        return self.run_aggregators([aggregator])[aggregator.name]
+    
+    def get_patient_statistics(self):
+        """获取患者统计"""
+        return self._run_aggregator(PatientAggregator())
     
     def _get_age_group(self, age):
         """获取年龄分组"""
-        if age < 18:
-            return '未成年(0-17)'
-        elif age < 30:
-            return '青年(18-29)'
-        elif age < 40:
-            return '青壮年(30-39)'
-        elif age < 50:
-            return '中年(40-49)'
-        elif age < 60:
-            return '中老年(50-59)'
-        else:
-            return '老年(60+)'
-    
-    def get_monthly_comparison(self):
-        """获取月度对比数据"""
-        current_date = datetime.datetime.now()
-        
-        comparisons = []
-        
-        for i in range(6):  # 最近6个月
-            month_date = current_date - datetime.timedelta(days=30*i)
-            month_str = month_date.strftime('%Y-%m')
-            
-            # 获取该月数据
-            prescriptions = self.db.get_all_prescriptions()
-            month_count = sum(1 for p in p.get('date', '').startswith(month_str) 
-                            for p in prescriptions)
-            
-            comparisons.append({
-                'month': month_str,
-                'count': month_count
-            })
-        
-        return comparisons
+        return get_age_group(age)
     
-    def get_diagnosis_statistics(self):
-        """获取诊断统计"""
-        prescriptions = self.db.get_all_prescriptions()
+    def get_monthly_comparison(self, months=6):
+        """
+        获取月度对比数据
         
-        diagnosis_counts = {}
+        Args:
+            months: 统计最近几个自然月（含本月）
         
-        for prescription in prescriptions:
-            diagnosis = prescription.get('diagnosis', '')
-            if diagnosis:
-                # 简化诊断名称
-                simplified = self._simplify_diagnosis(diagnosis)
-                diagnosis_counts[simplified] = diagnosis_counts.get(simplified, 0) + 1
+        Returns:
+            [{'month': 'YYYY-MM', 'count': 处方数}, ...]，本月在前
+        """
+        today = datetime.date.today()
+        month_keys = []
+        
+        for i in range(months):
+            year, month = divmod(today.year * 12 + today.month - 1 - i, 12)
+            month_keys.append(f'{year:04d}-{month + 1:02d}')
+        
+        counts = self.db.get_month_counts(month_keys[-1], month_keys[0]) if month_keys else {}
         
-        return dict(sorted(diagnosis_counts.items(), key=lambda x: x[1], reverse=True))
+        return [{'month': key, 'count': counts.get(key, 0)} for key in month_keys]
+    
+    def get_diagnosis_statistics(self):
+        """获取诊断统计"""
+        return self._run_aggregator(DiagnosisAggregator())
     
     def _simplify_diagnosis(self, diagnosis):
         """简化诊断名称"""
-        # 去除常见修饰词
-        modifiers = ['证', '型', '偏', '明显', '轻度', '重度', '急性', '慢性']
-        
-        simplified = diagnosis
-        for modifier in modifiers:
-            simplified = simplified.replace(modifier, '')
-        
-        return simplified.strip()
+        return simplify_diagnosis(diagnosis)
     
     def get_symptom_statistics(self, top_n=30):
         """获取症状统计"""
-        prescriptions = self.db.get_all_prescriptions()
-        
-        symptom_counts = {}
-        
-        # 常见症状关键词
-        common_symptoms = [
-            '头痛', '头晕', '眩晕', '耳鸣', '失眠', '多梦', '心悸', '胸闷',
-            '胸痛', '咳嗽', '咳痰', '气喘', '胃痛', '胃胀', '呕吐', '恶心',
-            '腹痛', '腹胀', '腹泻', '便秘', '腰痛', '腰酸', '尿频', '尿急',
-            '口干', '口苦', '口渴', '汗出', '发热', '恶寒', '怕冷', '乏力',
-            '疲倦', '食欲不振', '消化不良', '便秘', '腹泻', '月经不调', '痛经'
-        ]
-        
-        for prescription in prescriptions:
-            symptoms_text = prescription.get('symptoms', '')
-            
-            for symptom in common_symptoms:
-                if symptom in symptoms_text:
-                    symptom_counts[symptom] = symptom_counts.get(symptom, 0) + 1
-        
-        # 排序并取前N个
-        sorted_symptoms = sorted(symptom_counts.items(), key=lambda x: x[1], reverse=True)
-        
-        return dict(sorted_symptoms[:top_n])
+        return self._run_aggregator(SymptomAggregator(top_n))
     
     def get_doctor_statistics(self):
         """获取医生开方统计"""
-        prescriptions = self.db.get_all_prescriptions()
-        
-        doctor_counts = {}
-        
-        for prescription in prescriptions:
-            doctor = prescription.get('doctor_name', '未知')
-            if doctor:
-                doctor_counts[doctor] = doctor_counts.get(doctor, 0) + 1
-        
-        return dict(sorted(doctor_counts.items(), key=lambda x: x[1], reverse=True))
+        return self._run_aggregator(DoctorAggregator())
     
     def get_seasonal_statistics(self):
         """获取季节性统计"""
-        prescriptions = self.db.get_all_prescriptions()
-        
-        seasonal_data = {
-            '春季(3-5月)': {'count': 0, 'top_diagnoses': []},
-            '夏季(6-8月)': {'count': 0, 'top_diagnoses': []},
-            '秋季(9-11月)': {'count': 0, 'top_diagnoses': []},
-            '冬季(12-2月)': {'count': 0, 'top_diagnoses': []},
-        }
-        
-        seasonal_diagnoses = {
-            '春季(3-5月)': [],
-            '夏季(6-8月)': [],
-            '秋季(9-11月)': [],
-            '冬季(12-2月)': [],
-        }
-        
-        for prescription in prescriptions:
-            date_str = prescription.get('date', '')
-            if date_str:
-                try:
-                    month = int(date_str.split('-')[1])
-                    diagnosis = prescription.get('diagnosis', '')
-                    
-                    if 3 <= month <= 5:
-                        seasonal_data['春季(3-5月)']['count'] += 1
-                        seasonal_diagnoses['春季(3-5月)'].append(diagnosis)
-                    elif 6 <= month <= 8:
-                        seasonal_data['夏季(6-8月)']['count'] += 1
-                        seasonal_diagnoses['夏季(6-8月)'].append(diagnosis)
-                    elif 9 <= month <= 11:
-                        seasonal_data['秋季(9-11月)']['count'] += 1
-                        seasonal_diagnoses['秋季(9-11月)'].append(diagnosis)
-                    else:
-                        seasonal_data['冬季(12-2月)']['count'] += 1
-                        seasonal_diagnoses['冬季(12-2月)'].append(diagnosis)
-                
-                except:
-                    pass
-        
-        # 统计各季节常见诊断
-        for season, diagnoses in seasonal_diagnoses.items():
-            diagnosis_counts = Counter(diagnoses)
-            seasonal_data[season]['top_diagnoses'] = dict(diagnosis_counts.most_common(5))
-        
-        return seasonal_data
+        return self._run_aggregator(SeasonalAggregator())
     
-    def generate_report(self, start_date=None, end_date=None):
+    def create_report_aggregators(self):
+        """报告使用的聚合器，子类可覆盖以增删统计项"""
+        return [
+            PatientAggregator(),
+            SymptomAggregator(30),
+            DiagnosisAggregator(),
+            SeasonalAggregator(),
+            DoctorAggregator(),
+        ]
+    
+    def generate_report(self, start_date=None, end_date=None, aggregators=None):
         """
         生成统计报告
         
+        逐条统计的各项（患者、症状、诊断、季节、医生）只遍历一次处方表。
+        
         Args:
             start_date: 开始日期
             end_date: 结束日期
+            aggregators: 聚合器列表，默认使用 create_report_aggregators()
         
         Returns:
             报告字典
         """
+        if aggregators is None:
+            aggregators = self.create_report_aggregators()
+        
         report = {
             'generated_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'period': {
@@ -289,11 +384,8 @@ class StatisticsManager:
             'herb_usage': self.get_herb_statistics(30),
             'formula_usage': self.get_formula_statistics(30),
             'monthly_trend': self.get_trend_statistics(12),
-            'patient_analysis': self.get_patient_statistics(),
-            'symptom_analysis': self.get_symptom_statistics(30),
-            'diagnosis_analysis': self.get_diagnosis_statistics(),
-            'seasonal_analysis': self.get_seasonal_statistics(),
         }
+        report.update(self.run_aggregators(aggregators))
         
         return report
     
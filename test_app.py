@@ -8,14 +8,35 @@ import sys
 import unittest
 import tempfile
 import shutil
+import threading
+import time
+import lexicon as lexicon_module
+import keyword_matcher
 from datetime import datetime
 
 # 导入被测试的模块
-from database import DatabaseManager
+from database import DatabaseManager, parse_herbs, normalize_date, prescription_fingerprint, SCHEMA_VERSION
 from ocr_engine import OCREngine
+from ocr_cache import OCRCache
 from excel_export import ExcelExporter
+from export_backends import export_prescriptions, get_backend, ParquetBackend
 from llm_api import LLMAPI
-from statistics_manager import StatisticsManager
+from statistics_manager import StatisticsManager, Aggregator
+from keyword_matcher import KeywordMatcher
+from lexicon import Lexicon, get_lexicon, HERB_NAMES, FORMULA_NAMES
+from services import ServiceRegistry
+from history_model import PagedRecords, SearchController, diff_rows, record_row
+from batch_import import import_images
+
+
+class SlowOCREngine(OCREngine):
+    """每张图片固定耗时的引擎，用于测试批量识别超时"""
+    
+    delay = 0.4
+    
+    def recognize_and_parse(self, image_path):
+        time.sleep(self.delay)
+        return super().recognize_and_parse(image_path)
 
 
 class TestDatabaseManager(unittest.TestCase):
@@ -23,13 +44,19 @@ class TestDatabaseManager(unittest.TestCase):
     
     def setUp(self):
         """测试前准备"""
+        # 保存处方和同步会向全局词库加入名称，每个测试使用新的词库，结束后恢复
+        self.saved_lexicon = lexicon_module._lexicon
+        lexicon_module._lexicon = None
         self.test_db_path = os.path.join(tempfile.gettempdir(), 'test_tcm.db')
         self.db = DatabaseManager(self.test_db_path)
     
     def tearDown(self):
         """测试后清理"""
+        self.db.close()
         if os.path.exists(self.test_db_path):
             os.remove(self.test_db_path)
+        lexicon_module._lexicon = self.saved_lexicon
+        keyword_matcher._default_matcher = None
     
     def test_init_database(self):
         """测试数据库初始化"""
@@ -43,8 +70,6 @@ class TestDatabaseManager(unittest.TestCase):
         self.assertIn('prescriptions', tables)
         self.assertIn('herbs', tables)
         self.assertIn('formulas', tables)
-        
-        conn.close()
     
     def test_save_and_get_prescription(self):
         """测试保存和获取处方"""
@@ -102,6 +127,43 @@ class TestDatabaseManager(unittest.TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['patient_name'], '李四')
     
+    def test_search_fulltext_index(self):
+        """测试全文索引搜索与同步"""
+        self.assertTrue(self.db.fts_enabled)
+        
+        first_id = self.db.save_prescription({
+            'patient_name': '王五',
+            'formula_name': '补中益气汤',
+            'symptoms': '乏力、食欲不振',
+            'date': '2024-01-15'
+        })
+        self.db.save_prescription({
+            'patient_name': '赵六',
+            'formula_name': '四君子汤',
+            'symptoms': '食欲不振',
+            'date': '2024-01-16'
+        })
+        
+        results = self.db.search_prescriptions('食欲不振')
+        self.assertEqual(len(results), 2)
+        
+        # 更新后索引同步
+        self.db.update_prescription(first_id, {'symptoms': '头痛'})
+        results = self.db.search_prescriptions('食欲不振')
+        self.assertEqual([r['patient_name'] for r in results], ['赵六'])
+        
+        # 删除后索引同步
+        self.db.delete_prescription(first_id)
+        self.assertEqual(self.db.search_prescriptions('补中益气汤'), [])
+    
+    def test_search_like_fallback(self):
+        """测试不支持全文索引时退回LIKE查询"""
+        self.db.save_prescription({'patient_name': '张三', 'formula_name': '四物汤'})
+        self.db.fts_enabled = False
+        
+        results = self.db.search_prescriptions('四物汤')
+        self.assertEqual(len(results), 1)
+    
     def test_delete_prescription(self):
         """测试删除处方"""
         prescription = {
@@ -135,6 +197,368 @@ class TestDatabaseManager(unittest.TestCase):
         self.assertEqual(stats['total'], 5)
         self.assertEqual(stats['patients'], 5)
         self.assertEqual(stats['formulas'], 5)
+    
+    def test_save_prescriptions_bulk(self):
+        """测试批量保存处方"""
+        chunks = []
+        prescriptions = (
+            {'patient_name': f'批量患者{i}', 'date': '2024-01-15'}
+            for i in range(120)
+        )
+        
+        ids = self.db.save_prescriptions(prescriptions, chunk_size=50, on_chunk=chunks.append)
+        
+        self.assertEqual(len(ids), 120)
+        self.assertEqual([c['rows'] for c in chunks], [50, 50, 20])
+        self.assertEqual(self.db.get_prescription(ids[0])['patient_name'], '批量患者0')
+        self.assertEqual(self.db.get_prescription(ids[-1])['patient_name'], '批量患者119')
+    
+    def test_parse_herbs(self):
+        """测试解析药材文本"""
+        entries = parse_herbs('熟地黄 24g（滋阴补肾，填精益髓），山茱萸12克，甘草')
+        
+        self.assertEqual([(name, dose) for name, dose, raw in entries],
+                         [('熟地黄', 24.0), ('山茱萸', 12.0), ('甘草', None)])
+    
+    def test_parse_herbs_whitespace(self):
+        """测试解析空格分隔的多味药材"""
+        entries = parse_herbs('熟地黄24g 山茱萸12g 山药12g')
+        self.assertEqual([(name, dose, raw) for name, dose, raw in entries], [
+            ('熟地黄', 24.0, '熟地黄24g'), ('山茱萸', 12.0, '山茱萸12g'), ('山药', 12.0, '山药12g')
+        ])
+        
+        # 指纹包含每一味药，只差一味药的处方不会被当作重复
+        self.assertNotEqual(
+            prescription_fingerprint('张三', '2024-01-01', '六味地黄丸', '熟地黄24g 山茱萸12g'),
+            prescription_fingerprint('张三', '2024-01-01', '六味地黄丸', '熟地黄24g 当归12g')
+        )
+        
+        ids = self.db.save_prescriptions([
+            {'patient_name': '张三', 'date': '2024-01-01', 'formula_name': '六味地黄丸',
+             'herbs': '熟地黄24g 山茱萸12g'},
+            {'patient_name': '张三', 'date': '2024-01-01', 'formula_name': '六味地黄丸',
+             'herbs': '熟地黄24g 当归12g'},
+        ], mode='skip')
+        
+        self.assertEqual(len(set(ids)), 2)
+        self.assertEqual(self.db.get_herb_usage_stats()['熟地黄'], 2)
+    
+    def test_fingerprint_independent_of_lexicon(self):
+        """测试词库学到新药材前后，同一处方的指纹不变"""
+        prescription = {'patient_name': '张三', 'date': '2024-01-01', 'herbs': '熟地黄24g 试验草'}
+        first_id = self.db.save_prescription(prescription, mode='skip')
+        
+        # 另一张处方写明剂量，试验草登记为药材
+        self.db.save_prescription({'patient_name': '李四', 'herbs': '试验草 10g'})
+        self.assertTrue(get_lexicon().is_herb('试验草'))
+        
+        self.assertEqual(self.db.save_prescription(prescription, mode='skip'), first_id)
+        self.assertEqual(self.db.get_statistics()['total'], 2)
+    
+    def test_herb_usage_queries(self):
+        """测试药材明细表查询"""
+        first_id = self.db.save_prescription({
+            'patient_name': '张三', 'herbs': '熟地黄 24g，山茱萸 12g，茯苓 9g'
+        })
+        self.db.save_prescriptions([
+            {'patient_name': '李四', 'herbs': '人参 10g，茯苓 10g'},
+            {'patient_name': '王五', 'herbs': '人参 10g，白术 10g'},
+        ])
+        
+        usage = self.db.get_herb_usage_stats()
+        self.assertEqual(usage['茯苓'], 2)
+        self.assertEqual(usage['人参'], 2)
+        
+        cooccurrence = self.db.get_herb_cooccurrence('人参')
+        self.assertEqual(cooccurrence, {'茯苓': 1, '白术': 1})
+        
+        names = [p['patient_name'] for p in self.db.get_prescriptions_by_herb('茯苓')]
+        self.assertEqual(sorted(names), ['张三', '李四'])
+        
+        # 更新药材后明细同步
+        self.db.update_prescription(first_id, {'herbs': '当归 10g'})
+        self.assertEqual(self.db.get_herb_usage_stats()['茯苓'], 1)
+        
+        # 删除处方后明细同步
+        self.db.delete_prescription(first_id)
+        self.assertNotIn('当归', self.db.get_herb_usage_stats())
+    
+    def test_backfill_prescription_herbs(self):
+        """测试为已有处方回填药材明细"""
+        self.db.save_prescription({'patient_name': '张三', 'herbs': '人参 10g，茯苓 10g'})
+        with self.db.transaction() as cursor:
+            cursor.execute('DELETE FROM prescription_herbs')
+        self.assertEqual(self.db.get_herb_usage_stats(), {})
+        
+        self.db.backfill_prescription_herbs()
+        
+        self.assertEqual(self.db.get_herb_usage_stats(), {'人参': 1, '茯苓': 1})
+    
+    def test_lexicon_sync(self):
+        """测试词库与药材方剂表同步"""
+        lexicon = get_lexicon()
+        self.assertTrue(lexicon.is_herb('熟地黄'))
+        self.assertTrue(lexicon.is_formula('六味地黄丸'))
+        self.assertIsNotNone(self.db.get_herb_info('附子'))
+        self.assertEqual(self.db.get_herb_info('人参')['pinyin'], 'renshen')
+        
+        with self.db.transaction() as cursor:
+            cursor.execute("INSERT INTO herbs (name, pinyin) VALUES ('测试药', 'ceshiyao')")
+            lexicon.sync(cursor)
+        self.assertTrue(lexicon.is_herb('测试药'))
+        self.assertEqual(lexicon.complete('ceshi'), ['测试药'])
+    
+    def test_new_herbs_reach_matcher(self):
+        """测试保存处方时新药材加入词库，识别时即可匹配"""
+        ocr = OCREngine()
+        self.assertEqual(ocr.matcher.find('试验草 10g', 'herb'), [])
+        
+        self.db.save_prescription({'patient_name': '张三', 'herbs': '试验草 10g，人参 10g，字迹不清'})
+        
+        self.assertIsNotNone(self.db.get_herb_info('试验草'))
+        self.assertIsNone(self.db.get_herb_info('字迹不清'))
+        self.assertEqual(ocr.matcher.find('试验草 10g', 'herb'), ['试验草'])
+        self.assertEqual(self.db.get_herb_usage_stats(), {'试验草': 1, '人参': 1})
+    
+    def test_new_herbs_rolled_back(self):
+        """测试事务回滚时新药材不进入药材表和词库"""
+        record_id = self.db.save_prescription({'patient_name': '张三'})
+        
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction() as cursor:
+                self.db._save_herb_rows(cursor, record_id, '回滚草 10g')
+                raise RuntimeError('中断')
+        
+        self.assertIsNone(self.db.get_herb_info('回滚草'))
+        self.assertFalse(get_lexicon().is_herb('回滚草'))
+    
+    def test_save_mode_dedup(self):
+        """测试按处方指纹查重"""
+        prescription = {
+            'patient_name': '张三', 'date': '2024-01-15', 'formula_name': '四物汤',
+            'herbs': '当归 10g，川芎 6g', 'notes': '初诊'
+        }
+        first_id = self.db.save_prescription(prescription)
+        
+        # 药材顺序、日期写法不同仍视为同一处方
+        duplicate = dict(prescription, herbs='川芎 6g、当归 10g', date='2024年1月15日', notes='复诊')
+        self.assertEqual(self.db.save_prescription(duplicate, mode='skip'), first_id)
+        self.assertEqual(self.db.get_prescription(first_id)['notes'], '初诊')
+        
+        self.assertEqual(self.db.save_prescription(duplicate, mode='update'), first_id)
+        self.assertEqual(self.db.get_prescription(first_id)['notes'], '复诊')
+        self.assertEqual(self.db.get_statistics()['total'], 1)
+        
+        kept_id = self.db.save_prescription(duplicate)
+        self.assertEqual(self.db.find_duplicates(prescription), [first_id, kept_id])
+        
+        # 批量导入：库中已有的和同批重复的都只保留一条
+        batch = [prescription, {'patient_name': '李四'}, {'patient_name': '李四'}]
+        inserted = []
+        ids = self.db.save_prescriptions(
+            batch, on_chunk=lambda info: inserted.append(info['inserted']), mode='skip'
+        )
+        self.assertEqual(ids[0], first_id)
+        self.assertEqual(ids[1], ids[2])
+        self.assertEqual(inserted, [1])
+        self.assertEqual(self.db.get_statistics()['total'], 3)
+        
+        self.assertRaises(ValueError, self.db.save_prescription, prescription, mode='merge')
+    
+    def test_normalize_date(self):
+        """测试日期规范化"""
+        self.assertEqual(normalize_date('2024年1月5日'), '2024-01-05')
+        self.assertEqual(normalize_date('2024/12/31'), '2024-12-31')
+        self.assertEqual(normalize_date('2024-02-30'), None)
+        self.assertEqual(normalize_date(''), None)
+        
+        prescription_id = self.db.save_prescription({'patient_name': '张三', 'date': '2024年3月8日'})
+        self.assertEqual(self.db.get_prescription(prescription_id)['date_iso'], '2024-03-08')
+        
+        self.db.update_prescription(prescription_id, {'date': '2024.4.1'})
+        self.assertEqual(self.db.get_prescription(prescription_id)['date_iso'], '2024-04-01')
+        self.assertEqual(self.db.get_month_counts('2024-01', '2024-12'), {'2024-04': 1})
+    
+    def test_prescriptions_page(self):
+        """测试游标分页"""
+        ids = self.db.save_prescriptions({'patient_name': f'患者{i}'} for i in range(7))
+        
+        seen = []
+        cursor = None
+        while True:
+            page = self.db.get_prescriptions_page(3, cursor)
+            seen.extend(r['id'] for r in page['records'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        # 同一秒创建的记录按ID倒序
+        self.assertEqual(seen, list(reversed(ids)))
+        
+        pages = list(self.db.iter_prescription_pages(page_size=3))
+        self.assertEqual([len(p) for p in pages], [3, 3, 1])
+        
+        with self.assertRaises(ValueError):
+            self.db.get_prescriptions_page(3, 'invalid')
+    
+    def test_iter_prescriptions(self):
+        """测试流式遍历处方"""
+        self.db.save_prescriptions(
+            {'patient_name': f'患者{i}', 'symptoms': '食欲不振' if i % 2 else '头痛'}
+            for i in range(5)
+        )
+        
+        rows = self.db.iter_prescriptions(batch_size=2)
+        self.assertNotIsInstance(rows, list)
+        self.assertEqual([r['patient_name'] for r in rows], [f'患者{i}' for i in range(4, -1, -1)])
+        
+        matched = list(self.db.iter_search_prescriptions('食欲不振', batch_size=1))
+        self.assertEqual(len(matched), 2)
+    
+    def test_statistics_counters(self):
+        """测试统计计数器随增删改同步"""
+        current_month = datetime.now().strftime('%Y-%m')
+        first_id = self.db.save_prescription(
+            {'patient_name': '张三', 'formula_name': '四物汤', 'date': f'{current_month}-01'}
+        )
+        self.db.save_prescriptions([
+            {'patient_name': '张三', 'formula_name': '四君子汤', 'date': '2024-01-15'},
+            {'patient_name': '李四', 'formula_name': '四物汤', 'date': '2024-01-16'},
+        ])
+        
+        self.assertEqual(self.db.get_statistics(),
+                         {'total': 3, 'patients': 2, 'formulas': 2, 'monthly': 1})
+        self.assertEqual(self.db.get_formula_usage_stats(), {'四物汤': 2, '四君子汤': 1})
+        
+        self.db.update_prescription(first_id, {'patient_name': '王五', 'date': '2024-02-01'})
+        self.assertEqual(self.db.get_statistics(),
+                         {'total': 3, 'patients': 3, 'formulas': 2, 'monthly': 0})
+        self.assertEqual(self.db.get_monthly_trend(), {'2024-02': 1, '2024-01': 2})
+        
+        self.db.delete_prescription(first_id)
+        self.assertEqual(self.db.get_statistics(),
+                         {'total': 2, 'patients': 2, 'formulas': 2, 'monthly': 0})
+        self.assertEqual(self.db.check_statistics(), [])
+    
+    def test_statistics_month_non_iso_date(self):
+        """测试非ISO日期按规范化月份计入月度计数"""
+        record_id = self.db.save_prescription({'patient_name': '张三', 'date': '2024年1月15日'})
+        self.db.save_prescription({'patient_name': '李四', 'date': '2024/01/20'})
+        
+        self.assertEqual(self.db.get_monthly_trend(), {'2024-01': 2})
+        self.assertEqual(self.db.get_monthly_trend(),
+                         self.db.get_month_counts('2024-01', '2024-01'))
+        
+        self.db.update_prescription(record_id, {'date': '2024年2月1日'})
+        self.assertEqual(self.db.get_monthly_trend(), {'2024-02': 1, '2024-01': 1})
+        self.assertEqual(self.db.check_statistics(), [])
+    
+    def test_rebuild_statistics(self):
+        """测试校验并重建统计计数器"""
+        self.db.save_prescription({'patient_name': '张三', 'formula_name': '四物汤'})
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE stats_counters SET count = 9 WHERE kind = 'total'")
+        
+        self.assertEqual(self.db.check_statistics(), [('total', '', 9, 1)])
+        
+        self.db.rebuild_statistics()
+        self.assertEqual(self.db.check_statistics(), [])
+        self.assertEqual(self.db.get_statistics()['patients'], 1)
+    
+    def test_connection_reused_per_thread(self):
+        """测试连接按线程复用"""
+        conn = self.db.get_connection()
+        self.assertIs(self.db.get_connection(), conn)
+        
+        # 其他线程获得独立的连接
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.db.get_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+    
+    def test_close_reopens_connection(self):
+        """测试关闭后重新获取连接"""
+        conn = self.db.get_connection()
+        self.db.close()
+        
+        self.assertIsNot(self.db.get_connection(), conn)
+        prescription_id = self.db.save_prescription({'patient_name': '重连患者'})
+        self.assertIsNotNone(self.db.get_prescription(prescription_id))
+    
+    def test_storage_profile(self):
+        """测试存储配置"""
+        conn = self.db.get_connection()
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+        
+        with self.assertRaises(ValueError):
+            DatabaseManager(self.test_db_path, profile='unknown')
+    
+    def test_schema_version(self):
+        """测试结构版本为当前版本时跳过初始化"""
+        conn = self.db.get_connection()
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+        
+        reopened = DatabaseManager(self.test_db_path)
+        self.assertFalse(reopened.ensure_schema())
+        self.assertTrue(reopened.fts_enabled)
+        reopened.close()
+        
+        conn.execute('PRAGMA user_version = 0')
+        reopened = DatabaseManager(self.test_db_path)
+        self.assertEqual(
+            reopened.get_connection().execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION
+        )
+        reopened.close()
+    
+    def test_migrate_legacy_database(self):
+        """测试旧版本数据库按迁移升级并回填"""
+        import sqlite3
+        
+        legacy_path = os.path.join(tempfile.gettempdir(), 'test_tcm_legacy.db')
+        conn = sqlite3.connect(legacy_path)
+        conn.execute('''
+            CREATE TABLE prescriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, patient_name TEXT NOT NULL,
+                patient_age TEXT, patient_gender TEXT, formula_name TEXT, symptoms TEXT,
+                diagnosis TEXT, herbs TEXT, dosage TEXT, usage TEXT, doctor_name TEXT,
+                hospital TEXT, date TEXT, notes TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.executemany(
+            'INSERT INTO prescriptions (patient_name, formula_name, herbs, date) VALUES (?, ?, ?, ?)',
+            [(f'患者{i}', '四君子汤', '人参 10g，白术 10g', f'2024年3月{i + 1}日') for i in range(5)]
+        )
+        conn.commit()
+        conn.close()
+        
+        try:
+            db = DatabaseManager(legacy_path, backfill_budget=0)
+            self.assertEqual(db.schema_version(), SCHEMA_VERSION)
+            self.assertEqual(db.migrate(), [])
+            self.assertEqual(db.get_statistics()['total'], 5)
+            self.assertEqual(db.search_prescriptions('四君子汤')[0]['formula_name'], '四君子汤')
+            
+            # 限时为0时只完成一块，其余留待续跑
+            self.assertEqual(db.pending_backfills(), ['prescription_herbs', 'date_iso', 'fingerprint'])
+            self.assertFalse(db.run_backfills(time_budget=0, chunk_size=2))
+            self.assertTrue(db.run_backfills(chunk_size=2))
+            self.assertEqual(db.pending_backfills(), [])
+            
+            self.assertEqual(db.get_month_counts('2024-03', '2024-03'), {'2024-03': 5})
+            self.assertEqual(db.get_monthly_trend(), {'2024-03': 5})
+            self.assertEqual(db.check_statistics(), [])
+            self.assertEqual(len(db.find_duplicates(
+                {'patient_name': '患者0', 'formula_name': '四君子汤',
+                 'herbs': '人参 10g，白术 10g', 'date': '2024年3月1日'}
+            )), 1)
+            self.assertEqual(db.get_herb_usage_stats()['人参'], 5)
+            db.close()
+        finally:
+            os.remove(legacy_path)
 
 
 class TestOCREngine(unittest.TestCase):
@@ -198,6 +622,124 @@ class TestOCREngine(unittest.TestCase):
         self.assertIn('头痛', symptoms)
         self.assertIn('眩晕', symptoms)
         self.assertIn('失眠', symptoms)
+    
+    def test_extract_symptom_keywords(self):
+        """测试无标记文本按最长关键词提取症状"""
+        text = "患者头痛，舌红少苔，脉细数，头痛反复"
+        
+        symptoms = self.ocr._extract_symptoms(text)
+        
+        self.assertEqual(symptoms, '头痛、舌红少苔、脉细数')
+        self.assertEqual(self.ocr._extract_formula_name('拟四物汤合四君子汤'), '四物汤')
+    
+    def test_lexicon(self):
+        """测试词库去重、前缀和拼音补全"""
+        self.assertEqual(len(HERB_NAMES), len(set(HERB_NAMES)))
+        self.assertEqual(len(FORMULA_NAMES), len(set(FORMULA_NAMES)))
+        
+        lexicon = Lexicon()
+        self.assertEqual(lexicon.add('herb', ['熟地黄', '熟地黄', '生地'], {'熟地黄': 'shudihuang'}), 2)
+        self.assertEqual(lexicon.add('formula', ['地黄饮子']), 1)
+        self.assertEqual(lexicon.add('herb', ['生地']), 0)
+        self.assertEqual(lexicon.version, 2)
+        
+        self.assertTrue(lexicon.is_herb('生地'))
+        self.assertFalse(lexicon.is_herb('地黄饮子'))
+        self.assertEqual(lexicon.complete('熟'), ['熟地黄'])
+        self.assertEqual(lexicon.complete('SHUDI'), ['熟地黄'])
+        self.assertEqual(lexicon.complete('地', category='formula'), ['地黄饮子'])
+        self.assertRaises(ValueError, lexicon.add, 'symptom', ['头痛'])
+    
+    def test_batch_recognize_parallel(self):
+        """测试进程池批量识别"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for i in range(5):
+                path = os.path.join(test_dir, f'{i}.png')
+                open(path, 'wb').close()
+                paths.append(path)
+            paths.insert(2, os.path.join(test_dir, 'missing.png'))
+            
+            results = list(self.ocr.iter_batch_recognize(paths, workers=2, max_in_flight=3))
+            self.assertEqual([r['index'] for r in results], list(range(6)))
+            self.assertEqual(results[2]['text'], '错误：图片文件不存在')
+            self.assertEqual(results[0]['prescription']['patient_name'], '张三')
+            self.assertIsNone(results[0]['error'])
+            self.assertIn('recognize', results[0]['timings'])
+            
+            unordered = self.ocr.iter_batch_recognize(paths, workers=2, ordered=False)
+            self.assertEqual(sorted(r['index'] for r in unordered), list(range(6)))
+            
+            self.assertEqual(self.ocr.batch_recognize(paths), self.ocr.batch_recognize(paths, workers=2))
+        finally:
+            shutil.rmtree(test_dir)
+    
+    def test_batch_recognize_timeout(self):
+        """测试批量识别超时只计算执行时间，不计排队时间"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for i in range(4):
+                path = os.path.join(test_dir, f'{i}.png')
+                open(path, 'wb').close()
+                paths.append(path)
+            
+            # 两个进程各处理两张，第二轮提交时第一轮已经结束，排队不计入超时
+            results = list(SlowOCREngine().iter_batch_recognize(
+                paths, workers=2, timeout=SlowOCREngine.delay * 1.75, max_in_flight=4
+            ))
+            self.assertEqual([r['index'] for r in results], list(range(4)))
+            self.assertEqual([r['error'] for r in results], [None] * 4)
+        finally:
+            shutil.rmtree(test_dir)
+    
+    def test_recognize_cache(self):
+        """测试按图片内容缓存识别结果"""
+        test_dir = tempfile.mkdtemp()
+        cache = OCRCache(os.path.join(test_dir, 'cache.db'), max_entries=2)
+        try:
+            paths = []
+            for i in range(3):
+                path = os.path.join(test_dir, f'{i}.png')
+                with open(path, 'wb') as f:
+                    f.write(bytes([i]))
+                paths.append(path)
+            # 内容相同的副本命中同一条缓存
+            shutil.copy(paths[0], os.path.join(test_dir, 'copy.png'))
+            
+            ocr = OCREngine(cache=cache)
+            first = ocr.recognize_and_parse(paths[0])
+            again = ocr.recognize_and_parse(os.path.join(test_dir, 'copy.png'))
+            self.assertFalse(first['cached'])
+            self.assertTrue(again['cached'])
+            self.assertEqual(again['prescription'], first['prescription'])
+            self.assertEqual(cache.stats()['hits'], 1)
+            
+            results = list(ocr.iter_batch_recognize(paths, workers=2))
+            self.assertEqual([r['cached'] for r in results], [True, False, False])
+            
+            # 超出容量淘汰最久未使用的条目
+            self.assertEqual(cache.stats()['entries'], 2)
+            self.assertIsNone(cache.get(f'{ocr.cache_version}:missing'))
+            
+            # 引擎版本变化后旧结果失效
+            ocr.cache_version = 'other'
+            self.assertFalse(ocr.recognize_and_parse(paths[2])['cached'])
+        finally:
+            cache.close()
+            shutil.rmtree(test_dir)
+    
+    def test_keyword_matcher(self):
+        """测试多关键词匹配"""
+        matcher = KeywordMatcher({'symptom': ['舌红', '舌红少苔', '少苔'], 'herb': ['红花', '花']})
+        
+        self.assertEqual(matcher.find_all('舌红少苔，红花'), [
+            (0, '舌红少苔', 'symptom'), (5, '红花', 'herb')
+        ])
+        self.assertEqual(matcher.find('舌红，舌红', 'symptom'), ['舌红'])
+        self.assertEqual(matcher.find('红花', 'symptom'), [])
+        self.assertEqual(matcher.find_all(''), [])
 
 
 class TestExcelExporter(unittest.TestCase):
@@ -253,6 +795,84 @@ class TestExcelExporter(unittest.TestCase):
         self.assertTrue(os.path.exists(result))
         self.assertEqual(result, output_path)
     
+    def test_export_streaming(self):
+        """测试流式导出与内存导出内容一致"""
+        from openpyxl import load_workbook
+        
+        def generate():
+            for i in range(5):
+                yield {'patient_name': f'患者{i}', 'herbs': '人参 10g', 'date': '2024-01-15'}
+        
+        streaming_path = os.path.join(self.test_dir, 'streaming.xlsx')
+        memory_path = os.path.join(self.test_dir, 'memory.xlsx')
+        self.exporter.export(generate(), streaming_path)
+        self.exporter.export(generate(), memory_path, streaming=False)
+        
+        streaming = load_workbook(streaming_path).active
+        memory = load_workbook(memory_path).active
+        self.assertEqual(list(streaming.values), list(memory.values))
+        self.assertEqual(streaming.max_row, 6)
+        self.assertEqual(streaming.freeze_panes, 'A2')
+        self.assertTrue(streaming['A1'].font.bold)
+        self.assertEqual(streaming['B2'].alignment.horizontal, 'center')
+        self.assertEqual(streaming.column_dimensions['I'].width, 40)
+    
+    def test_export_rollover(self):
+        """测试按行数续写新工作表和拆分文件"""
+        from openpyxl import load_workbook
+        
+        prescriptions = [{'patient_name': f'患者{i}'} for i in range(5)]
+        
+        output_path = os.path.join(self.test_dir, 'sheets.xlsx')
+        self.exporter.export(prescriptions, output_path, rows_per_sheet=2)
+        wb = load_workbook(output_path)
+        self.assertEqual(wb.sheetnames, ['处方记录', '处方记录 (2)', '处方记录 (3)'])
+        self.assertEqual(wb['处方记录 (3)']['A2'].value, 5)
+        
+        output_path = os.path.join(self.test_dir, 'files.xlsx')
+        manifest = self.exporter.export_split(prescriptions, output_path, rows_per_file=3)
+        self.assertEqual(manifest['rows'], 5)
+        self.assertEqual([entry['rows'] for entry in manifest['files']], [3, 2])
+        self.assertTrue(os.path.exists(manifest['manifest']))
+        second = load_workbook(manifest['files'][1]['path']).active
+        self.assertEqual(second['A2'].value, 4)
+    
+    def test_export_by_month(self):
+        """测试按月分区导出"""
+        from openpyxl import load_workbook
+        
+        db = DatabaseManager(os.path.join(self.test_dir, 'test.db'))
+        db.save_prescriptions([
+            {'patient_name': '张三', 'date': '2024-02-03'},
+            {'patient_name': '李四', 'date': '2024年1月20日'},
+            {'patient_name': '王五', 'date': '2024-01-05'},
+            {'patient_name': '赵六', 'date': ''},
+        ])
+        
+        output_path = os.path.join(self.test_dir, 'monthly.xlsx')
+        manifest = self.exporter.export_by_month(db, output_path)
+        wb = load_workbook(output_path)
+        self.assertEqual(wb.sheetnames, ['2024-01', '2024-02', '日期不详'])
+        self.assertEqual(wb['2024-01']['B2'].value, '王五')
+        self.assertEqual(manifest['rows'], 4)
+        
+        # 分区方式只由 layout 决定，单进程与多进程输出相同
+        for workers in (1, 2):
+            output_path = os.path.join(self.test_dir, f'files_{workers}.xlsx')
+            manifest = self.exporter.export_by_month(db, output_path, layout='files', workers=workers)
+            self.assertEqual(
+                [entry['partition'] for entry in manifest['files']],
+                ['2024-01', '2024-02', '日期不详']
+            )
+            self.assertEqual([entry['rows'] for entry in manifest['files']], [2, 1, 1])
+            for entry in manifest['files']:
+                self.assertTrue(os.path.exists(entry['path']))
+        
+        manifest = self.exporter.export_by_month(db, output_path, workers=2)
+        self.assertEqual(len(manifest['files']), 1)
+        self.assertRaises(ValueError, self.exporter.export_by_month, db, output_path, layout='weeks')
+        db.close()
+    
     def test_create_template(self):
         """测试创建模板"""
         output_path = os.path.join(self.test_dir, 'test_template.xlsx')
@@ -261,12 +881,89 @@ class TestExcelExporter(unittest.TestCase):
         self.assertTrue(os.path.exists(result))
 
 
+class TestExportBackends(unittest.TestCase):
+    """测试按扩展名选择的导出后端"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.prescriptions = [
+            {'patient_name': '张三', 'date': '2024-01-15', 'herbs': '熟地黄 24g，山茱萸 12g'},
+            {'patient_name': '李四', 'date': '2024-01-16', 'herbs': '人参 10g', 'notes': '含,逗号'},
+        ]
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_export_csv(self):
+        """测试CSV导出"""
+        import csv
+        
+        output_path = os.path.join(self.test_dir, 'export.csv')
+        result = export_prescriptions(iter(self.prescriptions), output_path)
+        self.assertEqual(result['rows'], 2)
+        
+        with open(output_path, newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][:3], ['序号', '患者姓名', '年龄'])
+        self.assertEqual(rows[1][:2], ['1', '张三'])
+        self.assertEqual(rows[2][-1], '含,逗号')
+    
+    def test_export_jsonl(self):
+        """测试JSON Lines导出"""
+        import json
+        
+        output_path = os.path.join(self.test_dir, 'export.jsonl')
+        result = export_prescriptions(self.prescriptions, output_path)
+        self.assertEqual(result['rows'], 2)
+        
+        with open(output_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[0]['index'], 1)
+        self.assertEqual(records[1]['patient_name'], '李四')
+        self.assertEqual(records[1]['herbs'], '人参 10g')
+    
+    def test_export_xlsx(self):
+        """测试xlsx扩展名使用Excel导出"""
+        output_path = os.path.join(self.test_dir, 'export.XLSX')
+        result = export_prescriptions(self.prescriptions, output_path)
+        
+        self.assertEqual(result['rows'], 2)
+        self.assertTrue(os.path.exists(output_path))
+    
+    def test_unknown_extension(self):
+        """测试不支持的扩展名"""
+        with self.assertRaises(ValueError):
+            get_backend(os.path.join(self.test_dir, 'export.txt'))
+    
+    @unittest.skipUnless(ParquetBackend.available(), '未安装 pyarrow')
+    def test_export_parquet(self):
+        """测试Parquet导出"""
+        import pyarrow.parquet as pq
+        
+        output_path = os.path.join(self.test_dir, 'export.parquet')
+        backend = ParquetBackend(batch_size=1)
+        self.assertEqual(backend.write(self.prescriptions, output_path), 2)
+        
+        table = pq.read_table(output_path)
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.column('patient_name').to_pylist(), ['张三', '李四'])
+
+
 class TestLLMAPI(unittest.TestCase):
     """测试大模型API"""
     
     def setUp(self):
         """测试前准备"""
-        self.llm = LLMAPI()
+        self.test_dir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.test_dir, 'test.db'))
+        self.llm = LLMAPI(db=self.db)
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
     
     def test_diagnose(self):
         """测试诊断功能"""
@@ -307,13 +1004,14 @@ class TestStatisticsManager(unittest.TestCase):
         """测试前准备"""
         self.test_db_path = os.path.join(tempfile.gettempdir(), 'test_stats.db')
         self.db = DatabaseManager(self.test_db_path)
-        self.stats = StatisticsManager()
+        self.stats = StatisticsManager(db=self.db)
         
         # 添加测试数据
         self._add_test_data()
     
     def tearDown(self):
         """测试后清理"""
+        self.db.close()
         if os.path.exists(self.test_db_path):
             os.remove(self.test_db_path)
     
@@ -388,6 +1086,272 @@ class TestStatisticsManager(unittest.TestCase):
         self.assertIn('summary', report)
         self.assertIn('herb_usage', report)
         self.assertIn('formula_usage', report)
+        self.assertEqual(report['patient_analysis']['total_patients'], 2)
+        self.assertIn('doctor_analysis', report)
+    
+    def test_report_single_pass(self):
+        """测试报告只遍历一次处方表"""
+        scans = []
+        iter_prescriptions = self.db.iter_prescriptions
+        
+        def counting_iter(*args, **kwargs):
+            scans.append(1)
+            return iter_prescriptions(*args, **kwargs)
+        
+        self.db.iter_prescriptions = counting_iter
+        report = self.stats.generate_report()
+        
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(report['symptom_analysis'], {'头痛': 2, '眩晕': 2, '乏力': 1, '食欲不振': 1})
+        self.assertEqual(report['seasonal_analysis']['冬季(12-2月)']['count'], 3)
+    
+    def test_monthly_comparison(self):
+        """测试按自然月对比"""
+        today = datetime.now()
+        last_year = f'{today.year - 1}年{today.month}月1日'
+        self.db.save_prescription({'patient_name': '王五', 'date': today.strftime('%Y-%m-01')})
+        self.db.save_prescription({'patient_name': '王五', 'date': last_year})
+        
+        comparison = self.stats.get_monthly_comparison()
+        self.assertEqual(len(comparison), 6)
+        self.assertEqual(comparison[0], {'month': today.strftime('%Y-%m'), 'count': 1})
+        self.assertEqual(len({c['month'] for c in comparison}), 6)
+        
+        comparison = self.stats.get_monthly_comparison(months=13)
+        self.assertEqual(comparison[12]['count'], 1)
+        self.assertEqual(comparison[12]['month'], f'{today.year - 1}-{today.month:02d}')
+    
+    def test_custom_aggregator(self):
+        """测试自定义聚合器"""
+        class FormulaAggregator(Aggregator):
+            name = 'formulas'
+            
+            def __init__(self):
+                self.names = set()
+            
+            def add(self, prescription):
+                self.names.add(prescription['formula_name'])
+            
+            def result(self):
+                return sorted(self.names)
+        
+        results = self.stats.run_aggregators([FormulaAggregator()])
+        
+        self.assertEqual(results, {'formulas': ['六味地黄丸', '四君子汤']})
+
+
+class TestServices(unittest.TestCase):
+    """测试服务注册表"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.services = ServiceRegistry(os.path.join(self.test_dir, 'test.db'))
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.services.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_lazy_singletons(self):
+        """测试服务首次使用时创建且只创建一次"""
+        self.assertFalse(self.services.created('db'))
+        
+        stats = self.services.stats
+        self.assertTrue(self.services.created('db'))
+        self.assertIs(self.services.get('stats'), stats)
+        self.assertIs(self.services.llm.db, self.services.db)
+        self.assertIs(stats.db, self.services.db)
+        self.assertFalse(self.services.created('ocr'))
+    
+    def test_register(self):
+        """测试替换服务和未注册的服务"""
+        self.services.register('excel', lambda services: 'custom')
+        self.assertEqual(self.services.excel, 'custom')
+        
+        with self.assertRaises(KeyError):
+            self.services.get('unknown')
+        with self.assertRaises(AttributeError):
+            self.services.unknown
+
+
+class TestHistoryModel(unittest.TestCase):
+    """测试历史记录列表数据"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.test_dir, 'test.db'))
+        self.db.save_prescriptions(
+            {'patient_name': f'患者{i}', 'formula_name': '四君子汤'} for i in range(5)
+        )
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_record_row(self):
+        """测试列表行只保留显示字段"""
+        row = record_row({'id': 3, 'patient_name': '张三', 'herbs': '人参 10g'})
+        self.assertEqual(row['record_id'], 3)
+        self.assertEqual(row['name_text'], '患者: 张三')
+        self.assertEqual(row['formula_text'], '方剂: 未命名')
+        self.assertNotIn('herbs', row)
+    
+    def test_paged_records(self):
+        """测试按游标分页加载"""
+        source = PagedRecords(self.db, page_size=2)
+        rows = source.reset()
+        self.assertEqual([row['name_text'] for row in rows], ['患者: 患者4', '患者: 患者3'])
+        self.assertTrue(source.has_more)
+        
+        rows += source.load_more()
+        rows += source.load_more()
+        self.assertEqual(len(rows), 5)
+        self.assertFalse(source.has_more)
+        self.assertEqual(source.load_more(), [])
+        
+        self.assertEqual(len(source.reset()), 2)
+    
+    def test_diff_rows(self):
+        """测试只替换变化的行"""
+        rows = [{'record_id': i} for i in range(5)]
+        self.assertIsNone(diff_rows(rows, list(rows)))
+        
+        narrowed = [rows[0], rows[1], rows[4]]
+        start, stop, replacement = diff_rows(rows, narrowed)
+        self.assertEqual((start, stop, replacement), (2, 4, []))
+        
+        updated = list(rows)
+        updated[2] = {'record_id': 9}
+        self.assertEqual(diff_rows(rows, updated), (2, 3, [{'record_id': 9}]))
+        
+        merged = list(rows)
+        merged[start:stop] = replacement
+        self.assertEqual(merged, narrowed)
+    
+    def test_search_controller(self):
+        """测试后台搜索、结果缓存和过期查询"""
+        delivered = []
+        done = threading.Event()
+        
+        def deliver(generation, keyword, rows):
+            delivered.append((generation, keyword, [row['record_id'] for row in rows]))
+            done.set()
+        
+        search = SearchController(self.db, deliver, limit=3)
+        generation = search.submit('四君子汤')
+        self.assertTrue(done.wait(5))
+        self.assertEqual(delivered[0][0], generation)
+        self.assertEqual(len(delivered[0][2]), 3)
+        
+        # 命中缓存时在提交时直接回调
+        search.submit(' 四君子汤 ')
+        self.assertEqual(len(delivered), 2)
+        self.assertEqual(delivered[1][2], delivered[0][2])
+        search.close()
+    
+    def test_search_controller_stale(self):
+        """测试新查询提交后旧查询被放弃"""
+        release = threading.Event()
+        delivered = []
+        done = threading.Event()
+        
+        class SlowSource:
+            def iter_search_prescriptions(self, keyword):
+                if keyword == '旧':
+                    release.wait(5)
+                yield {'id': 1 if keyword == '旧' else 2}
+        
+        def deliver(generation, keyword, rows):
+            delivered.append(keyword)
+            done.set()
+        
+        search = SearchController(SlowSource(), deliver)
+        search.submit('旧')
+        search.submit('新')
+        release.set()
+        
+        self.assertTrue(done.wait(5))
+        search.close(wait=True)
+        self.assertEqual(delivered, ['新'])
+    
+    def test_search_controller_error(self):
+        """测试查询出错时送达错误信息"""
+        delivered = []
+        done = threading.Event()
+        
+        class BrokenSource:
+            def iter_search_prescriptions(self, keyword):
+                raise RuntimeError('database is locked')
+                yield
+        
+        def deliver(generation, keyword, rows, error=None):
+            delivered.append((generation, keyword, rows, error))
+            done.set()
+        
+        search = SearchController(BrokenSource(), deliver)
+        generation = search.submit('张三')
+        
+        self.assertTrue(done.wait(5))
+        search.close(wait=True)
+        self.assertEqual(delivered, [(generation, '张三', None, 'database is locked')])
+
+
+class TestBatchImport(unittest.TestCase):
+    """测试批量识别并保存"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.test_dir, 'test.db'))
+        self.ocr = OCREngine()
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.test_dir, f'{i}.png')
+            open(path, 'wb').close()
+            self.paths.append(path)
+        self.paths.append(os.path.join(self.test_dir, 'missing.png'))
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+    
+    def test_import_images(self):
+        """测试识别结果逐张回调并跳过重复处方"""
+        progress = []
+        outcome = import_images(
+            self.ocr, self.db, self.paths,
+            on_result=lambda result, done: progress.append((done, result['path']))
+        )
+        
+        self.assertEqual(progress, list(enumerate(self.paths, 1)))
+        self.assertIsNone(outcome['error'])
+        self.assertFalse(outcome['cancelled'])
+        self.assertEqual(outcome['total'], 4)
+        self.assertEqual(outcome['saved'], self.db.get_statistics()['total'])
+        self.assertGreater(outcome['saved'], 0)
+        
+        again = import_images(self.ocr, self.db, self.paths)
+        self.assertEqual(again['saved'], 0)
+    
+    def test_import_images_cancel(self):
+        """测试取消后停止识别"""
+        cancel_event = threading.Event()
+        progress = []
+        
+        def on_result(result, done):
+            progress.append(done)
+            cancel_event.set()
+        
+        outcome = import_images(self.ocr, self.db, self.paths,
+                                on_result=on_result, cancel_event=cancel_event)
+        
+        self.assertEqual(progress, [1])
+        self.assertTrue(outcome['cancelled'])
+        self.assertEqual(outcome['saved'], 1)
 
 
 class TestIntegration(unittest.TestCase):
@@ -401,13 +1365,13 @@ class TestIntegration(unittest.TestCase):
         self.db = DatabaseManager(self.test_db_path)
         self.ocr = OCREngine()
         self.excel = ExcelExporter()
-        self.llm = LLMAPI()
-        # 使用同一个数据库路径
-        self.stats = StatisticsManager()
-        self.stats.db = self.db
+        # 使用同一个数据库
+        self.llm = LLMAPI(db=self.db)
+        self.stats = StatisticsManager(db=self.db)
     
     def tearDown(self):
         """测试后清理"""
+        self.db.close()
         if os.path.exists(self.test_db_path):
             os.remove(self.test_db_path)
         shutil.rmtree(self.test_dir, ignore_errors=True)
@@ -448,8 +1412,12 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestDatabaseManager))
     suite.addTests(loader.loadTestsFromTestCase(TestOCREngine))
     suite.addTests(loader.loadTestsFromTestCase(TestExcelExporter))
+    suite.addTests(loader.loadTestsFromTestCase(TestExportBackends))
     suite.addTests(loader.loadTestsFromTestCase(TestLLMAPI))
     suite.addTests(loader.loadTestsFromTestCase(TestStatisticsManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestServices))
+    suite.addTests(loader.loadTestsFromTestCase(TestHistoryModel))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchImport))
     suite.addTests(loader.loadTestsFromTestCase(TestIntegration))
     
     # 运行测试